@@ -0,0 +1,320 @@
+"""Differences of the baseline, before the model of lib/Metadata.py and DiffEngine: the rows are merged in nested
+dicts and getDiffObj compares and renders them in one pass, each block indented again by addTab at each level. The
+methods from fillArray to getDiffProperties are copied verbatim from lib/CompareEnv.py of the baseline commit
+7692923, to check that DiffRenderer prints the same differences and to measure it against them."""
+import re
+from typing import Dict, List
+
+from termcolor import colored
+
+from benchmarks.SyntheticCatalog import SyntheticCatalog
+
+# Granularities of the baseline, without the definitions and the space compared since
+GRANULARITIES = ("table", "col", "constraint", "constraintColumns", "indices", "indexColumns")
+
+
+class BaselineResult(object):
+    """Description of the rows of a granularity, like the cursor given to fillArray"""
+
+    def __init__(self, description: List):
+        self.description = description
+
+
+class BaselineEnvironment(object):
+    def __init__(self, name: str, color: str):
+        self.name = name
+        self.color = color
+
+
+class BaselineCompareEnv(object):
+    """The two environments of a synthetic catalog, compared by the code of the baseline"""
+
+    def __init__(self, catalog: SyntheticCatalog):
+        self.catalog = catalog
+        self.ignoreProperties: List[str] = []
+        self.env1 = BaselineEnvironment("ENV1", "green")
+        self.env2 = BaselineEnvironment("ENV2", "yellow")
+        self.ddl: Dict = {}
+        # fmt: off
+        self.colors = (
+            {"name": "cyan",    "attrs": []},
+            {"name": "magenta", "attrs": []},
+            {"name": "white",   "attrs": ["bold"]},
+            {"name": "white",   "attrs": ["bold"]},
+        )
+        # fmt: on
+
+    # Model of the baseline, getDiffObj changes it while it pairs the unnamed objects
+    def load(self):
+        self.ddl = {}
+        for envNumber in (1, 2):
+            rows = self.catalog.getAllRows(envNumber)
+            otherEnv = 1 if envNumber == 2 else 2
+            for granularity in GRANULARITIES:
+                res = BaselineResult(self.catalog.getDescription(granularity))
+                self.fillArray(rows[granularity], res, f"env{envNumber}", f"env{otherEnv}", granularity)
+
+    # Output of compare_env.py in the baseline, without the line break added by print
+    def render(self) -> str:
+        return self.getDiffObj(self.ddl, 0)
+
+    def fillArray(self, dbcColumns, res, envName, otherEnv, granularity):
+        for line in dbcColumns:
+            dbName = line["DatabaseName"].upper()
+            tbName = line["TableName"].upper()
+
+            if (
+                re.search("_P[0-9]{3}_S[0-9]{3}$", tbName)
+                or re.search("_[0-9]{8}$", tbName)
+                or tbName.endswith(("_1", "_2", "_ET"))
+            ):
+                continue
+
+            if dbName not in self.ddl:
+                self.ddl[dbName] = {"name": dbName, envName: True, otherEnv: False, "tables": {}}
+            else:
+                self.ddl[dbName][envName] = True
+
+            tables = self.ddl[dbName]["tables"]
+            if tbName not in tables:
+                tables[tbName] = {
+                    "name": tbName,
+                    envName: True,
+                    otherEnv: False,
+                    "columns": {},
+                    "constraints": {},
+                    "indices": {},
+                }
+            else:
+                tables[tbName][envName] = True
+
+            if granularity == "table":
+                tables[tbName][envName + "Properties"] = self.fillColProperties(line, res)
+
+            if granularity == "col":
+                colName = line["ColumnName"].upper()
+                columns = tables[tbName]["columns"]
+                if colName not in columns:
+                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
+                else:
+                    columns[colName][envName] = True
+
+                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
+
+            if granularity == "constraint":
+                constraintName = line["ConstraintName"].upper()
+                constraints = tables[tbName]["constraints"]
+                if constraintName not in constraints:
+                    constraints[constraintName] = {
+                        "name": constraintName,
+                        "columns": {},
+                        envName: True,
+                        otherEnv: False,
+                    }
+                else:
+                    constraints[constraintName][envName] = True
+
+                constraints[constraintName][envName + "Properties"] = self.fillColProperties(line, res)
+
+            if granularity == "constraintColumns":
+                constraintName = line["ConstraintName"].upper()
+                constraints = tables[tbName]["constraints"]
+                colName = line["ColumnName"].upper()
+                columns = constraints[constraintName]["columns"]
+                if colName not in columns:
+                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
+                else:
+                    columns[colName][envName] = True
+
+                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
+
+            if granularity == "indices":
+                indexCode = line["IndexCode"].upper()
+                indices = tables[tbName]["indices"]
+                if indexCode not in indices:
+                    indices[indexCode] = {"name": indexCode, "columns": {}, envName: True, otherEnv: False}
+                else:
+                    indices[indexCode][envName] = True
+
+                indices[indexCode][envName + "Properties"] = self.fillColProperties(line, res)
+
+            if granularity == "indexColumns":
+                indexCode = line["IndexCode"].upper()
+                indices = tables[tbName]["indices"]
+                colName = line["ColumnName"].upper()
+                columns = indices[indexCode]["columns"]
+                if colName not in columns:
+                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
+                else:
+                    columns[colName][envName] = True
+
+                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
+
+    def fillColProperties(self, line, res):
+        properties = {}
+        for colDesc in res.description:
+            colName = colDesc[0]
+            if colName not in ["DatabaseName", "TableName", "ColumnName", "IndexCode", "ConstraintName"]:
+                if type(line[colName]) is str:
+                    properties[colName] = line[colName].replace("\r", "\n")
+                else:
+                    properties[colName] = line[colName]
+
+        return properties
+
+    def delete_keys_from_dict(self, dict_del, lst_keys):
+        for k in lst_keys:
+            try:
+                del dict_del[k]
+            except KeyError:
+                pass
+        for v in dict_del.values():
+            if isinstance(v, dict):
+                self.delete_keys_from_dict(v, lst_keys)
+
+        return dict_del
+
+    def merge(self, a, b, path=None):
+        "merges b into a"
+        if path is None:
+            path = []
+        for key in b:
+            if key in a:
+                if isinstance(a[key], dict) and isinstance(b[key], dict):
+                    self.merge(a[key], b[key], path + [str(key)])
+                else:
+                    a[key] = b[key]
+            else:
+                a[key] = b[key]
+        return a
+
+    def mergeObjects(self, obj1, obj2):
+
+        if obj2["env1"]:
+            newObj2 = self.delete_keys_from_dict(obj2, ["env2"])
+        else:
+            newObj2 = self.delete_keys_from_dict(obj2, ["env1"])
+
+        return self.merge(obj1, newObj2)
+
+    def matchUnnamedObjects(self, objList, objType):
+        newObjectList = {}
+
+        for name, obj in objList.items():
+            if not (obj["env1"] and obj["env2"]):
+                trueId = ""
+                for name, col in obj["columns"].items():
+
+                    if objType == "indices":
+                        trueId += "#" + name
+                    elif objType == "constraints":
+                        if obj["env1"]:
+                            trueId += "#" + col["env1Properties"]["ChildKeyColumn"]
+                        else:
+                            trueId += "#" + col["env2Properties"]["ChildKeyColumn"]
+
+                if objType == "constraints":
+                    if obj["env1"]:
+                        childTable = obj["env1Properties"]["ChildDatabase"] + "." + obj["env1Properties"]["ChildTable"]
+                    else:
+                        childTable = obj["env2Properties"]["ChildDatabase"] + "." + obj["env2Properties"]["ChildTable"]
+
+                    trueId = childTable + trueId
+                obj["trueId"] = trueId
+                if trueId in newObjectList:
+
+                    newObjectList[trueId] = self.mergeObjects(obj, newObjectList[trueId])
+                    # pp.pprint(newObjectList[trueId])
+                else:
+                    newObjectList[trueId] = obj
+            else:
+                newObjectList[name] = obj
+
+        return newObjectList
+
+    # Add one tab to the beginning of each line
+    def addTab(self, string):
+        return "\t".join(string.splitlines(True))
+
+    def getDiffObj(self, objects, lvl):
+        diffObjs = ""
+        for name, obj in sorted(objects.items()):
+            # if obj['name'] == 'REF_TERRITORY' or obj['name'] == 'REF_TERRITORY':
+            #     pp.pprint(obj)
+
+            diffObj = ""
+            if not obj["env1"]:
+                diffObj = " not in " + colored(self.env1.name, self.env1.color)
+            elif not obj["env2"]:
+                diffObj = " not in " + colored(self.env2.name, self.env2.color)
+            else:
+                diffObjProperties = self.getDiffProperties(obj)
+                if diffObjProperties != "":
+                    diffObj = diffObjProperties
+                for k in obj.keys():
+                    if type(obj[k]) is dict and k != "env1Properties" and k != "env2Properties":
+                        if k == "constraints" or k == "indices":
+                            obj[k] = self.matchUnnamedObjects(obj[k], k)
+                        diffSubObjs = self.getDiffObj(obj[k], lvl + 1)
+                        if diffSubObjs != "":
+                            diffObj += self.addTab("\n" + k + diffSubObjs)
+
+            tableKind = ""
+
+            if "env1Properties" in obj:
+                if "TableKind" in obj["env1Properties"]:
+                    tableKind = obj["env1Properties"]["TableKind"]
+            if tableKind == "":
+                if "env2Properties" in obj:
+                    if "TableKind" in obj["env2Properties"]:
+                        tableKind = obj["env2Properties"]["TableKind"]
+            if tableKind != "":
+                objName = "(" + tableKind + ") " + obj["name"]
+            else:
+                objName = obj["name"]
+
+            if diffObj != "":
+                diffObjs += (
+                    "\n" + colored(objName, self.colors[lvl]["name"], attrs=self.colors[lvl]["attrs"]) + diffObj
+                )
+
+        if diffObjs != "" and lvl > 0:
+            return self.addTab(diffObjs)
+        elif diffObjs != "" and lvl == 0:
+            return diffObjs
+        else:
+            return ""
+
+    def getDiffProperties(self, obj):
+        if "env1Properties" not in obj:
+            return ""
+        diffObjProperties = ""
+        # pp.pprint(obj)
+        for propName, val1 in obj["env1Properties"].items():
+            if propName.lower() == "commentstring" and "comments" in self.ignoreProperties:
+                continue
+            if propName.lower() in self.ignoreProperties:
+                continue
+
+            if val1 is None:
+                val1 = "Null"
+
+            val2 = obj["env2Properties"][propName]
+            if val2 is None:
+                val2 = "Null"
+
+            if propName == "ColumnFormat":
+                if val1.upper() == "YYYY-MM-DD":
+                    val1 = "YY/MM/DD"
+                if val2.upper() == "YYYY-MM-DD":
+                    val2 = "YY/MM/DD"
+
+            if val1 != val2:
+                diffObjProperties += (
+                    "\n" + propName + " : " + colored(val1, self.env1.color) + " -> " + colored(val2, self.env2.color)
+                )
+
+        if diffObjProperties != "":
+            return self.addTab(diffObjProperties)
+        else:
+            return ""
@@ -0,0 +1,123 @@
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.SyntheticCatalog import VIEW_COLUMNS, SyntheticCatalog, fresh
+
+
+class FakeCursor(object):
+    """Cursor answering the DBC queries of CompareEnv from the rows of a synthetic catalog, with the execute,
+    description, fetchall and fetchmany of a teradatasql cursor. Each query waits latency seconds before its rows
+    are available, like the time a server spends to run it."""
+
+    def __init__(self, pool: "FakeConnectionPool"):
+        self.pool = pool
+        self.description: Optional[List[Tuple]] = None
+        self.rows: List[tuple] = []
+        self.position = 0
+
+    def execute(self, sql: str) -> "FakeCursor":
+        show = re.match(r'SHOW VIEW "(\w+)"\."(\w+)"', sql)
+        if show is not None:
+            time.sleep(self.pool.latency)
+            self.description = [("RequestText", None)]
+            self.rows = [(self.pool.getRequestText(show.group(1), show.group(2)),)]
+            self.position = 0
+            return self
+
+        view = re.search(r"FROM DBC\.(\w+)", sql, re.IGNORECASE)
+        dbList = re.search(r"where \w+ in \(([^)]*)\)", sql, re.IGNORECASE)
+        if view is None or view.group(1) not in VIEW_COLUMNS or dbList is None:
+            raise Exception(f"Query not simulated by the synthetic catalog: {sql}")
+
+        # The hashes of the definitions are selected from DBC.TablesV
+        viewName = "Definitions" if "DefinitionKind" in sql else view.group(1)
+        rows = []
+        for dbName in re.findall(r"'([^']*)'", dbList.group(1)):
+            rows += self.pool.getViewRows(dbName, viewName)
+        columns = VIEW_COLUMNS[viewName]
+        # Queries of the merge engine, with the logical database names and sorted by database and table
+        if "REGEXP_REPLACE" in sql:
+            dbColumns = [i for i, name in enumerate(columns) if name in ("DatabaseName", "ChildDatabase")]
+            rows = [
+                tuple(self.pool.logicalNames[value] if i in dbColumns else value for i, value in enumerate(row))
+                for row in rows
+            ]
+        if re.search(r"order by 1, 2", sql, re.IGNORECASE):
+            rows.sort(key=lambda row: (row[0], row[1]))
+
+        time.sleep(self.pool.latency)
+        self.description = [(name, None) for name in columns]
+        self.rows = rows
+        self.position = 0
+        return self
+
+    # Every value is a new object, like the values decoded by the driver
+    def fetchmany(self, size: int) -> List[List]:
+        rows = self.rows[self.position : self.position + size]
+        self.position += len(rows)
+        return [[fresh(value) for value in row] for row in rows]
+
+    def fetchall(self) -> List[List]:
+        return self.fetchmany(len(self.rows) - self.position)
+
+    def close(self):
+        self.rows = []
+
+
+class FakeConnection(object):
+    def __init__(self, pool: "FakeConnectionPool"):
+        self.pool = pool
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.pool)
+
+    def close(self):
+        pass
+
+
+class FakeConnectionPool(object):
+    """Replaces the ConnectionPool of CompareEnv to run the comparisons without a database. The rows of the catalog
+    are generated by database on the first query reading them."""
+
+    def __init__(self, catalog: SyntheticCatalog, latency: float = 0):
+        self.catalog = catalog
+        self.latency = latency
+        self.viewRows: Dict[str, Dict[str, List[tuple]]] = {}
+        self.lock = threading.Lock()
+        self.databases = {
+            catalog.getPhysicalName(envNumber, dbIndex): (envNumber, dbIndex)
+            for envNumber in (1, 2)
+            for dbIndex in range(catalog.databases)
+        }
+        self.logicalNames = {
+            physicalName: catalog.getDbNames()[dbIndex] for physicalName, (_, dbIndex) in self.databases.items()
+        }
+
+    # Generates the rows of all the databases, so that the generation is not measured with the queries
+    def generate(self):
+        for dbName in self.databases:
+            self.getViewRows(dbName, "TablesV")
+
+    def getViewRows(self, dbName: str, view: str) -> List[tuple]:
+        with self.lock:
+            if dbName not in self.viewRows:
+                if dbName not in self.databases:
+                    return []
+                self.viewRows[dbName] = self.catalog.getViewRows(*self.databases[dbName])
+            return self.viewRows[dbName][view]
+
+    def getRequestText(self, dbName: str, tbName: str) -> str:
+        envNumber, dbIndex = self.databases[dbName]
+        table = self.catalog.getTable(envNumber, dbIndex, int(tbName.split("_")[-1]))
+        return table["RequestText"] if table is not None else ""
+
+    def acquire(self, connectionStr: str) -> FakeConnection:
+        return FakeConnection(self)
+
+    def release(self, connectionStr: str, conn: FakeConnection):
+        pass
+
+    def clear(self):
+        pass
@@ -0,0 +1,301 @@
+import random
+import zlib
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from lib.CompareEnv import CompareEnv, Environment
+from lib.DatabaseConfig import ConfigFile, DatabaseConfig
+
+# fmt: off
+COLUMN_TYPES = (
+    # ColumnFormat, CharType
+    ("X(30)",       1),
+    ("X(255)",      1),
+    ("X(1)",        1),
+    ("-(10)9",      0),
+    ("-(19)9",      0),
+    ("-(16)9.99",   0),
+    ("YYYY-MM-DD",  0),
+    ("YYYY-MM-DDBHH:MI:SS.S(6)", 0),
+)
+
+DESCRIPTIONS = {
+    "table":             ("DatabaseName", "TableName", "TableKind", "ProtectionType", "JournalFlag", "CommentString",
+                          "PIColumnCount", "PartitioningLevels"),
+    "col":               ("DatabaseName", "TableName", "ColumnName", "ColumnFormat", "CharType", "Nullable",
+                          "DefaultValue", "UpperCaseFlag"),
+    "constraint":        ("DatabaseName", "TableName", "ConstraintName", "ChildDatabase", "IndexName", "ChildTable"),
+    "constraintColumns": ("DatabaseName", "TableName", "ConstraintName", "ColumnName", "ChildKeyColumn"),
+    "indices":           ("DatabaseName", "TableName", "IndexCode", "IndexName", "IndexNumber", "IndexType",
+                          "UniqueFlag"),
+    "indexColumns":      ("DatabaseName", "TableName", "IndexCode", "ColumnName", "ColumnPosition"),
+    "definition":        ("DatabaseName", "TableName", "DefinitionKind", "RequestText"),
+    "space":             ("DatabaseName", "TableName", "SpaceKind", "CurrentPerm", "AmpSkew", "HasStatistics"),
+}
+
+# Columns selected from each DBC view by the queries of CompareEnv
+VIEW_COLUMNS = {
+    "TablesV":          DESCRIPTIONS["table"],
+    "ColumnsV":         DESCRIPTIONS["col"],
+    "All_RI_ChildrenV": ("DatabaseName", "TableName", "ConstraintName", "ChildDatabase", "IndexName", "ChildTable",
+                         "IndexID", "ColumnName", "ChildKeyColumn"),
+    "IndicesV":         ("DatabaseName", "TableName", "IndexCode", "IndexName", "IndexNumber", "IndexType",
+                         "UniqueFlag", "ColumnName", "ColumnPosition"),
+    # Hashes of the definitions, computed by the server on DBC.TablesV
+    "Definitions":      DESCRIPTIONS["definition"],
+    # Space and statistics of the tables, aggregated by the server on DBC.TableSizeV and DBC.StatsV
+    "TableSizeV":       DESCRIPTIONS["space"],
+}
+# fmt: on
+SPACE_COLUMNS = DESCRIPTIONS["space"][3:]
+
+
+# The driver decodes every value in a new string object, the catalog does the same so that the models are measured
+# on realistic rows
+def fresh(value):
+    return value.encode("utf8").decode("utf8") if isinstance(value, str) else value
+
+
+class SyntheticCatalog(object):
+    """Deterministic DBC result sets of two environments of the same app. The second environment drifts from the
+    first one: tables and columns are dropped or added and some properties change, at driftRate."""
+
+    def __init__(
+        self,
+        databases: int = 2,
+        tables: int = 1000,
+        columns: int = 50,
+        indices: int = 2,
+        foreignKeys: int = 1,
+        driftRate: float = 0.01,
+        seed: int = 0,
+    ):
+        self.databases = databases
+        self.tables = tables
+        self.columns = columns
+        self.indices = indices
+        self.foreignKeys = foreignKeys
+        self.driftRate = driftRate
+        self.seed = seed
+
+    @classmethod
+    def forColumnCount(cls, columnCount: int, **kwargs) -> "SyntheticCatalog":
+        columns = kwargs.pop("columns", 50)
+        databases = kwargs.pop("databases", 2)
+        tables = max(1, columnCount // (columns * databases))
+        return cls(databases=databases, tables=tables, columns=columns, **kwargs)
+
+    def getDbNames(self) -> List[str]:
+        return [f"DB{i:02d}" for i in range(self.databases)]
+
+    def getDescription(self, granularity: str):
+        return [(name, None) for name in DESCRIPTIONS[granularity]]
+
+    def getConfig(self) -> DatabaseConfig:
+        conf = {
+            "app": "BENCH",
+            "databaseNamePattern": "${app}_${db}_${env}",
+            "servers": [
+                {
+                    "name": "bench",
+                    "host": "bench",
+                    "defaultUser": "bench",
+                    "defaultPassword": "bench",
+                    "environments": [{"name": "ENV1"}, {"name": "ENV2"}],
+                }
+            ],
+        }
+        return DatabaseConfig(ConfigFile(**conf))
+
+    def getCompareEnv(self, ignoreList: Optional[List[str]] = None) -> CompareEnv:
+        # Every query is measured, the space too
+        compareEnv = CompareEnv(self.getConfig(), ignoreList or [], compareSpace=True)
+        compareEnv.envNames = ["ENV1", "ENV2"]
+        compareEnv.dbSuffixList = self.getDbNames()
+        compareEnv.env1 = Environment("ENV1", compareEnv.dbCredentials, 1, "green", compareEnv.dbSuffixList)
+        compareEnv.env2 = Environment("ENV2", compareEnv.dbCredentials, 2, "yellow", compareEnv.dbSuffixList)
+        compareEnv.envs = [compareEnv.env1, compareEnv.env2]
+        return compareEnv
+
+    # Definition of one table in one environment, or None if the table is not in the environment
+    def getTable(self, envNumber: int, dbIndex: int, tbIndex: int) -> Optional[Dict]:
+        rnd = random.Random(f"{self.seed}:{dbIndex}:{tbIndex}")
+        drift = random.Random(f"{self.seed}:{dbIndex}:{tbIndex}:drift")
+        isDrifted = envNumber == 2
+
+        if isDrifted and drift.random() < self.driftRate:
+            return None
+
+        dbName = self.getDbNames()[dbIndex]
+        tbName = f"T_{dbIndex:02d}_{tbIndex:06d}"
+        isView = rnd.random() < 0.1
+        colNames = [f"{'ID' if colIndex == 0 else 'COL'}_{colIndex:03d}" for colIndex in range(self.columns)]
+        columns = []
+        for colIndex in range(self.columns):
+            colFormat, charType = COLUMN_TYPES[rnd.randrange(len(COLUMN_TYPES))]
+            column = {
+                "ColumnName": colNames[colIndex],
+                "ColumnFormat": colFormat,
+                "CharType": charType,
+                "Nullable": "N" if colIndex == 0 or rnd.random() < 0.3 else "Y",
+                "DefaultValue": None if rnd.random() < 0.95 else "0",
+                "UpperCaseFlag": "N" if charType else "C",
+            }
+            if isDrifted and drift.random() < self.driftRate:
+                if drift.random() < 0.5:
+                    continue
+                column["Nullable"] = "Y" if column["Nullable"] == "N" else "N"
+            columns.append(column)
+        if isDrifted and drift.random() < self.driftRate:
+            columns.append(dict(columns[-1], ColumnName="COL_NEW"))
+
+        table = {
+            "DatabaseName": dbName,
+            "TableName": tbName,
+            "TableKind": "V" if isView else "T",
+            "ProtectionType": "F",
+            "JournalFlag": "NN",
+            "CommentString": None if rnd.random() < 0.8 else f"Table {tbName} of {dbName}",
+            "PIColumnCount": 0 if isView else 1,
+            "PartitioningLevels": 0,
+            "CurrentPerm": 0.0 if isView else float(rnd.randrange(1, 1000) * 2**20),
+            "AmpSkew": Decimal("1.00") if isView else Decimal(rnd.randrange(100, 150)) / 100,
+            "HasStatistics": "N" if isView else "Y",
+            "columns": columns,
+            "indices": [],
+            "foreignKeys": [],
+        }
+        if isDrifted and drift.random() < self.driftRate:
+            table["CurrentPerm"] *= 50
+        if isDrifted and drift.random() < self.driftRate:
+            table["HasStatistics"] = "N"
+        if isView:
+            # Text returned by SHOW VIEW, with the physical database names, and the hash of the normalized text
+            # returned by the query of the definitions
+            physicalName = self.getPhysicalName(envNumber, dbIndex)
+            selectList = "\n  , ".join(column["ColumnName"] for column in columns)
+            text = f"REPLACE VIEW {physicalName}.{tbName} AS\nLOCKING ROW FOR ACCESS\nSELECT\n    {selectList}\n"
+            text += f"FROM {physicalName}.T_{dbIndex:02d}_{0:06d}"
+            if isDrifted and drift.random() < self.driftRate:
+                text += "\nWHERE ID_000 IS NOT NULL"
+            table["RequestText"] = text + ";"
+            normalized = " ".join(text.replace(physicalName, dbName).split()).upper() + ";"
+            table["DefinitionHash"] = f"{len(normalized)} chars #{zlib.crc32(normalized.encode()):08x}"
+            return table
+
+        indexNumbers = [1] + [4 * (i + 1) for i in range(self.indices - 1)]
+        for indexNumber in indexNumbers:
+            indexType = "P" if indexNumber == 1 else "S"
+            indexColumns = colNames[:1] if indexNumber == 1 else rnd.sample(colNames, min(2, len(colNames)))
+            table["indices"].append(
+                {
+                    "IndexCode": f"{tbName}_{indexType}_{indexNumber}",
+                    "IndexName": None,
+                    "IndexNumber": indexNumber,
+                    "IndexType": indexType,
+                    "UniqueFlag": "Y" if indexNumber == 1 else "N",
+                    "columns": indexColumns,
+                }
+            )
+
+        # Foreign keys of child tables referencing the table, unnamed so that their numbers differ between the
+        # environments like on a real system
+        for fkIndex in range(self.foreignKeys if tbIndex + 1 < self.tables else 0):
+            childIndex = rnd.randrange(tbIndex + 1, self.tables)
+            indexId = rnd.randrange(1, 64)
+            if isDrifted and drift.random() < 0.5:
+                indexId = drift.randrange(64, 128)
+            childTable = f"T_{dbIndex:02d}_{childIndex:06d}"
+            table["foreignKeys"].append(
+                {
+                    "ConstraintName": f"{dbName}_{childTable}_{indexId}",
+                    "IndexID": indexId,
+                    "ChildDatabase": dbName,
+                    "IndexName": None,
+                    "ChildTable": childTable,
+                    "columns": [(colNames[0], f"{tbName}_{colNames[0]}")],
+                }
+            )
+
+        return table
+
+    # Rows of every granularity, as returned by CompareEnv.rows2Obj, for a slice of the tables of each database
+    def getAllRows(self, envNumber: int, first: int = 0, count: Optional[int] = None) -> Dict[str, List[Dict]]:
+        rows: Dict[str, List[Dict]] = {granularity: [] for granularity in DESCRIPTIONS}
+        last = self.tables if count is None else min(self.tables, first + count)
+        for dbIndex in range(self.databases):
+            for tbIndex in range(first, last):
+                table = self.getTable(envNumber, dbIndex, tbIndex)
+                if table is None:
+                    continue
+                key = {"DatabaseName": table["DatabaseName"], "TableName": table["TableName"]}
+
+                rows["table"].append(dict(key, **{name: table[name] for name in DESCRIPTIONS["table"][2:]}))
+                rows["col"].extend(dict(key, **column) for column in table["columns"])
+                if "RequestText" in table:
+                    rows["definition"].append(dict(key, DefinitionKind="VIEW", RequestText=table["DefinitionHash"]))
+                else:
+                    rows["space"].append(dict(key, SpaceKind="PERM", **{name: table[name] for name in SPACE_COLUMNS}))
+                # With the signature added by CompareEnv.fillResult to the rows of the foreign keys and indices
+                for index in table["indices"]:
+                    header = dict(key, **{name: index[name] for name in DESCRIPTIONS["indices"][2:]})
+                    columnRows = [
+                        dict(key, IndexCode=index["IndexCode"], ColumnName=colName, ColumnPosition=position + 1)
+                        for position, colName in enumerate(index["columns"])
+                    ]
+                    signature = CompareEnv.getIndexSignature([dict(header, **row) for row in columnRows])
+                    rows["indices"].append(dict(header, Signature=signature))
+                    rows["indexColumns"].extend(dict(row, Signature=signature) for row in columnRows)
+                for fk in table["foreignKeys"]:
+                    header = dict(key, **{name: fk[name] for name in DESCRIPTIONS["constraint"][2:]})
+                    columnRows = [
+                        dict(key, ConstraintName=fk["ConstraintName"], ColumnName=colName, ChildKeyColumn=childColName)
+                        for colName, childColName in fk["columns"]
+                    ]
+                    signature = CompareEnv.getConstraintSignature([dict(header, **row) for row in columnRows])
+                    rows["constraint"].append(dict(header, Signature=signature))
+                    rows["constraintColumns"].extend(dict(row, Signature=signature) for row in columnRows)
+
+        return {
+            granularity: [{name: fresh(value) for name, value in row.items()} for row in granularityRows]
+            for granularity, granularityRows in rows.items()
+        }
+
+    def getRows(self, envNumber: int, granularity: str, first: int = 0, count: Optional[int] = None) -> List[Dict]:
+        return self.getAllRows(envNumber, first, count)[granularity]
+
+    # Physical name of a database, with the databaseNamePattern of getConfig
+    def getPhysicalName(self, envNumber: int, dbIndex: int) -> str:
+        return f"BENCH_{self.getDbNames()[dbIndex]}_ENV{envNumber}"
+
+    # Rows of each DBC view for one database of one environment, as tuples in the order of VIEW_COLUMNS, with the
+    # physical database names and the unnamed foreign keys returned by the server
+    def getViewRows(self, envNumber: int, dbIndex: int) -> Dict[str, List[tuple]]:
+        rows: Dict[str, List[tuple]] = {view: [] for view in VIEW_COLUMNS}
+        dbName = self.getPhysicalName(envNumber, dbIndex)
+        for tbIndex in range(self.tables):
+            table = self.getTable(envNumber, dbIndex, tbIndex)
+            if table is None:
+                continue
+            tbName = table["TableName"]
+
+            rows["TablesV"].append((dbName, tbName) + tuple(table[name] for name in VIEW_COLUMNS["TablesV"][2:]))
+            if "RequestText" in table:
+                rows["Definitions"].append((dbName, tbName, "VIEW", table["DefinitionHash"]))
+            else:
+                rows["TableSizeV"].append((dbName, tbName, "PERM") + tuple(table[name] for name in SPACE_COLUMNS))
+            for column in table["columns"]:
+                rows["ColumnsV"].append(
+                    (dbName, tbName) + tuple(column[name] for name in VIEW_COLUMNS["ColumnsV"][2:])
+                )
+            for index in table["indices"]:
+                header = (index["IndexCode"], index["IndexName"], index["IndexNumber"], index["IndexType"])
+                for position, colName in enumerate(index["columns"]):
+                    rows["IndicesV"].append((dbName, tbName) + header + (index["UniqueFlag"], colName, position + 1))
+            for fk in table["foreignKeys"]:
+                for colName, childColName in fk["columns"]:
+                    rows["All_RI_ChildrenV"].append(
+                        (dbName, tbName, None, dbName, None, fk["ChildTable"], fk["IndexID"], colName, childColName)
+                    )
+
+        return rows
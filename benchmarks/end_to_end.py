@@ -0,0 +1,147 @@
+"""Time and peak memory of each stage of a comparison, from the DBC queries to the rendered differences, on
+synthetic catalogs answered by a fake cursor:
+
+- fetch decode: queries, rows decoded in dicts and database names mapped (CompareEnv.submitQueries)
+- tree build: rows merged in the model (CompareEnv.fillResult)
+- definitions: texts of the views whose hashes differ (CompareEnv.fetchDefinitions)
+- diff: differences of the model (CompareEnv.getDifferences)
+- render: colored tree of the differences (DiffRenderer)
+
+    python -m benchmarks.end_to_end [--columns 1000 100000 1000000] [--databases 2] [--columns-per-table 50]
+                                    [--indices 2] [--foreign-keys 1] [--drift-rate 0.01] [--latency 0.05]
+                                    [--max-sessions 2]
+"""
+import argparse
+import gc
+import io
+import time
+import tracemalloc
+from typing import Dict, List, Tuple, cast
+
+from benchmarks.FakeConnectionPool import FakeConnectionPool
+from benchmarks.SyntheticCatalog import SyntheticCatalog
+from lib.ConnectionPool import ConnectionPool
+from lib.DiffRenderer import DiffRenderer
+
+STAGES = ("fetch decode", "tree build", "definitions", "diff", "render")
+
+
+# Stream of the renderer, only counting the characters written
+class NullStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        return len(text)
+
+
+class StageClock(object):
+    """Time of each stage and, when traced, peak of the memory allocated during the stage"""
+
+    def __init__(self, traced: bool):
+        self.traced = traced
+        self.times: Dict[str, float] = {}
+        self.peaks: Dict[str, int] = {}
+        self.stage = ""
+        self.start = 0.0
+        # Memory allocated before the stage
+        self.base = 0
+
+    def begin(self, stage: str):
+        gc.collect()
+        self.stage = stage
+        if self.traced:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+
+    def end(self):
+        self.times[self.stage] = time.perf_counter() - self.start
+        if self.traced:
+            self.peaks[self.stage] = tracemalloc.get_traced_memory()[1] - self.base
+
+
+def runStages(catalog: SyntheticCatalog, args, traced: bool) -> Tuple[StageClock, int, int]:
+    pool = FakeConnectionPool(catalog, args.latency)
+    pool.generate()
+
+    compareEnv = catalog.getCompareEnv()
+    # The fake pool has the acquire and release of a ConnectionPool, with fake connections
+    compareEnv.connectionPool = cast(ConnectionPool, pool)
+    compareEnv.maxSessions = args.max_sessions
+    compareEnv.showProgress = False
+
+    clock = StageClock(traced)
+    if traced:
+        tracemalloc.start()
+
+    clock.begin("fetch decode")
+    compareEnv.openEnvironments()
+    results: List = [(env, query, future.result()) for env, query, future in compareEnv.submitQueries()]
+    clock.end()
+    rowCount = sum(len(res.rows) for env, query, res in results)
+
+    clock.begin("tree build")
+    # Like extractMetadata, the rows of a result are freed once they are in the model
+    results.reverse()
+    while results:
+        compareEnv.fillResult(*results.pop())
+    clock.end()
+
+    clock.begin("definitions")
+    compareEnv.fetchDefinitions()
+    compareEnv.closeExecutors()
+    clock.end()
+
+    clock.begin("diff")
+    diffs = compareEnv.getDifferences()
+    clock.end()
+
+    clock.begin("render")
+    stream = NullStream()
+    DiffRenderer(compareEnv, stream).render(diffs)
+    clock.end()
+
+    if traced:
+        tracemalloc.stop()
+    for env in compareEnv.envs:
+        env.close()
+    return clock, rowCount, stream.size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--columns", type=int, nargs="+", default=[1000, 100000, 1000000], help="Columns of each environment"
+    )
+    parser.add_argument("--databases", type=int, default=2, help="Databases of each environment")
+    parser.add_argument("--columns-per-table", type=int, default=50, help="Columns of each table")
+    parser.add_argument("--indices", type=int, default=2, help="Indices of each table, the primary index included")
+    parser.add_argument("--foreign-keys", type=int, default=1, help="Foreign keys referencing each table")
+    parser.add_argument("--drift-rate", type=float, default=0.01, help="Share of the objects that differ")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds spent by the server on each query")
+    parser.add_argument("--max-sessions", type=int, default=2, help="Sessions of the server, shared by the two envs")
+    args = parser.parse_args()
+
+    for columns in args.columns:
+        catalog = SyntheticCatalog.forColumnCount(
+            columns,
+            databases=args.databases,
+            columns=args.columns_per_table,
+            indices=args.indices,
+            foreignKeys=args.foreign_keys,
+            driftRate=args.drift_rate,
+        )
+        # The times are measured without tracemalloc, which slows the allocations down
+        clock, rowCount, outputSize = runStages(catalog, args, False)
+        memory, _, _ = runStages(catalog, args, True)
+
+        print(
+            f"{columns} columns: {catalog.databases} databases x {catalog.tables} tables x {catalog.columns} columns, "
+            f"{rowCount} rows fetched, {outputSize} characters of differences"
+        )
+        for stage in STAGES:
+            print(f"    {stage:<13} time: {clock.times[stage]:7.2f} s   peak: {memory.peaks[stage] / 2**20:8.1f} MiB")
+        print(f"    {'total':<13} time: {sum(clock.times.values()):7.2f} s")
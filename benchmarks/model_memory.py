@@ -0,0 +1,112 @@
+"""Memory held by the metadata model of CompareEnv, compared with the former dict based model, on a synthetic catalog.
+
+    python -m benchmarks.model_memory [--columns 1000000] [--batch-tables 500]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.SyntheticCatalog import SyntheticCatalog
+from lib.CompareEnv import CompareEnv, QueryResult
+
+GRANULARITIES = ("table", "col", "indices", "indexColumns", "constraint", "constraintColumns")
+
+
+# Former model: one dict per object, with its flags and a dict of properties per environment
+def legacyFillColProperties(line, res):
+    properties = {}
+    for colDesc in res.description:
+        colName = colDesc[0]
+        if colName not in ["DatabaseName", "TableName", "ColumnName", "IndexCode", "ConstraintName"]:
+            if type(line[colName]) is str:
+                properties[colName] = line[colName].replace("\r", "\n")
+            else:
+                properties[colName] = line[colName]
+
+    return properties
+
+
+def legacyFillChild(children, name, envName, otherEnv, childKeys=()):
+    if name not in children:
+        children[name] = {"name": name, envName: True, otherEnv: False, **{key: {} for key in childKeys}}
+    else:
+        children[name][envName] = True
+    return children[name]
+
+
+def legacyFillArray(ddl, dbcColumns, res, envName, otherEnv, granularity):
+    for line in dbcColumns:
+        dbName = line["DatabaseName"].upper()
+        tbName = line["TableName"].upper()
+
+        database = legacyFillChild(ddl, dbName, envName, otherEnv, ("tables",))
+        table = legacyFillChild(database["tables"], tbName, envName, otherEnv, ("columns", "constraints", "indices"))
+
+        if granularity == "table":
+            obj = table
+        elif granularity == "col":
+            obj = legacyFillChild(table["columns"], line["ColumnName"].upper(), envName, otherEnv)
+        elif granularity == "constraint":
+            obj = legacyFillChild(
+                table["constraints"], line["ConstraintName"].upper(), envName, otherEnv, ("columns",)
+            )
+        elif granularity == "constraintColumns":
+            constraint = table["constraints"][line["ConstraintName"].upper()]
+            obj = legacyFillChild(constraint["columns"], line["ColumnName"].upper(), envName, otherEnv)
+        elif granularity == "indices":
+            obj = legacyFillChild(table["indices"], line["IndexCode"].upper(), envName, otherEnv, ("columns",))
+        else:
+            index = table["indices"][line["IndexCode"].upper()]
+            obj = legacyFillChild(index["columns"], line["ColumnName"].upper(), envName, otherEnv)
+
+        obj[envName + "Properties"] = legacyFillColProperties(line, res)
+
+
+def build(catalog: SyntheticCatalog, compareEnv: CompareEnv, legacy: bool, batchTables: int):
+    legacyDdl = {}
+    for first in range(0, catalog.tables, batchTables):
+        for envNumber in (1, 2):
+            envName, otherEnv = f"env{envNumber}", f"env{3 - envNumber}"
+            allRows = catalog.getAllRows(envNumber, first, batchTables)
+            for granularity in GRANULARITIES:
+                res = QueryResult(catalog.getDescription(granularity), allRows.pop(granularity))
+                if legacy:
+                    legacyFillArray(legacyDdl, res.rows, res, envName, otherEnv, granularity)
+                else:
+                    compareEnv.fillArray(res.rows, res.description, envNumber - 1, granularity)
+                del res
+
+    return legacyDdl if legacy else compareEnv.ddl
+
+
+def measure(catalog: SyntheticCatalog, legacy: bool, batchTables: int):
+    compareEnv = catalog.getCompareEnv()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = build(catalog, compareEnv, legacy, batchTables)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+    return current, peak, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=1000000, help="Number of columns of each environment")
+    parser.add_argument("--batch-tables", type=int, default=500, help="Tables of each database generated at once")
+    args = parser.parse_args()
+
+    catalog = SyntheticCatalog.forColumnCount(args.columns)
+    print(f"{catalog.databases} databases x {catalog.tables} tables x {catalog.columns} columns, 2 environments")
+
+    results = {}
+    for name, legacy in (("dict model", True), ("slotted model", False)):
+        current, peak, elapsed = measure(catalog, legacy, args.batch_tables)
+        results[name] = current
+        print(f"{name:<14} held: {current / 2**20:8.1f} MiB   peak: {peak / 2**20:8.1f} MiB   build: {elapsed:6.1f} s")
+
+    print(f"reduction: {1 - results['slotted model'] / results['dict model']:.0%}")
@@ -0,0 +1,107 @@
+"""Time and memory of the computation of the differences (DiffEngine, in the main process and in a pool of
+forked processes) and of their rendering, on synthetic catalogs. The rendering is measured against the baseline
+(getDiffObj, which compares and renders the nested dicts of its model in one pass, see BaselineCompareEnv), on
+the objects the baseline compares, and its output is checked to be the same.
+
+    python -m benchmarks.render_diff [--columns 10000 100000] [--drift-rate 0.05] [--processes 4]
+"""
+import argparse
+import gc
+import io
+import time
+import tracemalloc
+from typing import Callable, Optional, Sequence
+
+from benchmarks.BaselineCompareEnv import GRANULARITIES, BaselineCompareEnv
+from benchmarks.SyntheticCatalog import SyntheticCatalog
+from lib.CompareEnv import CompareEnv
+from lib.DiffRenderer import DiffRenderer
+
+
+# Stream of the renderer, only counting the characters written
+class NullStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        return len(text)
+
+
+def buildModel(catalog: SyntheticCatalog, granularities: Optional[Sequence[str]] = None) -> CompareEnv:
+    compareEnv = catalog.getCompareEnv()
+    for envNumber in (1, 2):
+        for granularity, rows in catalog.getAllRows(envNumber).items():
+            if granularities is None or granularity in granularities:
+                compareEnv.fillArray(rows, catalog.getDescription(granularity), envNumber - 1, granularity)
+    return compareEnv
+
+
+# Time of run, then the peak of the memory it allocates, measured again as tracemalloc slows the allocations down.
+# prepare is called before each run, out of the measure.
+def measure(run: Callable, prepare: Callable = lambda: None):
+    prepare()
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+
+    prepare()
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def render(compareEnv: CompareEnv, processes: int = 1) -> str:
+    compareEnv.diffProcesses = processes
+    output = io.StringIO()
+    DiffRenderer(compareEnv, output).render(compareEnv.getDifferences())
+    return output.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, nargs="+", default=[10000, 100000], help="Columns of each environment")
+    parser.add_argument("--drift-rate", type=float, default=0.05, help="Share of the objects that differ")
+    parser.add_argument("--processes", type=int, default=4, help="Processes computing the differences")
+    args = parser.parse_args()
+
+    for columns in args.columns:
+        catalog = SyntheticCatalog.forColumnCount(columns, driftRate=args.drift_rate)
+        compareEnv = buildModel(catalog)
+
+        # The model is not changed by the comparison: a second one gives the same output
+        expected = render(compareEnv)
+        lines = expected.count("\n")
+        identical = render(compareEnv) == expected and render(compareEnv, args.processes) == expected
+        print(f"{columns} columns, {lines} lines of differences, identical output: {identical}")
+
+        for processes in (1, args.processes):
+            compareEnv.diffProcesses = processes
+            elapsed, peak = measure(compareEnv.getDifferences)
+            print(f"    diff ({processes:2d} processes) time: {elapsed:7.2f} s   peak: {peak / 2**20:8.1f} MiB")
+
+        # The baseline only compares the tables, columns, foreign keys and indices
+        baseline = BaselineCompareEnv(catalog)
+        baseline.load()
+        baselineEnv = buildModel(catalog, GRANULARITIES)
+        baselineEnv.diffProcesses = 1
+        sameAsBaseline = render(baselineEnv) == baseline.render()
+        print(f"    objects of the baseline, same output as the baseline: {sameAsBaseline}")
+
+        diffs = baselineEnv.getDifferences()
+        for name, run, prepare in (
+            ("baseline getDiffObj", baseline.render, baseline.load),
+            (
+                "diff + DiffRenderer",
+                lambda: DiffRenderer(baselineEnv, NullStream()).render(baselineEnv.getDifferences()),
+                lambda: None,
+            ),
+            ("DiffRenderer", lambda: DiffRenderer(baselineEnv, NullStream()).render(diffs), lambda: None),
+        ):
+            elapsed, peak = measure(run, prepare)
+            print(f"    {name:<22} time: {elapsed:7.2f} s   peak: {peak / 2**20:8.1f} MiB")
@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from compare_env import readAcceptedDifferences
+from lib.AcceptedIndex import AcceptedIndex
+from lib.CompareEnv import CompareEnv, Environment
+from lib.ConnectionPool import ConnectionPool
+from lib.DatabaseConfig import AcceptedDifference, BatchApp, BatchJob, DatabaseConfig
+from lib.DiffRenderer import DiffRenderer
+from lib.JsonlRenderer import JsonlRenderer
+from lib.MetadataCache import MetadataCache
+
+
+class Catalog(object):
+    """Metadata of one environment of an application, extracted once into the cache of the batch for all the pairs
+    comparing it, and dropped from the cache after the last one"""
+
+    def __init__(self, app: BatchApp, appConfig: DatabaseConfig, envName: str):
+        self.app = app
+        self.appConfig = appConfig
+        self.envName = envName
+        self.host = appConfig.getCredentials(envName)[0].host
+        # Pairs comparing the catalog that are not compared yet
+        self.pairCount = 0
+        # Physical names of the databases, the keys of the catalog in the cache
+        self.dbNames: List[str] = []
+        self.future: Optional[Future] = None
+
+
+class Pair(object):
+    def __init__(self, app: BatchApp, catalogs: Tuple[Catalog, Catalog], accepted: Optional[List[AcceptedDifference]]):
+        self.app = app
+        self.catalogs = catalogs
+        self.accepted = accepted
+        self.label = f"{app.app} {catalogs[0].envName}/{catalogs[1].envName}"
+
+    def isReady(self) -> bool:
+        return all(catalog.future is not None and catalog.future.done() for catalog in self.catalogs)
+
+
+class BatchRunner(object):
+    """Compares the environment pairs of several applications in one run. The sessions of each server are shared by
+    all the comparisons, each catalog is extracted once, by the executor of its host, and a pair is compared as soon
+    as its two catalogs are extracted, while the extraction of the next ones goes on."""
+
+    def __init__(self, dbCredentials: DatabaseConfig, job: BatchJob, args):
+        self.dbCredentials = dbCredentials
+        self.args = args
+        self.ignoreList = list(map(str.lower, (args.ignore_objects or "").split(",")))
+        self.ignoreProperties = list(map(str.lower, (args.ignore_properties or "").split(",")))
+        self.outputDir = Path(args.output_dir)
+        # The catalogs are kept for the whole run, until their last pair is compared
+        self.cache = MetadataCache(float("inf"))
+        self.pool = ConnectionPool()
+        self.catalogs: Dict[Tuple[str, str], Catalog] = {}
+        self.pairs: List[Pair] = []
+
+        for app in job.apps:
+            appConfig = DatabaseConfig(
+                dbCredentials.conf.copy(
+                    update={
+                        "app": app.app,
+                        "databaseNamePattern": app.databaseNamePattern or dbCredentials.conf.databaseNamePattern,
+                    }
+                )
+            )
+            accepted = readAcceptedDifferences(app.accepted) if app.accepted else None
+            for env1, env2 in app.pairs if app.pairs is not None else job.pairs:
+                catalogs = (self.getCatalog(app, appConfig, env1), self.getCatalog(app, appConfig, env2))
+                for catalog in catalogs:
+                    catalog.pairCount += 1
+                self.pairs.append(Pair(app, catalogs, accepted))
+
+        # Sessions opened at the same time on each host, by server name in the job file. The extractions and the
+        # texts of the definitions fetched by the comparisons take a slot of their host for each query.
+        self.hostSessions: Dict[str, int] = {}
+        for server in dbCredentials.conf.servers:
+            sessions = job.maxSessions.get(server.name)
+            self.hostSessions[server.host] = sessions if sessions is not None else args.max_sessions
+        self.hostSlots: Dict[str, threading.Semaphore] = {
+            host: threading.BoundedSemaphore(sessions) for host, sessions in self.hostSessions.items()
+        }
+
+    def getCatalog(self, app: BatchApp, appConfig: DatabaseConfig, envName: str) -> Catalog:
+        if (app.app, envName) not in self.catalogs:
+            self.catalogs[(app.app, envName)] = Catalog(app, appConfig, envName)
+        return self.catalogs[(app.app, envName)]
+
+    # Compare every pair, returns the exit code
+    def run(self) -> int:
+        self.outputDir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        executors = {host: ThreadPoolExecutor(max_workers=sessions) for host, sessions in self.hostSessions.items()}
+        failures = 0
+        try:
+            # Submitted in the order of their first pair, so that the first pairs are ready first
+            for pair in self.pairs:
+                for catalog in pair.catalogs:
+                    if catalog.future is None:
+                        catalog.future = executors[catalog.host].submit(self.extractCatalog, catalog)
+
+            pending = list(self.pairs)
+            while pending:
+                pair = next((pair for pair in pending if pair.isReady()), None)
+                if pair is None:
+                    futures = [catalog.future for pair in pending for catalog in pair.catalogs]
+                    wait([future for future in futures if future is not None], return_when=FIRST_COMPLETED)
+                    continue
+
+                pending.remove(pair)
+                if not self.comparePair(pair):
+                    failures += 1
+                for catalog in pair.catalogs:
+                    catalog.pairCount -= 1
+                    if catalog.pairCount == 0:
+                        self.dropCatalog(catalog)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(cancel_futures=True)
+            self.pool.clear()
+
+        extracted = [
+            catalog for catalog in self.catalogs.values() if catalog.future and not catalog.future.exception()
+        ]
+        print(
+            f"{len(self.pairs) - failures} of {len(self.pairs)} pairs compared, {len(extracted)} of "
+            f"{len(self.catalogs)} catalogs extracted in {time.perf_counter() - start:.1f} s"
+        )
+        return 1 if failures else 0
+
+    # Run the queries of the catalog into the cache, on one session of its host
+    def extractCatalog(self, catalog: Catalog):
+        compareEnv = CompareEnv(catalog.appConfig, self.ignoreList, self.args.compare_space)
+        compareEnv.cache = self.cache
+        env = Environment(catalog.envName, catalog.appConfig, 1, compareEnv.envColors[0], catalog.app.databases)
+        env.pool = self.pool
+        env.hostSlots = self.hostSlots[env.host]
+        catalog.dbNames = list(env.dbMap.keys())
+        try:
+            for query in compareEnv.queries:
+                if query["condition"]:
+                    compareEnv.fetchQuery(env, query)
+        finally:
+            env.close()
+
+    # Free the results of the catalog, but the databases shared with the catalog of another app still compared
+    def dropCatalog(self, catalog: Catalog):
+        usedNames = {
+            dbName
+            for other in self.catalogs.values()
+            if other.envName == catalog.envName and other.pairCount > 0
+            for dbName in other.dbNames
+        }
+        self.cache.invalidate(catalog.envName, [dbName for dbName in catalog.dbNames if dbName not in usedNames])
+
+    # Compare the extracted catalogs of the pair and write its report, returns False if it failed
+    def comparePair(self, pair: Pair) -> bool:
+        failed = False
+        for catalog in pair.catalogs:
+            error = catalog.future.exception() if catalog.future is not None else None
+            if error is not None:
+                print(f"{pair.label}: extraction of {catalog.envName} failed: {error}", file=sys.stderr)
+                failed = True
+        if failed:
+            # The sessions may have been broken by the error
+            self.pool.clear()
+            return False
+
+        start = time.perf_counter()
+        compareEnv = CompareEnv(pair.catalogs[0].appConfig, self.ignoreList, self.args.compare_space)
+        compareEnv.envNames = [catalog.envName for catalog in pair.catalogs]
+        # One session per environment for the texts of the definitions that differ
+        compareEnv.maxSessions = max(compareEnv.getEnvironmentsPerHost().values())
+        compareEnv.dbSuffixList = pair.app.databases
+        compareEnv.setTableFilter(pair.app.tableFilter)
+        compareEnv.setIgnoredProperties(self.ignoreProperties)
+        if pair.accepted is not None:
+            compareEnv.acceptedIndex = AcceptedIndex(pair.accepted)
+        compareEnv.renameSimilarity = self.args.detect_renames
+        compareEnv.cache = self.cache
+        compareEnv.connectionPool = self.pool
+        compareEnv.hostSlots = self.hostSlots
+        compareEnv.showProgress = False
+
+        extension = "jsonl" if self.args.format == "jsonl" else "txt"
+        path = self.outputDir / f"{pair.app.app}_{'_'.join(compareEnv.envNames)}.{extension}"
+        try:
+            compareEnv.extractMetadata()
+            diffs = compareEnv.getDifferences()
+            with path.open("w", encoding="utf8") as stream:
+                if self.args.format == "jsonl":
+                    renderer = JsonlRenderer(compareEnv, stream)
+                    renderer.render(diffs)
+                    result = f"{renderer.count} differences"
+                else:
+                    DiffRenderer(compareEnv, stream).render(diffs)
+                    stream.write("\n")
+                    result = "differences found" if diffs else "no difference"
+        except Exception:
+            print(f"{pair.label}: comparison failed", file=sys.stderr)
+            traceback.print_exc()
+            self.pool.clear()
+            return False
+        finally:
+            for env in compareEnv.envs:
+                env.close()
+
+        print(f"{pair.label}: {result} in {time.perf_counter() - start:.1f} s, {path}")
+        self.printStaleDifferences(pair, compareEnv)
+        return True
+
+    def printStaleDifferences(self, pair: Pair, compareEnv: CompareEnv):
+        if compareEnv.acceptedIndex is None:
+            return
+        stale = compareEnv.acceptedIndex.getStaleDifferences([db.strip() for db in compareEnv.dbSuffixList])
+        if stale:
+            print(
+                f"{pair.label}: {len(stale)} accepted differences of {pair.app.accepted} not found anymore:",
+                file=sys.stderr,
+            )
+        for index, difference in stale:
+            print(f"    #{index + 1} {difference.json(exclude_none=True)}", file=sys.stderr)
+
+
+# Job of the file, exits if it is missing, invalid or names unknown environments or servers
+def readBatchJob(path: str, dbCredentials: DatabaseConfig) -> BatchJob:
+    if not Path(path).is_file():
+        print(f"Missing batch job file {path}")
+        exit(1)
+    try:
+        job = BatchJob(**json.loads(Path(path).read_text("utf8")))
+    except ValueError as e:
+        print(f"Invalid batch job file {path}: {e}")
+        exit(1)
+
+    envlist = dbCredentials.getEnvironmentList()
+    pairs = [pair for app in job.apps for pair in (app.pairs if app.pairs is not None else job.pairs)]
+    unknownEnvs = sorted({env for pair in pairs for env in pair if env not in envlist})
+    if unknownEnvs:
+        print(f"Unknown environment {', '.join(unknownEnvs)} in {path}, choose in {', '.join(envlist)}")
+        exit(1)
+
+    serverNames = [server.name for server in dbCredentials.conf.servers]
+    unknownServers = sorted(name for name in job.maxSessions if name not in serverNames)
+    if unknownServers:
+        print(f"Unknown server {', '.join(unknownServers)} in {path}, choose in {', '.join(serverNames)}")
+        exit(1)
+    return job
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job", help="JSON file of the applications, databases and environment pairs to compare")
+    parser.add_argument("-o", "--output-dir", default="reports", help="Folder of the reports, one per pair")
+    parser.add_argument(
+        "--format",
+        choices=["text", "jsonl"],
+        default="text",
+        help="text: tree of the differences (default). jsonl: one JSON record per difference",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=2,
+        help="Maximum number of sessions opened on each server, unless set for the server in the job file",
+    )
+    parser.add_argument(
+        "-i",
+        "--ignore-objects",
+        help="List of objects to ignore separated by comma in (constraints,indices,definitions)",
+    )
+    parser.add_argument(
+        "--compare-space",
+        action="store_true",
+        help="Compare the space and the skew of the tables and whether they have statistics",
+    )
+    parser.add_argument(
+        "-ip",
+        "--ignore-properties",
+        help="List of properties to ignore separated by comma in (comments,indexname,ProtectionType)",
+    )
+    parser.add_argument(
+        "--detect-renames",
+        type=float,
+        nargs="?",
+        const=0.6,
+        metavar="SIMILARITY",
+        help="Pair the tables, foreign keys and indices found in one environment only with the most similar ones "
+        "found in the other as renamed objects, 0.6 by default",
+    )
+    args = parser.parse_args()
+
+    if args.max_sessions < 1:
+        print("--max-sessions is at least 1")
+        exit(1)
+    if args.detect_renames is not None and not 0 < args.detect_renames <= 1:
+        print("The similarity of --detect-renames is between 0 and 1")
+        exit(1)
+
+    unknownObjects = [
+        obj
+        for obj in map(str.lower, (args.ignore_objects or "").split(","))
+        if obj and obj not in CompareEnv.ignorableObjects
+    ]
+    if unknownObjects:
+        print(
+            f"Unknown objects to ignore {', '.join(unknownObjects)}, choose in {', '.join(CompareEnv.ignorableObjects)}"
+            + (". The space is only compared with --compare-space" if "space" in unknownObjects else "")
+        )
+        exit(1)
+
+    # The reports are files, without the colors of the terminal
+    os.environ["ANSI_COLORS_DISABLED"] = "1"
+
+    dbCredentials = DatabaseConfig()
+    job = readBatchJob(args.job, dbCredentials)
+    exit(BatchRunner(dbCredentials, job, args).run())
@@ -0,0 +1,54 @@
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+from colorama import init
+
+# Thin client of compare_daemon.py: only the standard library and colorama are loaded, the comparison runs in the
+# daemon
+if __name__ == "__main__":
+    init()
+
+    parser = argparse.ArgumentParser(
+        description="Send a comparison to compare_daemon.py. The other options are the ones of compare_env.py"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port of the daemon")
+    parser.add_argument(
+        "--invalidate",
+        metavar="ENV",
+        nargs="?",
+        const="",
+        help="Drop the cached metadata of an environment, or of all of them without ENV",
+    )
+    parser.add_argument("--status", action="store_true", help="Print the cached metadata and idle sessions")
+    args, compareArgs = parser.parse_known_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        if args.status:
+            with urllib.request.urlopen(f"{url}/status") as response:
+                print(json.dumps(json.load(response), indent=4))
+            exit(0)
+
+        if args.invalidate is not None:
+            request = {"env": args.invalidate or None}
+            with urllib.request.urlopen(f"{url}/invalidate", json.dumps(request).encode("utf8")) as response:
+                print(f"{json.load(response)['invalidated']} cached results dropped")
+            exit(0)
+
+        request = {"args": compareArgs, "color": sys.stdout.isatty()}
+        exitCode = 1
+        with urllib.request.urlopen(f"{url}/compare", json.dumps(request).encode("utf8")) as response:
+            for line in response:
+                message = json.loads(line)
+                if "output" in message:
+                    sys.stdout.write(message["output"])
+                    sys.stdout.flush()
+                else:
+                    exitCode = message["exit"]
+        exit(exitCode)
+    except urllib.error.URLError as e:
+        print(f"Cannot reach the daemon on {url} ({e.reason}), start it with: python compare_daemon.py")
+        exit(1)
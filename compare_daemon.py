@@ -0,0 +1,146 @@
+import argparse
+import json
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from compare_env import createCompareEnv, getArgumentParser, runComparison
+from lib.ConnectionPool import ConnectionPool
+from lib.DatabaseConfig import DatabaseConfig
+from lib.MetadataCache import MetadataCache
+
+
+class ResponseStream(object):
+    """Output of a comparison, sent to the client as JSON lines while it is written"""
+
+    def __init__(self, wfile, isTerminal: bool):
+        self.wfile = wfile
+        self.isTerminal = isTerminal
+
+    def write(self, text: str) -> int:
+        if text:
+            self.wfile.write((json.dumps({"output": text}) + "\n").encode("utf8"))
+        return len(text)
+
+    def flush(self):
+        self.wfile.flush()
+
+    # termcolor only colors the output of a terminal, the one of the client
+    def isatty(self) -> bool:
+        return self.isTerminal
+
+
+class CompareDaemon(object):
+    def __init__(self, dbCredentials: DatabaseConfig, cache: MetadataCache, pool: ConnectionPool):
+        self.dbCredentials = dbCredentials
+        self.cache = cache
+        self.pool = pool
+        # The comparisons print to sys.stdout, they run one at a time
+        self.compareLock = threading.Lock()
+
+    def compare(self, argv: List[str], stream: ResponseStream) -> int:
+        with self.compareLock, redirect_stdout(stream), redirect_stderr(stream):  # type: ignore
+            try:
+                args = getArgumentParser(self.dbCredentials.getEnvironmentList()).parse_args(argv)
+                snapshot = args.from_snapshot or args.save_snapshot or args.refresh_snapshot
+                if args.engine == "merge" or args.explain or snapshot or args.format == "browse":
+                    print(
+                        "The daemon compares its cached metadata, run compare_env.py for the merge engine, "
+                        "--explain, the snapshots or the browser"
+                    )
+                    return 1
+                # Any local client may call the daemon, it reads and writes no file named by the request
+                if args.accepted or args.metrics_json or args.metrics_prometheus:
+                    print("The daemon does not open the files of --accepted and the metrics, run compare_env.py")
+                    return 1
+                compareEnv = createCompareEnv(args, self.dbCredentials)
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+
+            compareEnv.cache = self.cache
+            compareEnv.connectionPool = self.pool
+            compareEnv.showProgress = False
+            try:
+                return runComparison(args, compareEnv)
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                # The sessions may have been broken by the error
+                self.pool.clear()
+                return 1
+            finally:
+                for env in compareEnv.envs:
+                    env.close()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """POST /compare {"args": [...], "color": bool}, POST /invalidate {"env": name or null}, GET /status"""
+
+    compareDaemon: CompareDaemon
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        self.sendJson(
+            {
+                "environments": self.compareDaemon.cache.getStatus(),
+                "idleSessions": self.compareDaemon.pool.getIdleCount(),
+            }
+        )
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/invalidate":
+            self.sendJson({"invalidated": self.compareDaemon.cache.invalidate(request.get("env"))})
+        elif self.path == "/compare":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            stream = ResponseStream(self.wfile, bool(request.get("color")))
+            exitCode = self.compareDaemon.compare(request.get("args", []), stream)
+            self.wfile.write((json.dumps({"exit": exitCode}) + "\n").encode("utf8"))
+        else:
+            self.send_error(404)
+
+    def sendJson(self, response):
+        body = json.dumps(response).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # The output of the comparisons is redirected, the requests are logged on the terminal of the daemon
+    def log_message(self, format, *args):
+        if sys.__stderr__ is not None:
+            sys.__stderr__.write(f"{self.address_string()} - {format % args}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765, help="Port listened on localhost")
+    parser.add_argument("--ttl", type=float, default=900, help="Seconds the extracted metadata are kept")
+    parser.add_argument(
+        "--max-idle", type=float, default=600, help="Seconds after which an idle session is not reused any more"
+    )
+    args = parser.parse_args()
+
+    RequestHandler.compareDaemon = CompareDaemon(
+        DatabaseConfig(), MetadataCache(args.ttl), ConnectionPool(args.max_idle)
+    )
+    # Only local clients, the comparisons run with the credentials of the config file
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), RequestHandler)
+    print(f"Listening on http://127.0.0.1:{args.port}, stop with Ctrl+C")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RequestHandler.compareDaemon.pool.clear()
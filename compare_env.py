@@ -1,47 +1,363 @@
 import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List
 
 from colorama import init
+from prompt_toolkit.output import create_output
 
+from lib.AcceptedIndex import AcceptedIndex
 from lib.CompareEnv import CompareEnv
-from lib.DatabaseConfig import DatabaseConfig
+from lib.DatabaseConfig import AcceptedDifference, AcceptedDifferences, DatabaseConfig
+from lib.DiffBrowser import DiffBrowser
+from lib.DiffEngine import DiffEngine
+from lib.DiffRenderer import DiffRenderer
+from lib.JsonlRenderer import JsonlRenderer
+from lib.MergeDiff import MergeDiff
+from lib.Metrics import Metrics
+from lib.Snapshot import Snapshot
 
-if __name__ == "__main__":
-    init()
-
-    dbCredentials = DatabaseConfig()
-
-    envlist = dbCredentials.getEnvironmentList()
 
+def getArgumentParser(envlist: List[str]) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
-    parser.add_argument("-e", "--env1", choices=envlist, help="Environnement", required=True)
-    parser.add_argument("-f", "--env2", choices=envlist, help="Environnement", required=True)
+    parser.add_argument(
+        "-e",
+        "--env1",
+        help=f"Environnement, or several environments separated by comma to compare them all at once in {envlist}",
+        required=True,
+    )
+    parser.add_argument("-f", "--env2", choices=envlist, help="Environnement")
     parser.add_argument("-d", "--databases", help="List of databases to compare separated by comma", required=True)
-    parser.add_argument("-t", "--tablefilter", help="Filter on tablename. Use % sign for partial search")
+    parser.add_argument(
+        "-t",
+        "--tablefilter",
+        help="Filter on tablename. Use %% sign for partial search, and comma to separate several patterns",
+    )
     parser.add_argument(
         "-i",
         "--ignore-objects",
-        help="List of objects to ignore separated by comma in (constraints,indices)",
+        help="List of objects to ignore separated by comma in (constraints,indices,definitions)",
+    )
+    parser.add_argument(
+        "--compare-space",
+        action="store_true",
+        help="Compare the space and the skew of the tables and whether they have statistics",
     )
     parser.add_argument(
         "-ip",
         "--ignore-properties",
         help="List of properties to ignore separated by comma in (comments,indexname,ProtectionType)",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--accepted",
+        metavar="FILE",
+        help="JSON file of the known differences left out of the comparison. The ones no longer found are reported",
+    )
+    parser.add_argument(
+        "--detect-renames",
+        type=float,
+        nargs="?",
+        const=0.6,
+        metavar="SIMILARITY",
+        help="Pair the tables, foreign keys and indices found in one environment only with the most similar ones "
+        "found in the other as renamed objects, and compare them. The similarity of their names, properties and "
+        "children is between 0 and 1, 0.6 by default",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        help="Maximum number of sessions opened on each server. Environments run their queries in parallel. One per "
+        "environment of the server by default, and the sessions needed by the merge engine with --engine merge",
+    )
+    parser.add_argument(
+        "--split-databases",
+        action="store_true",
+        help="Run one query per database to spread the extraction over the sessions",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Extract, compare and print one database at a time instead of waiting for the whole extraction",
+    )
+    parser.add_argument(
+        "--diff-processes",
+        type=int,
+        default=1,
+        help="Number of processes comparing the tables of the extracted databases, for databases of tens of "
+        "thousands of tables. Needs fork, not available on Windows",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["tree", "merge"],
+        default="tree",
+        help="tree: load both environments in memory before comparing them (default). "
+        "merge: compare the sorted query results table by table, for very large databases",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "jsonl", "browse"],
+        default="text",
+        help="text: colored tree of the differences (default). "
+        "jsonl: one JSON record per difference, the exit code is 1 if any difference is found. "
+        "browse: interactive tree of the differences, with search, filters and tables queried again on demand",
+    )
+    parser.add_argument(
+        "--hash-first",
+        action="store_true",
+        help="Compare a fingerprint of the columns, foreign keys and indices of each table computed by the servers, "
+        "and only fetch the details of the tables whose fingerprints differ",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Only tell which tables differ: compare the tables and the fingerprints of their details",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print the estimated rows, spool and time of each query instead of comparing the environments",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        metavar="FILE",
+        help="Write the time of the logons, queries and phases, and the rows fetched, by environment and query",
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        metavar="FILE",
+        help="Write the same metrics as --metrics-json in a Prometheus textfile, for the node exporter",
+    )
+    snapshotGroup = parser.add_mutually_exclusive_group()
+    snapshotGroup.add_argument(
+        "--save-snapshot",
+        metavar="FILE",
+        help="Save the metadata extracted from the databases in a snapshot file",
+    )
+    snapshotGroup.add_argument(
+        "--refresh-snapshot",
+        metavar="FILE",
+        help="Like --save-snapshot, but only query again the tables changed since the previous snapshot in the file",
+    )
+    parser.add_argument(
+        "--from-snapshot",
+        metavar="FILE",
+        help="Read the environments available in the snapshot file instead of querying the databases",
+    )
+    return parser
+
+
+# Check the options and build the comparison, exits on invalid options
+def createCompareEnv(args, dbCredentials: DatabaseConfig) -> CompareEnv:
+    envlist = dbCredentials.getEnvironmentList()
 
     compareEnv = CompareEnv(
         dbCredentials=dbCredentials,
         ignoreList=list(map(str.lower, (args.ignore_objects or "").split(","))),
+        compareSpace=args.compare_space,
     )
 
-    compareEnv.env1name = args.env1
-    compareEnv.env2name = args.env2
+    unknownObjects = [obj for obj in compareEnv.ignoreList if obj and obj not in CompareEnv.ignorableObjects]
+    if unknownObjects:
+        print(
+            f"Unknown objects to ignore {', '.join(unknownObjects)}, choose in {', '.join(CompareEnv.ignorableObjects)}"
+            + (". The space is only compared with --compare-space" if "space" in unknownObjects else "")
+        )
+        exit(1)
+
+    compareEnv.envNames = [env.strip() for env in args.env1.split(",") if env.strip() != ""]
+    if args.env2:
+        compareEnv.envNames.append(args.env2)
+
+    compareEnv.setIgnoredProperties(list(map(str.lower, (args.ignore_properties or "").split(","))))
+
+    if args.accepted:
+        compareEnv.acceptedIndex = AcceptedIndex(readAcceptedDifferences(args.accepted))
 
-    compareEnv.ignoreProperties = list(map(str.lower, (args.ignore_properties or "").split(",")))
+    if args.detect_renames is not None and not 0 < args.detect_renames <= 1:
+        print("The similarity of --detect-renames is between 0 and 1")
+        exit(1)
+    compareEnv.renameSimilarity = args.detect_renames
 
     compareEnv.dbSuffixList = args.databases.split(",")
     compareEnv.setTableFilter(args.tablefilter)
+    if args.max_sessions is not None:
+        compareEnv.maxSessions = args.max_sessions
+    compareEnv.splitByDatabase = args.split_databases
+    compareEnv.diffProcesses = args.diff_processes
+    if args.metrics_json or args.metrics_prometheus:
+        compareEnv.metrics = Metrics(compareEnv.app, compareEnv.envNames)
+    compareEnv.sortedQueries = args.engine == "merge"
+    compareEnv.hashFirst = args.hash_first
+    compareEnv.quick = args.quick
+
+    unknownEnvs = [env for env in compareEnv.envNames if env not in envlist]
+    if unknownEnvs:
+        print(f"Unknown environment {', '.join(unknownEnvs)}, choose in {', '.join(envlist)}")
+        exit(1)
+
+    if len(set(compareEnv.envNames)) != len(compareEnv.envNames) or len(compareEnv.envNames) < 2:
+        print("Give at least two different environments, with -e ENV1 -f ENV2 or -e ENV1,ENV2,ENV3")
+        exit(1)
+
+    if len(compareEnv.envNames) > 2 and (args.engine == "merge" or args.format == "jsonl"):
+        print("The merge engine and the jsonl format compare two environments")
+        exit(1)
+
+    if args.format == "browse" and (args.engine == "merge" or args.pipeline or args.explain):
+        print(
+            "The browser shows the whole comparison, it cannot be used with the merge engine, --pipeline or --explain"
+        )
+        exit(1)
+
+    if args.format == "browse" and not sys.stdout.isatty():
+        print("The browser needs a terminal")
+        exit(1)
+
+    if args.engine == "merge" and (args.pipeline or args.from_snapshot or args.save_snapshot or args.refresh_snapshot):
+        print("The merge engine reads the databases directly, it cannot be used with --pipeline or the snapshots")
+        exit(1)
+
+    if (args.hash_first or args.quick) and (
+        args.engine == "merge" or args.from_snapshot or args.save_snapshot or args.refresh_snapshot
+    ):
+        print(
+            "--hash-first and --quick query the fingerprints, they cannot be used with the merge engine or the snapshots"
+        )
+        exit(1)
+
+    # The sessions of a server are shared by the environments it hosts, one session each by default
+    envsPerHost = max(compareEnv.getEnvironmentsPerHost().values())
+    if args.max_sessions is None:
+        compareEnv.maxSessions = envsPerHost
+    if args.engine == "merge":
+        required = MergeDiff.getSessionCount(compareEnv) * envsPerHost
+        if args.max_sessions is None:
+            compareEnv.maxSessions = required
+        elif args.max_sessions < required:
+            print(
+                f"The merge engine reads all its queries at the same time, on {required} sessions of the server: "
+                f"raise --max-sessions to {required} or use the tree engine"
+            )
+            exit(1)
+
+    if args.explain and (args.from_snapshot or args.save_snapshot or args.refresh_snapshot):
+        print("--explain only queries the databases, it cannot be used with the snapshots")
+        exit(1)
 
-    compareEnv.extractMetadata()
+    if args.from_snapshot and not Path(args.from_snapshot).is_file():
+        print(f"Missing snapshot file {args.from_snapshot}")
+        exit(1)
+
+    # The same file can be read for one environment and written for the other
+    snapshots = {}
+    for path in filter(None, [args.from_snapshot, args.save_snapshot, args.refresh_snapshot]):
+        if Path(path).resolve() not in snapshots:
+            snapshots[Path(path).resolve()] = Snapshot(Path(path))
+    if args.from_snapshot:
+        compareEnv.fromSnapshot = snapshots[Path(args.from_snapshot).resolve()]
+    if args.save_snapshot:
+        compareEnv.saveSnapshot = snapshots[Path(args.save_snapshot).resolve()]
+    if args.refresh_snapshot:
+        compareEnv.refreshSnapshot = snapshots[Path(args.refresh_snapshot).resolve()]
+
+    return compareEnv
+
+
+# Differences of the accepted differences file, exits if it is missing or invalid
+def readAcceptedDifferences(path: str) -> List[AcceptedDifference]:
+    if not Path(path).is_file():
+        print(f"Missing accepted differences file {path}")
+        exit(1)
+    try:
+        return AcceptedDifferences(**json.loads(Path(path).read_text("utf8"))).differences
+    except ValueError as e:
+        print(f"Invalid accepted differences file {path}: {e}")
+        exit(1)
+
+
+# Accepted differences of the compared databases that matched nothing, on stderr to keep stdout for the
+# differences. The quick mode does not compare the objects of the tables, and the browser compares the tables
+# while they are shown.
+def printStaleDifferences(args, compareEnv: CompareEnv):
+    if compareEnv.acceptedIndex is None or args.explain or args.quick or args.format == "browse":
+        return
+    stale = compareEnv.acceptedIndex.getStaleDifferences([db.strip() for db in compareEnv.dbSuffixList])
+    if stale:
+        print(f"\n{len(stale)} accepted differences of {args.accepted} not found anymore:", file=sys.stderr)
+    for index, difference in stale:
+        print(f"    #{index + 1} {difference.json(exclude_none=True)}", file=sys.stderr)
+
+
+# Print the comparison and save its metrics, returns the exit code
+def runComparison(args, compareEnv: CompareEnv) -> int:
+    exitCode = printComparison(args, compareEnv)
+    printStaleDifferences(args, compareEnv)
+    if compareEnv.metrics is not None:
+        compareEnv.metrics.save(args.metrics_json, args.metrics_prometheus)
+    return exitCode
+
+
+def printComparison(args, compareEnv: CompareEnv) -> int:
+    if args.explain:
+        costs = compareEnv.explainQueries()
+        labelWidth = max((len(cost.getLabel()) for cost in costs), default=0)
+        for cost in costs:
+            print(cost.format(labelWidth))
+    elif args.format == "jsonl":
+        # The progress bar is written to stderr, to keep stdout for the records
+        if compareEnv.showProgress:
+            compareEnv.progressOutput = create_output(stdout=sys.stderr)
+        jsonlRenderer = JsonlRenderer(compareEnv, sys.stdout)
+        if args.engine == "merge":
+            for ddl in MergeDiff(compareEnv).iterModels():
+                with compareEnv.timePhase("diff"):
+                    diffs = DiffEngine(compareEnv).diff(ddl)
+                with compareEnv.timePhase("render"):
+                    jsonlRenderer.render(diffs)
+        elif args.pipeline:
+            for dbName in compareEnv.iterDatabases():
+                diffs = compareEnv.getDifferences()
+                with compareEnv.timePhase("render"):
+                    jsonlRenderer.render(diffs)
+                sys.stdout.flush()
+        else:
+            compareEnv.extractMetadata()
+            diffs = compareEnv.getDifferences()
+            with compareEnv.timePhase("render"):
+                jsonlRenderer.render(diffs)
+        return 1 if jsonlRenderer.count > 0 else 0
+    elif args.format == "browse":
+        compareEnv.extractMetadata()
+        DiffBrowser(compareEnv).run()
+    elif args.engine == "merge":
+        for diff in MergeDiff(compareEnv).iterDiffs():
+            print(diff, end="", flush=True)
+        print()
+    elif args.pipeline:
+        renderer = DiffRenderer(compareEnv, sys.stdout)
+        for dbName in compareEnv.iterDatabases():
+            diffs = compareEnv.getDifferences()
+            with compareEnv.timePhase("render"):
+                renderer.render(diffs)
+            sys.stdout.flush()
+        print()
+    else:
+        compareEnv.extractMetadata()
+
+        diffs = compareEnv.getDifferences()
+        with compareEnv.timePhase("render"):
+            DiffRenderer(compareEnv, sys.stdout).render(diffs)
+        print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    init()
+
+    dbCredentials = DatabaseConfig()
 
-    print(compareEnv.getDiffObj(compareEnv.ddl, 0))
+    args = getArgumentParser(dbCredentials.getEnvironmentList()).parse_args()
+    compareEnv = createCompareEnv(args, dbCredentials)
+    exit(runComparison(args, compareEnv))
@@ -0,0 +1,167 @@
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from lib.DatabaseConfig import AcceptedDifference
+from lib.Metadata import MetaObject
+from lib.PropertyComparator import PROPERTY_ALIASES, PropertyDiffs
+
+
+class AcceptedNode(object):
+    """State of the trie of the accepted differences. The names without % are found in the names of the root of
+    their level, the patterns with % are spelled out one character at a time: chars holds the literal characters
+    and anyString the state after a %, which loops on any character. A name fully read ends on the states holding
+    the rules accepting it, and the root of the patterns of the next level (table, type, name then property)."""
+
+    __slots__ = ("names", "chars", "anyString", "loop", "rules", "next")
+
+    def __init__(self, loop: bool = False):
+        self.names: Dict[str, AcceptedNode] = {}
+        self.chars: Dict[str, AcceptedNode] = {}
+        self.anyString: Optional[AcceptedNode] = None
+        self.loop = loop
+        self.rules: Tuple[int, ...] = ()
+        self.next: Optional[AcceptedNode] = None
+
+
+# Roots of the patterns an object name is matched from
+Scope = Sequence[AcceptedNode]
+
+
+class AcceptedIndex(object):
+    """Accepted differences compiled into a trie walked along the tree of the compared objects: the databases from
+    the root, the tables from the states of their database, the objects of a table from the states of the table by
+    their type then their name, and the properties from the states of their object. Looking up an object reads
+    each character of its name once, whatever the number of rules. The rules used by the comparison are kept to
+    report the ones not matching anything anymore."""
+
+    def __init__(self, differences: List[AcceptedDifference]):
+        self.differences = differences
+        self.root = AcceptedNode()
+        self.used: Set[int] = set()
+        for index, difference in enumerate(differences):
+            self.addDifference(index, difference)
+
+    def addDifference(self, index: int, difference: AcceptedDifference):
+        patterns = [difference.database]
+        if difference.property is not None:
+            propName = PROPERTY_ALIASES.get(difference.property.lower(), difference.property)
+            patterns += [difference.table or "%", difference.type or "%", difference.name or "%", propName]
+        elif difference.type is not None or difference.name is not None:
+            patterns += [difference.table or "%", difference.type or "%", difference.name or "%"]
+        elif difference.table is not None:
+            patterns.append(difference.table)
+
+        node = self.root
+        for level, pattern in enumerate(patterns):
+            if level > 0:
+                node.next = node.next or AcceptedNode()
+                node = node.next
+            node = self.addPattern(node, pattern.upper())
+        node.rules += (index,)
+
+    def addPattern(self, node: AcceptedNode, pattern: str) -> AcceptedNode:
+        parts = self.splitPattern(pattern)
+        if len(parts) == 1:
+            if parts[0] not in node.names:
+                node.names[parts[0]] = AcceptedNode()
+            return node.names[parts[0]]
+
+        for position, part in enumerate(parts):
+            if position > 0 and not node.loop:
+                node.anyString = node.anyString or AcceptedNode(loop=True)
+                node = node.anyString
+            for char in part:
+                if char not in node.chars:
+                    node.chars[char] = AcceptedNode()
+                node = node.chars[char]
+        return node
+
+    # Literal parts of a pattern around its %
+    @staticmethod
+    def splitPattern(pattern: str) -> List[str]:
+        if "%" not in pattern and "\\" not in pattern:
+            return [pattern]
+        parts = [""]
+        chars = iter(pattern)
+        for char in chars:
+            if char == "%":
+                parts.append("")
+            else:
+                parts[-1] += next(chars, "\\") if char == "\\" else char
+        return parts
+
+    # States ending the patterns of the scope matching the name
+    def match(self, scope: Scope, name: str) -> List[AcceptedNode]:
+        name = name.upper()
+        found = []
+        patterns = []
+        for root in scope:
+            if name in root.names:
+                found.append(root.names[name])
+            if root.chars or root.anyString is not None:
+                patterns.append(root)
+        return found + self.matchPatterns(patterns, name) if patterns else found
+
+    def matchPatterns(self, roots: Scope, name: str) -> List[AcceptedNode]:
+        states = self.addAnyStrings(roots)
+        for char in name:
+            nextStates = []
+            for state in states:
+                if state.loop:
+                    nextStates.append(state)
+                if char in state.chars:
+                    nextStates.append(state.chars[char])
+            if not nextStates:
+                return []
+            states = self.addAnyStrings(nextStates)
+        return states
+
+    # The states and the states reached from them by a %, without duplicates
+    def addAnyStrings(self, states: Sequence[AcceptedNode]) -> List[AcceptedNode]:
+        allStates: Dict[int, AcceptedNode] = {}
+        for state in states:
+            while state is not None and id(state) not in allStates:
+                allStates[id(state)] = state
+                state = state.anyString
+        return list(allStates.values())
+
+    def getNext(self, states: Sequence[AcceptedNode]) -> Scope:
+        return [state.next for state in states if state.next is not None]
+
+    # Rules accepting the whole object, the scope of its properties and the scope of its children
+    def lookup(self, scope: Scope, obj: MetaObject) -> Tuple[Set[int], Scope, Scope]:
+        if obj.typeName == "database":
+            states = self.match(scope, obj.name)
+            return {rule for state in states for rule in state.rules}, [], self.getNext(states)
+
+        # The objects of a table are looked up from the states of the table, the table itself as an object of
+        # type table
+        childScope = scope
+        rules: Set[int] = set()
+        if obj.typeName == "table":
+            tableStates = self.match(scope, obj.name)
+            childScope = self.getNext(tableStates)
+            rules.update(rule for state in tableStates for rule in state.rules)
+        states = self.match(self.getNext(self.match(childScope, obj.typeName)), obj.name)
+        rules.update(rule for state in states for rule in state.rules)
+        return rules, self.getNext(states), childScope
+
+    # Properties not accepted for the object
+    def filterProperties(self, propertyScope: Scope, properties: PropertyDiffs) -> PropertyDiffs:
+        kept = []
+        for propName, values in properties:
+            rules = [rule for state in self.match(propertyScope, propName) for rule in state.rules]
+            if rules:
+                self.used.update(rules)
+            else:
+                kept.append((propName, values))
+        return tuple(kept)
+
+    # Accepted differences of the compared databases that no difference matched
+    def getStaleDifferences(self, dbNames: List[str]) -> List[Tuple[int, AcceptedDifference]]:
+        stale = []
+        for index, difference in enumerate(self.differences):
+            regex = re.compile(".*".join(map(re.escape, self.splitPattern(difference.database))), re.I | re.S)
+            if index not in self.used and any(regex.fullmatch(dbName) for dbName in dbNames):
+                stale.append((index, difference))
+        return stale
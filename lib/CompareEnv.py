@@ -1,17 +1,57 @@
 import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from queue import Queue
 from string import Template
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
 
 import teradatasql
 from colorama import init
+from prompt_toolkit.output import Output
 from prompt_toolkit.shortcuts import ProgressBar
-from termcolor import colored
 
 from lib.DatabaseConfig import DatabaseConfig
+from lib.DiffEngine import DiffEngine, Difference
+from lib.Metadata import (
+    Column,
+    Constraint,
+    ConstraintColumn,
+    Database,
+    Definition,
+    Index,
+    IndexColumn,
+    MetaObject,
+    Space,
+    Table,
+    TYPE_NAMES,
+)
+from lib.PropertyComparator import PropertyComparator
+from lib.QueryCost import QueryCost
+from lib.TableFilter import TableFilter
+
+if TYPE_CHECKING:
+    from lib.AcceptedIndex import AcceptedIndex
+    from lib.ConnectionPool import ConnectionPool
+    from lib.MetadataCache import MetadataCache
+    from lib.Metrics import Metrics
+    from lib.Snapshot import IncrementalRefresh, Snapshot
+
+
+class QueryResult(object):
+    """Rows fetched by one query, detached from the cursor that produced them"""
+
+    def __init__(self, description, rows: List[Dict]):
+        self.description = description
+        self.rows = rows
 
 
 class Environment(object):
-    def __init__(self, name: str, dbConf: DatabaseConfig, number: int, color: str, dbList: List[str]):
+    def __init__(
+        self, name: str, dbConf: DatabaseConfig, number: int, color: str, dbList: List[str], maxSessions: int = 1
+    ):
         self.name = name
         self.dbCredentials = dbConf
         self.number = number
@@ -19,12 +59,31 @@ class Environment(object):
 
         (server, env, username, password) = dbConf.getCredentials(name)
         self.code = env.code or env.name
+        self.host = server.host
 
-        connectionStr = (
+        self.connectionStr = (
             '{"host":"' + server.host + '", "user":"' + username + '","password":"' + password + '", "cop": "false"}'
         )
-        self.conn = teradatasql.connect(connectionStr)
-        self.cur = self.conn.cursor()
+        self.maxSessions = maxSessions
+        self.connections: List[teradatasql.TeradataConnection] = []
+        self.sessions: Queue = Queue()
+        self.sessionCount = 0
+        self.sessionLock = threading.Lock()
+        # Connections kept open by the daemon between the comparisons
+        self.pool: Optional["ConnectionPool"] = None
+        # Sessions of the host shared by the comparisons of a batch: each query takes one and gives its connection
+        # back to the pool, so that the sessions opened on the host stay within the limit of the batch
+        self.hostSlots: Optional[threading.Semaphore] = None
+        self.slotConnections: Dict[int, teradatasql.TeradataConnection] = {}
+        self.metrics: Optional["Metrics"] = None
+
+        # Set when the environment is read from, or saved to, a snapshot instead of only queried
+        self.snapshot: Optional["Snapshot"] = None
+        self.snapshotId: Optional[int] = None
+        self.saveSnapshot: Optional["Snapshot"] = None
+        self.saveSnapshotId: Optional[int] = None
+        self.refreshSnapshotId: Optional[int] = None
+        self.refresh: Optional["IncrementalRefresh"] = None
 
         self.dbMap: Dict[str, str] = {}
 
@@ -37,23 +96,144 @@ class Environment(object):
         self.dbRegexStr = Template(dbConf.conf.databaseNamePattern).substitute(
             app=dbConf.conf.app, db="(.*)", env=self.code
         )
+        self.dbRegex = re.compile(f"^{self.dbRegexStr}$", re.IGNORECASE)
+        # Database names in the text of the views, macros and procedures
+        self.dbTextRegexStr = r"\b" + self.dbRegexStr.replace("(.*)", r"(\w+)") + r"\b"
+        self.dbTextRegex = re.compile(self.dbTextRegexStr, re.IGNORECASE)
+        self.dbNames: Dict[str, str] = {}
+
+    # Logical name of a physical database name, like the REGEXP_REPLACE of the sorted queries
+    def getDbName(self, physicalName: str) -> str:
+        dbName = self.dbNames.get(physicalName)
+        if dbName is None:
+            match = self.dbRegex.match(physicalName)
+            dbName = self.dbNames[physicalName] = match.group(1) if match else physicalName
+        return dbName
+
+    def acquireSession(self) -> teradatasql.TeradataCursor:
+        if self.hostSlots is not None:
+            return self.acquireHostSlot(self.hostSlots)
+
+        # Log on lazily, up to maxSessions, so that sessions of several environments open at the same time
+        with self.sessionLock:
+            newSession = self.sessions.empty() and self.sessionCount < self.maxSessions
+            if newSession:
+                self.sessionCount += 1
+
+        if not newSession:
+            return self.sessions.get()
+
+        start = time.perf_counter()
+        conn = (
+            self.pool.acquire(self.connectionStr) if self.pool is not None else teradatasql.connect(self.connectionStr)
+        )
+        if self.metrics is not None:
+            self.metrics.addLogon(self.name, time.perf_counter() - start)
+        with self.sessionLock:
+            self.connections.append(conn)
+        return conn.cursor()
+
+    def releaseSession(self, cur: teradatasql.TeradataCursor):
+        if self.hostSlots is not None:
+            assert self.pool is not None
+            with self.sessionLock:
+                conn = self.slotConnections.pop(id(cur))
+            self.pool.release(self.connectionStr, conn)
+            self.hostSlots.release()
+            return
+        self.sessions.put(cur)
+
+    def acquireHostSlot(self, hostSlots: threading.Semaphore) -> teradatasql.TeradataCursor:
+        assert self.pool is not None
+        hostSlots.acquire()
+        try:
+            conn = self.pool.acquire(self.connectionStr)
+        except BaseException:
+            hostSlots.release()
+            raise
+        cur = conn.cursor()
+        with self.sessionLock:
+            self.slotConnections[id(cur)] = conn
+        return cur
+
+    def close(self):
+        for conn in self.connections:
+            if self.pool is not None:
+                self.pool.release(self.connectionStr, conn)
+            else:
+                conn.close()
+        self.connections = []
+        self.sessions = Queue()
+        self.sessionCount = 0
 
 
 class CompareEnv(object):
-    def __init__(self, dbCredentials: DatabaseConfig, ignoreList: List[str]):
+    # Objects left out of the comparison with -i, the space is only compared with --compare-space
+    ignorableObjects = ("constraints", "indices", "definitions")
+
+    def __init__(self, dbCredentials: DatabaseConfig, ignoreList: List[str], compareSpace: bool = False):
         self.dbCredentials = dbCredentials
         self.app = self.dbCredentials.conf.app
-        self.env1name: str = ""
-        self.env2name: str = ""
+        # Two environments are compared side by side, more are grouped by identical definitions
+        self.envNames: List[str] = []
         self.env1: Environment
         self.env2: Environment
         self.dbSuffixList: List[str] = []
-        self.tableFilter: str = ""
-        self.backupTableFilter = " and regexp_similar(TableName, '.*20[0-9]{6,12}','i') = 0"
+        self.tableFilterPattern: Optional[str] = None
+        self.tableRules = TableFilter(self.dbCredentials.conf.tableRules)
+        self.tableFilter = self.tableRules.getSqlCondition()
+        # Where clause of the table rules only, without the -t patterns
+        self.ruleTableFilter = self.tableFilter
         self.ignoreList = ignoreList
         self.ignoreProperties: List[str] = []
+        self.propertyComparator = PropertyComparator(self.dbCredentials.conf.propertyRules)
         self.envs: List[Environment] = []
-        self.ddl = {}
+        self.maxSessions = 1
+        self.splitByDatabase = False
+        # Processes comparing the tables of the extracted model
+        self.diffProcesses = 1
+        # Map the database names and sort the rows on the server, for the merge engine
+        self.sortedQueries = False
+        # Terminal of the progress bar, stdout if None. The daemon has no terminal and no progress bar
+        self.progressOutput: Optional[Output] = None
+        self.showProgress = True
+        self.executors: Dict[int, ThreadPoolExecutor] = {}
+        self.fromSnapshot: Optional["Snapshot"] = None
+        self.saveSnapshot: Optional["Snapshot"] = None
+        self.refreshSnapshot: Optional["Snapshot"] = None
+        # Compare the fingerprints of the details of each table first, then only fetch the details of the tables
+        # whose fingerprints differ. The quick mode only compares the tables and their fingerprints.
+        self.hashFirst = False
+        self.quick = False
+        # Set by the daemon, the queries go through the cache and the sessions are taken from the pool
+        self.cache: Optional["MetadataCache"] = None
+        self.connectionPool: Optional["ConnectionPool"] = None
+        # Set by the batch, the sessions of each host shared by its comparisons and extractions
+        self.hostSlots: Optional[Dict[str, threading.Semaphore]] = None
+        # Time and volume of the queries and of the phases, when they are exported
+        self.metrics: Optional["Metrics"] = None
+        # Known differences left out of the comparison
+        self.acceptedIndex: Optional["AcceptedIndex"] = None
+        # Minimum similarity of the objects found in some environments only to be paired as renamed objects
+        self.renameSimilarity: Optional[float] = None
+        # Above this number of changed tables, an incremental refresh queries the whole granularity again
+        self.maxRefreshTables = 1000
+        # Size of DBC.TablesV.RequestText, the longer definitions are not hashed on the server
+        self.maxRequestTextLength = 12500
+        self.ddl: Dict[str, Database] = {}
+        # Columns naming the objects of the rows, the other columns are their properties
+        self.keyColumns = (
+            "DatabaseName",
+            "TableName",
+            "ColumnName",
+            "IndexCode",
+            "ConstraintName",
+            "DefinitionKind",
+            "SpaceKind",
+        )
+        # Property names of each granularity, and the distinct property tuples shared by the model
+        self.propertySchemas: Dict[str, Tuple[str, ...]] = {}
+        self.propertyPool: Dict[tuple, tuple] = {}
 
         # fmt: off
         self.colors = (
@@ -62,80 +242,588 @@ class CompareEnv(object):
             {"name": "white",   "attrs": ["bold"]},
             {"name": "white",   "attrs": ["bold"]},
         )
+        self.envColors = ("green", "yellow", "blue", "red")
 
         self.queries = [
             {
                 "granularity": "table",
                 "sql": self.getSqlDbcTables,
-                "condition": True
+                "condition": True,
+                "tableColumns": ("DataBaseName", "TableName"),
+            },
+            # Hash of the text of the views, macros, procedures and join indexes, the texts are only fetched for
+            # the definitions whose hashes differ
+            {
+                "granularity": "definition",
+                "sql": self.getSqlDbcDefinitions,
+                "condition": "definitions" not in ignoreList,
+                "tableColumns": ("DataBaseName", "TableName"),
+                "incremental": True,
             },
             {
                 "granularity": "col",
                 "sql": self.getSqlDbcColumns,
-                "condition": True
+                "condition": True,
+                "tableColumns": ("DatabaseName", "TableName"),
+                "incremental": True,
+                # (property name, hashed columns)
+                "fingerprint": (
+                    "ColumnsFingerprint",
+                    ("ColumnName", "ColumnFormat", "CharType", "Nullable", "DefaultValue", "UpperCaseFlag"),
+                ),
             },
+            # One row per column of each foreign key and index, the header objects are built from the same rows:
+            # (granularity, name column, header properties) and (granularity, column properties). The signature of
+            # the definition of each object, computed from its rows, pairs the unnamed objects whose generated name
+            # differs between the environments.
             {
-                "granularity": "constraint",
+                "granularity": "constraintRows",
                 "sql": self.getSqlDbcConstraints,
                 "condition": "constraints" not in ignoreList,
+                "tableColumns": ("ParentDB", "ParentTable"),
+                "childTableColumns": ("ChildDB", "ChildTable"),
+                "incremental": True,
+                "prepareRow": self.prepareConstraintRow,
+                "header": ("constraint", "ConstraintName", ("ChildDatabase", "IndexName", "ChildTable")),
+                "detail": ("constraintColumns", ("ChildKeyColumn",)),
+                "signature": self.getConstraintSignature,
+                # Without the names generated for the unnamed foreign keys, matched on their columns
+                "fingerprint": (
+                    "ForeignKeysFingerprint",
+                    ("IndexName", "ChildDatabase", "ChildTable", "ColumnName", "ChildKeyColumn"),
+                ),
             },
             {
-                "granularity": "constraintColumns",
-                "sql": self.getSqlDbcConstraintColumns,
-                "condition": "constraints" not in ignoreList,
-            },
-            {
-                "granularity": "indices",
+                "granularity": "indexRows",
                 "sql": self.getSqlDbcIndices,
                 "condition": "indices" not in ignoreList,
+                "tableColumns": ("DatabaseName", "TableName"),
+                "incremental": True,
+                "header": ("indices", "IndexCode", ("IndexName", "IndexNumber", "IndexType", "UniqueFlag")),
+                "detail": ("indexColumns", ("ColumnPosition",)),
+                "signature": self.getIndexSignature,
+                "fingerprint": (
+                    "IndicesFingerprint",
+                    ("IndexName", "IndexNumber", "IndexType", "UniqueFlag", "ColumnName", "ColumnPosition"),
+                ),
             },
+            # Only with --compare-space, the space of the environments differs by design and DBC.TableSizeV is slow
+            # to read. Aggregated by the server, DBC.TableSizeV has one row per AMP. Not incremental: the space
+            # changes without any change of the definition of the table.
             {
-                "granularity": "indexColumns",
-                "sql": self.getSqlDbcIndexColumns,
-                "condition": "indices" not in ignoreList,
+                "granularity": "space",
+                "sql": self.getSqlDbcSpace,
+                "condition": compareSpace,
+                "tableColumns": ("DataBaseName", "TableName"),
             },
         ]
+
+        # Only saved in snapshots, to find the tables changed since the previous snapshot
+        self.versionQuery = {
+            "granularity": "tableVersion",
+            "sql": self.getSqlDbcTableVersions,
+            "condition": True,
+            "tableColumns": ("DataBaseName", "TableName"),
+        }
         # fmt: on
 
+    # One or several LIKE patterns separated by comma, on top of the table rules of the config file
     def setTableFilter(self, tableFilter: Optional[str]):
         if tableFilter is not None and tableFilter.strip() != "":
-            self.tableFilter = f" and TableName like '{tableFilter}'"
+            patterns = [pattern.strip() for pattern in tableFilter.split(",") if pattern.strip() != ""]
+            self.tableRules = TableFilter(self.dbCredentials.conf.tableRules, patterns)
+            self.tableFilter = self.tableRules.getSqlCondition()
+            self.tableFilterPattern = ",".join(patterns)
+
+    def openEnvironments(self):
+        self.envs = [
+            Environment(name, self.dbCredentials, i + 1, self.envColors[i % len(self.envColors)], self.dbSuffixList)
+            for i, name in enumerate(self.envNames)
+        ]
+        for env in self.envs:
+            env.pool = self.connectionPool
+            env.metrics = self.metrics
+            env.hostSlots = self.hostSlots.get(env.host) if self.hostSlots is not None else None
+        self.env1, self.env2 = self.envs[0], self.envs[1]
+        self.setSessionLimits()
+        self.attachSnapshots()
+        self.executors = {env.number: ThreadPoolExecutor(max_workers=env.maxSessions) for env in self.envs}
+        self.prepareRefreshes()
+
+    def attachSnapshots(self):
+        granularities = [query["granularity"] for query in self.queries if query["condition"]]
+
+        for env in self.envs:
+            info = self.fromSnapshot.getInfo(self.app, env.name) if self.fromSnapshot is not None else None
+            if info is not None:
+                assert self.fromSnapshot is not None
+                if info.tableFilter is not None and info.tableFilter != self.tableFilterPattern:
+                    print(f"The snapshot of {env.name} only holds the tables like '{info.tableFilter}'")
+                    exit(1)
+                missing = set(granularities) - set(self.fromSnapshot.getGranularities(info.id))
+                if missing:
+                    print(f"The snapshot of {env.name} does not hold: {', '.join(sorted(missing))}")
+                    exit(1)
+                env.snapshot = self.fromSnapshot
+                env.snapshotId = info.id
+                continue
+
+            if self.refreshSnapshot is not None:
+                env.saveSnapshot = self.refreshSnapshot
+                info = self.refreshSnapshot.getInfo(self.app, env.name)
+                # A snapshot that does not hold everything we need is extracted again from scratch
+                if (
+                    info is not None
+                    and info.tableFilter == self.tableFilterPattern
+                    and set(granularities + ["tableVersion"]) <= set(self.refreshSnapshot.getGranularities(info.id))
+                ):
+                    env.refreshSnapshotId = info.id
+            else:
+                env.saveSnapshot = self.saveSnapshot
+
+            if env.saveSnapshot is not None:
+                env.saveSnapshotId = env.saveSnapshot.create(self.app, env.name, env.code, self.tableFilterPattern)
+
+    # Compare the table timestamps with the previous snapshot, before any other query, to know which tables to
+    # extract again
+    def prepareRefreshes(self):
+        from lib.Snapshot import IncrementalRefresh
+
+        refreshEnvs = [env for env in self.envs if env.refreshSnapshotId is not None]
+        futures = {
+            env.number: self.executors[env.number].submit(
+                self.executeQuery, env, self.versionQuery["sql"](env, None, ""), "tableVersion"
+            )
+            for env in refreshEnvs
+        }
+
+        for env in refreshEnvs:
+            snapshot = env.saveSnapshot
+            assert snapshot is not None and env.refreshSnapshotId is not None
+            dbNames = list(env.dbMap.values())
+            cachedVersions = snapshot.read(env.refreshSnapshotId, "tableVersion", dbNames, self.tableFilterPattern)
+            refresh = IncrementalRefresh(snapshot, env.refreshSnapshotId, cachedVersions, futures[env.number].result())
+
+            # Foreign keys are listed under their parent table, which is stale as soon as the child table changed
+            if "constraints" not in self.ignoreList:
+                changedChildTables = refresh.changedTables | refresh.droppedTables
+                cachedFks = snapshot.read(env.refreshSnapshotId, "constraintRows", dbNames, self.tableFilterPattern)
+                for row in cachedFks.rows:
+                    if (row["ChildDatabase"].upper(), row["ChildTable"].upper()) in changedChildTables:
+                        refresh.changedParentTables.add(refresh.getKey(row))
+
+                if 0 < len(refresh.changedTables) <= self.maxRefreshTables:
+                    restriction = self.getTableRestriction(env, refresh.changedTables, "ChildDB", "ChildTable")
+                    sql = self.getSqlDbcConstraints(env, None, restriction)
+                    currentFks = self.executeQuery(env, sql, "constraintRows")
+                    refresh.changedParentTables.update(refresh.getKey(row) for row in currentFks.rows)
+
+            env.refresh = refresh
+
+    def commitSnapshot(self):
+        for snapshot in {id(env.saveSnapshot): env.saveSnapshot for env in self.envs if env.saveSnapshot}.values():
+            snapshot.commit()
+
+    def closeExecutors(self):
+        for executor in self.executors.values():
+            executor.shutdown(cancel_futures=True)
+        self.executors = {}
+
+    # Queue the queries of every environment, restricted to one logical database if dbName is set
+    def submitQueries(self, dbName: Optional[str] = None):
+        fingerprints = self.fetchFingerprints(dbName) if self.hashFirst or self.quick else None
+        tasks = []
+        for env in self.envs:
+            if dbName is None:
+                dbLists = [[db] for db in env.dbMap.keys()] if self.splitByDatabase else [None]
+            else:
+                dbLists = [[db for db, name in env.dbMap.items() if name == dbName]]
+
+            queries = self.queries + [self.versionQuery] if env.saveSnapshot is not None else self.queries
+            for query in queries:
+                if not query["condition"]:
+                    continue
+                if fingerprints is not None and "fingerprint" in query and self.quick:
+                    continue
+                for dbList in dbLists:
+                    executor = self.executors[env.number]
+                    if fingerprints is None:
+                        future = executor.submit(self.fetchQuery, env, query, dbList)
+                    elif self.quick and query["granularity"] == "table":
+                        future = executor.submit(self.fetchQuickTables, env, query, dbList, fingerprints)
+                    elif "fingerprint" in query:
+                        tables = self.getChangedTables(fingerprints[query["fingerprint"][0]])
+                        future = executor.submit(self.fetchChangedTables, env, query, dbList, tables)
+                    else:
+                        future = executor.submit(self.fetchQuery, env, query, dbList)
+                    tasks.append((env, query, future))
+
+        return tasks
+
+    def fillResult(self, env: Environment, query, res: QueryResult):
+        if env.saveSnapshot is not None and env.saveSnapshotId is not None:
+            env.saveSnapshot.append(env.saveSnapshotId, query["granularity"], res)
+        if query is self.versionQuery:
+            return
+
+        start = time.perf_counter()
+        envIndex = env.number - 1
+        if "prepareRow" in query:
+            for row in res.rows:
+                query["prepareRow"](row)
+        if "header" not in query:
+            discarded = self.fillArray(res.rows, res.description, envIndex, query["granularity"])
+        else:
+            granularity, nameColumn, headerColumns = query["header"]
+            objectRows: Dict[tuple, List[Dict]] = {}
+            for row in res.rows:
+                objectRows.setdefault((row["DatabaseName"], row["TableName"], row[nameColumn]), []).append(row)
+            headers = []
+            for rows in objectRows.values():
+                signature = query["signature"](rows)
+                for row in rows:
+                    row["Signature"] = signature
+                headers.append(rows[0])
+            headerDescription = self.getSubDescription(res.description, headerColumns)
+            self.fillArray(headers, headerDescription, envIndex, granularity)
+
+            granularity, detailColumns = query["detail"]
+            discarded = self.fillArray(
+                res.rows, self.getSubDescription(res.description, detailColumns), envIndex, granularity
+            )
+
+        if self.metrics is not None:
+            seconds = time.perf_counter() - start
+            self.metrics.addBuild(env.name, query["granularity"], seconds, len(res.rows) - discarded, discarded)
+
+    # Description of the key columns and of a subset of the properties
+    def getSubDescription(self, description, propertyColumns: Tuple[str, ...]):
+        return [colDesc for colDesc in description or [] if colDesc[0] in self.keyColumns + propertyColumns]
 
     def extractMetadata(self):
-        maxRange = 2 * len(self.queries) + 2
-        with ProgressBar(title=f"Extracting metadata") as pb:
-            pb2 = pb(total=maxRange, remove_when_done=True)
-
-            pb.title = f"Connecting to: {self.env1name}"
-            self.env1 = Environment(self.env1name, self.dbCredentials, 1, "green", self.dbSuffixList)
-            pb2.item_completed()
-            pb.title = f"Connecting to: {self.env2name}"
-            self.env2 = Environment(self.env2name, self.dbCredentials, 2, "yellow", self.dbSuffixList)
-            pb2.item_completed()
-            self.envs = [
-                self.env1,
-                self.env2,
-            ]
+        self.openEnvironments()
+        progressBar = (
+            ProgressBar(title=f"Extracting metadata", output=self.progressOutput) if self.showProgress else None
+        )
+        with progressBar or nullcontext() as pb, self.timePhase("extract"):
+            try:
+                tasks = self.submitQueries()
+                pb2 = pb(total=len(tasks), remove_when_done=True) if pb is not None else None
+
+                # Results are merged in submission order so that the tree is the same as with a sequential run.
+                # Processed tasks are dropped so that their rows are freed as soon as they are in the model.
+                tasks.reverse()
+                while tasks:
+                    env, query, future = tasks.pop()
+                    if pb is not None and pb2 is not None:
+                        pb.title = f"Extracting metadata {env.name}:{query['granularity']}"
+                    self.fillResult(env, query, future.result())
+                    if pb2 is not None:
+                        pb2.item_completed()
+                self.fetchDefinitions()
+                self.commitSnapshot()
+            finally:
+                self.closeExecutors()
+
+            if pb is not None and pb2 is not None:
+                pb.title = "done"
+                pb2.done = True
+
+    # Extract one database at a time into self.ddl, to compare and render it before the next one. The next
+    # database is fetched while the current one is compared, so only two databases are held in memory at once.
+    def iterDatabases(self):
+        self.openEnvironments()
+        dbNames = sorted({db.upper(): db for db in self.dbSuffixList}.items())
+        try:
+            pending = self.submitQueries(dbNames[0][1]) if dbNames else []
+            for i in range(len(dbNames)):
+                tasks = pending
+                if i + 1 < len(dbNames):
+                    pending = self.submitQueries(dbNames[i + 1][1])
+
+                self.ddl = {}
+                self.propertyPool = {}
+                tasks.reverse()
+                with self.timePhase("extract"):
+                    while tasks:
+                        env, query, future = tasks.pop()
+                        self.fillResult(env, query, future.result())
+                    self.fetchDefinitions()
+                yield dbNames[i][1]
+            self.commitSnapshot()
+        finally:
+            self.closeExecutors()
+            self.ddl = {}
+            self.propertyPool = {}
+
+    # Query one table again in every environment once the comparison is done, and replace it in the model. Returns
+    # the new table, None if no environment holds it anymore.
+    def refreshTable(self, dbName: str, tbName: str) -> Optional[Table]:
+        self.executors = {env.number: ThreadPoolExecutor(max_workers=env.maxSessions) for env in self.envs}
+        try:
+            tasks = []
+            for env in self.envs:
+                for query in self.queries:
+                    if not query["condition"]:
+                        continue
+                    restriction = self.getTableRestriction(env, {(dbName, tbName)}, *query["tableColumns"])
+                    sql = query["sql"](env, None, restriction)
+                    future = self.executors[env.number].submit(self.executeQuery, env, sql, query["granularity"])
+                    tasks.append((env, query, future))
+            results = [(env, query, future.result()) for env, query, future in tasks]
+
+            database = self.ddl.get(dbName)
+            if database is not None:
+                database.tables.pop(tbName, None)
+            for env, query, res in results:
+                self.fillResult(env, query, res)
+
+            database = self.ddl.get(dbName)
+            table = database.tables.get(tbName) if database is not None else None
+            if table is not None:
+                self.fetchDefinitions([(dbName, table)])
+            return table
+        finally:
+            self.closeExecutors()
+
+    # Estimates of Teradata for each query of the comparison, without running them
+    def explainQueries(self) -> List[QueryCost]:
+        self.openEnvironments()
+        costs = []
+        try:
             for env in self.envs:
+                dbLists = [[db] for db in env.dbMap.keys()] if self.splitByDatabase else [None]
                 for query in self.queries:
-                    granularity = query["granularity"]
-                    pb.title = f"Extracting metadata {env.name}:{granularity}"
-                    # print(f"\t{granularity}")
-                    sql = query["sql"](env)
-                    # print(sql)
-                    res = env.cur.execute(sql)
-                    objRows = self.array2Obj(res)
-                    # print(objRows)
-                    otherEnv = 1 if env.number == 2 else 2
-                    self.fillArray(objRows, res, f"env{env.number}", f"env{otherEnv}", granularity)
-                    pb2.item_completed()
-
-            pb.title = "done"
-            pb2.done = True
-
-    def array2Obj(self, res: teradatasql.TeradataCursor):
-        rows: List[List] = res.fetchall()
-        header = res.description
+                    if not query["condition"]:
+                        continue
+                    for dbList in dbLists:
+                        cur = env.acquireSession()
+                        try:
+                            cur.execute("EXPLAIN " + query["sql"](env, dbList))
+                            explanation = "\n".join(str(row[0]) for row in cur.fetchall())
+                        finally:
+                            env.releaseSession(cur)
+                        granularity = query["granularity"] + (f" {dbList[0]}" if dbList else "")
+                        costs.append(QueryCost(env.name, granularity, explanation))
+        finally:
+            self.closeExecutors()
+
+        return costs
+
+    # Share maxSessions between the environments hosted on the same server, exits if one of them would get no session
+    def setSessionLimits(self):
+        envsPerHost = self.getEnvironmentsPerHost()
+        for host, envCount in envsPerHost.items():
+            if envCount > self.maxSessions:
+                print(
+                    f"{envCount} environments are compared on {host}, each one needs a session: raise --max-sessions "
+                    f"to {envCount}"
+                )
+                exit(1)
+
+        for env in self.envs:
+            env.maxSessions = self.maxSessions // envsPerHost[env.host]
+
+    # Number of compared environments hosted on each server
+    def getEnvironmentsPerHost(self) -> Dict[str, int]:
+        envsPerHost: Dict[str, int] = {}
+        for envName in self.envNames:
+            host = self.dbCredentials.getCredentials(envName)[0].host
+            envsPerHost[host] = envsPerHost.get(host, 0) + 1
+        return envsPerHost
+
+    def fetchQuery(self, env: Environment, query, dbList: Optional[List[str]] = None) -> QueryResult:
+        if env.snapshot is not None and env.snapshotId is not None:
+            dbNames = [env.dbMap[db] for db in dbList or env.dbMap.keys()]
+            return env.snapshot.read(env.snapshotId, query["granularity"], dbNames, self.tableFilterPattern)
+
+        if self.cache is not None:
+            return self.fetchCachedQuery(env, query, dbList)
+
+        if env.refresh is not None:
+            if query is self.versionQuery:
+                return env.refresh.versions
+            if query.get("incremental", False):
+                return self.fetchRefreshedQuery(env, query, dbList)
+
+        return self.executeQuery(env, query["sql"](env, dbList), query["granularity"])
+
+    # Rows of the unchanged tables come from the previous snapshot, the others are queried again
+    def fetchRefreshedQuery(self, env: Environment, query, dbList: Optional[List[str]] = None) -> QueryResult:
+        refresh = env.refresh
+        assert refresh is not None
+        byChild = "childTableColumns" in query
+        dbNames = [env.dbMap[db] for db in dbList or env.dbMap.keys()]
+        upperDbNames = {db.upper() for db in dbNames}
+        staleTables = {key for key in refresh.getStaleTables(byChild) if key[0] in upperDbNames}
+
+        if len(staleTables) > self.maxRefreshTables:
+            return self.executeQuery(env, query["sql"](env, dbList), query["granularity"])
+
+        cached = refresh.snapshot.read(refresh.snapshotId, query["granularity"], dbNames, self.tableFilterPattern)
+        rows = [row for row in cached.rows if not refresh.isStale(row, byChild)]
+        if staleTables:
+            restriction = self.getTableRestriction(env, staleTables, *query["tableColumns"])
+            rows += self.executeQuery(env, query["sql"](env, dbList, restriction), query["granularity"]).rows
+
+        return QueryResult(cached.description, rows)
+
+    # One result per database in the cache, the expired ones are queried again together
+    def fetchCachedQuery(self, env: Environment, query, dbList: Optional[List[str]] = None) -> QueryResult:
+        cache = self.cache
+        assert cache is not None
+        dbs = list(dbList or env.dbMap.keys())
+        with cache.getLoadLock(env.name, self.app, query["granularity"]):
+            results: Dict[str, QueryResult] = {}
+            for db in dbs:
+                cached = cache.get((env.name, query["granularity"], db))
+                if cached is not None:
+                    results[db] = cached
+            missing = [db for db in dbs if db not in results]
+            if missing:
+                res = self.executeQuery(env, query["sql"](env, missing), query["granularity"])
+                physicalNames = {env.dbMap[db].upper(): db for db in missing}
+                rowsByDb: Dict[str, List[Dict]] = {db: [] for db in missing}
+                for row in res.rows:
+                    rowsByDb[physicalNames[row["DatabaseName"].upper()]].append(row)
+                for db in missing:
+                    results[db] = QueryResult(res.description, rowsByDb[db])
+                    cache.put((env.name, query["granularity"], db), results[db])
+
+        description = next((res.description for res in results.values() if res.description), None)
+        return QueryResult(description, [row for db in dbs for row in results[db].rows])
+
+    # Text of the definitions whose hashes differ, or that are too long to be hashed, queried with SHOW on the
+    # sessions of each environment. The texts replace the hashes in the model, the texts that only differ in
+    # whitespace, case or CREATE / REPLACE are replaced by the same text. The snapshots only hold the hashes.
+    def fetchDefinitions(self, tables: Optional[List[Tuple[str, Table]]] = None):
+        if self.quick:
+            return
+
+        tasks = []
+        for dbName, tbName, definition, envs in self.getChangedDefinitions(tables):
+            futures = []
+            for env in envs:
+                executor = self.executors[env.number]
+                futures.append((env, executor.submit(self.fetchDefinition, env, dbName, tbName, definition.name)))
+            tasks.append((definition, futures))
+
+        for definition, futures in tasks:
+            texts: Dict[str, str] = {}
+            for env, future in futures:
+                text = future.result()
+                text = texts.setdefault(self.normalizeDefinition(text), text)
+                self.setProperties(definition, env.number - 1, (text,))
+
+    # Definitions held by several environments, not read from a snapshot, with different hashes or without hash, in
+    # the (logical database, table) of tables or in the whole model
+    def getChangedDefinitions(self, tables: Optional[Iterable[Tuple[str, Table]]] = None):
+        if tables is None:
+            tables = ((dbName, table) for dbName, database in self.ddl.items() for table in database.tables.values())
+        for dbName, table in tables:
+            for definition in table.definitions.values():
+                envs = [env for env in self.envs if definition.isIn(env.number - 1)]
+                hashes = {(definition.getProperties(env.number - 1) or (None,))[0] for env in envs}
+                if len(envs) < 2 or (len(hashes) == 1 and None not in hashes):
+                    continue
+                if all(env.snapshot is None for env in envs):
+                    yield dbName, table.name, definition, envs
+
+    # Text of a definition, with the logical names of the databases
+    def fetchDefinition(self, env: Environment, dbName: str, tbName: str, kind: str) -> str:
+        physicalNames = {name.upper(): db for db, name in env.dbMap.items()}
+        objectName = ".".join('"' + name.replace('"', '""') + '"' for name in (physicalNames[dbName], tbName))
+        res = self.executeQuery(env, f"SHOW {kind} {objectName}", "definitionText")
+        text = "\n".join(str(value) for row in res.rows for value in row.values() if value is not None)
+        return env.dbTextRegex.sub(r"\1", text.replace("\r\n", "\n").replace("\r", "\n"))
+
+    # Length and hash of getSqlDbcDefinitions left in place of the text of a definition, or None for a text too long
+    # to be hashed: the definitions read from a snapshot or that were not fetched
+    def isDefinitionHash(self, text) -> bool:
+        return text is None or re.fullmatch(r"\d+ chars #[0-9a-f]+", str(text)) is not None
+
+    # Same normalization as the hashes of getSqlDbcDefinitions, on the texts with the logical database names
+    def normalizeDefinition(self, text: str) -> str:
+        text = " ".join(text.split()).upper()
+        return "REPLACE " + text[len("CREATE ") :] if text.startswith("CREATE ") else text
+
+    # Fingerprint of the detail rows of each table, by fingerprint name and (logical database, table), with the value
+    # of each environment
+    def fetchFingerprints(self, dbName: Optional[str] = None) -> Dict[str, Dict[Tuple[str, str], List]]:
+        futures = []
+        for env in self.envs:
+            dbList = None if dbName is None else [db for db, name in env.dbMap.items() if name == dbName]
+            for query in self.queries:
+                if query["condition"] and "fingerprint" in query:
+                    sql = self.getSqlFingerprints(env, query, dbList)
+                    future = self.executors[env.number].submit(self.executeQuery, env, sql, query["fingerprint"][0])
+                    futures.append((env, query, future))
+
+        fingerprints: Dict[str, Dict[Tuple[str, str], List]] = {}
+        for env, query, future in futures:
+            tables = fingerprints.setdefault(query["fingerprint"][0], {})
+            for row in future.result().rows:
+                values = tables.setdefault(
+                    (row["DatabaseName"].upper(), row["TableName"].upper()), [None] * len(self.envs)
+                )
+                values[env.number - 1] = f"{row['RowCount']} rows #{int(row['RowHash']):05x}{int(row['RowHash2']):05x}"
+        return fingerprints
+
+    def getChangedTables(self, fingerprints: Dict[Tuple[str, str], List]) -> Set[Tuple[str, str]]:
+        return {key for key, values in fingerprints.items() if len(set(values)) > 1}
+
+    # Details of the tables whose fingerprints differ only, or of all of them when there are too many
+    def fetchChangedTables(
+        self, env: Environment, query, dbList: Optional[List[str]], tables: Set[Tuple[str, str]]
+    ) -> QueryResult:
+        upperDbNames = {env.dbMap[db].upper() for db in dbList or env.dbMap.keys()}
+        tables = {key for key in tables if key[0] in upperDbNames}
+        if len(tables) > self.maxRefreshTables:
+            return self.fetchQuery(env, query, dbList)
+        if not tables:
+            return QueryResult(None, [])
+
+        restriction = self.getTableRestriction(env, tables, *query["tableColumns"])
+        return self.executeQuery(env, query["sql"](env, dbList, restriction), query["granularity"])
+
+    # Rows of the tables with the fingerprints of their details as properties. The rows are copied, the ones of the
+    # cache are shared by the comparisons of the daemon.
+    def fetchQuickTables(self, env: Environment, query, dbList: Optional[List[str]], fingerprints) -> QueryResult:
+        res = self.fetchQuery(env, query, dbList)
+        rows = []
+        for row in res.rows:
+            key = (row["DatabaseName"].upper(), row["TableName"].upper())
+            row = dict(row)
+            for name, tables in fingerprints.items():
+                row[name] = tables.get(key, [None] * len(self.envs))[env.number - 1]
+            rows.append(row)
+        return QueryResult(list(res.description or []) + [(name, None) for name in fingerprints], rows)
+
+    def executeQuery(self, env: Environment, sql: str, granularity: str) -> QueryResult:
+        cur = env.acquireSession()
+        try:
+            start = time.perf_counter()
+            res = cur.execute(sql)
+            description = res.description
+            executed = time.perf_counter()
+            fetchedRows = res.fetchall()
+            if self.metrics is not None:
+                size = self.metrics.getSize(fetchedRows)
+                self.metrics.addQuery(
+                    env.name, granularity, executed - start, time.perf_counter() - executed, len(fetchedRows), size
+                )
+            rows = self.rows2Obj(fetchedRows, description)
+        finally:
+            env.releaseSession(cur)
+
+        if not self.sortedQueries:
+            for row in rows:
+                for dbColumn in ("DatabaseName", "ChildDatabase"):
+                    if dbColumn in row:
+                        row[dbColumn] = env.getDbName(row[dbColumn])
+        return QueryResult(description, rows)
+
+    def rows2Obj(self, rows: List[List], header) -> List[Dict]:
         output = []
         if header is not None:
             for row in rows:
@@ -149,14 +837,70 @@ class CompareEnv(object):
 
         return output
 
-    def dbList2whereSqlList(self, env: Environment) -> str:
-        dbListStr = ",".join(map(lambda db: f"'{db}'", env.dbMap.keys()))
+    def dbList2whereSqlList(self, env: Environment, dbList: Optional[List[str]] = None) -> str:
+        dbListStr = ",".join(map(lambda db: f"'{db}'", dbList or env.dbMap.keys()))
         return f"({dbListStr})"
 
-    def getSqlDbcTables(self, env: Environment):
+    # Where clause restricting a query to a set of (logical database, table) keys
+    def getTableRestriction(self, env: Environment, tables: Set[Tuple[str, str]], dbColumn: str, tableColumn: str):
+        physicalNames = {name.upper(): db for db, name in env.dbMap.items()}
+        tablesByDb: Dict[str, List[str]] = {}
+        for dbName, tbName in sorted(tables):
+            tablesByDb.setdefault(physicalNames[dbName], []).append(tbName.replace("'", "''"))
+
+        conditions = []
+        for db, tbNames in tablesByDb.items():
+            tbListStr = ",".join(map(lambda tb: f"'{tb}'", tbNames))
+            conditions.append(f"({dbColumn} = '{db}' and {tableColumn} in ({tbListStr}))")
+
+        return " and (" + "\n                    or ".join(conditions) + ")"
+
+    # Logical name of the databases. Only the merge engine needs the rows sorted by logical name, otherwise the
+    # physical names are mapped on the client by Environment.getDbName
+    def getSqlDbName(self, env: Environment, column: str) -> str:
+        if self.sortedQueries:
+            return f"REGEXP_REPLACE({column}, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i')"
+        return column
+
+    # The cached results are shared by the comparisons of the daemon, the -t patterns are only checked on their rows
+    def getSqlTableFilter(self) -> str:
+        return self.ruleTableFilter if self.cache is not None else self.tableFilter
+
+    def getSqlOrderBy(self) -> str:
+        return "order by 1, 2" if self.sortedQueries else ""
+
+    # Number of rows and sums of their hashes, by table. The columns are normalized by the property rules like the
+    # values compared on the client, and the ignored properties are left out. HASHBUCKET gives an integer that can
+    # be summed, two hashes of the columns in different orders make a collision unlikely.
+    def getSqlFingerprints(self, env: Environment, query, dbList: Optional[List[str]] = None) -> str:
+        columns = []
+        for column in query["fingerprint"][1]:
+            if "header" in query and column in query["header"][2]:
+                granularity = query["header"][0]
+            else:
+                granularity = query["detail"][0] if "detail" in query else query["granularity"]
+            expression = None
+            if column == "ChildDatabase" and not self.sortedQueries:
+                expression = f"REGEXP_REPLACE(ChildDatabase, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i')"
+            sqlValue = self.propertyComparator.getSqlValue(TYPE_NAMES[granularity], column, expression)
+            if sqlValue is not None:
+                columns.append(sqlValue)
+
+        return f"""
+            SELECT
+                  DatabaseName
+                , TableName
+                , count(*) as RowCount
+                , sum(cast(hashbucket(hashrow({", ".join(columns)})) as bigint)) as RowHash
+                , sum(cast(hashbucket(hashrow({", ".join(reversed(columns))})) as bigint)) as RowHash2
+            FROM ({query["sql"](env, dbList)}) details
+            group by 1, 2
+        """
+
+    def getSqlDbcTables(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
         sql = f"""
             SELECT
-                  REGEXP_REPLACE(DatabaseName, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
+                  {self.getSqlDbName(env, "DatabaseName")} as DatabaseName
                 , TableName
                 , TableKind
                 , ProtectionType
@@ -165,17 +909,101 @@ class CompareEnv(object):
                 , PIColumnCount
                 , PartitioningLevels
             FROM DBC.TablesV
-            where DataBaseName in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            order by DatabaseName, TableName
+            where DataBaseName in {self.dbList2whereSqlList(env, dbList)}
+                {self.getSqlTableFilter()}
+                {restriction}
+            {self.getSqlOrderBy()}
         """
         return sql
 
-    def getSqlDbcColumns(self, env: Environment):
+    # Length and hash of the normalized text of each definition: database names replaced by their logical name,
+    # whitespace collapsed, upper case and CREATE replaced by REPLACE. The texts that may be truncated have no hash.
+    def getSqlDbcDefinitions(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
+        return f"""
+            SELECT
+                  DatabaseName
+                , TableName
+                , DefinitionKind
+                , case when Truncated = 'N'
+                    then trim(character_length(Definition)) || ' chars #' || lower(from_bytes(hashrow(Definition), 'base16'))
+                    else null end as RequestText
+            FROM (
+                SELECT
+                      {self.getSqlDbName(env, "DatabaseName")} as DatabaseName
+                    , TableName
+                    , case when TableKind = 'V' then 'VIEW'
+                        when TableKind = 'M' then 'MACRO'
+                        when TableKind = 'P' then 'PROCEDURE'
+                        else 'JOIN INDEX' end as DefinitionKind
+                    , case when character_length(RequestText) < {self.maxRequestTextLength} then 'N' else 'Y' end as Truncated
+                    , REGEXP_REPLACE(
+                        upper(trim(REGEXP_REPLACE(
+                            REGEXP_REPLACE(RequestText, '{env.dbTextRegexStr}', '\\1', 1, 0, 'i'), '\\s+', ' ', 1, 0, 'c'
+                        ))), '^CREATE ', 'REPLACE ', 1, 1, 'c'
+                    ) as Definition
+                FROM DBC.TablesV
+                where DataBaseName in {self.dbList2whereSqlList(env, dbList)}
+                    and TableKind in ('V', 'M', 'P', 'I')
+                    {self.getSqlTableFilter()}
+                    {restriction}
+            ) definitions
+            {self.getSqlOrderBy()}
+        """
+
+    # Permanent space of each table summed over the AMPs, skew as the ratio of the biggest AMP to the average (1 when
+    # the rows are evenly distributed) and whether statistics are collected on the table, their number changes with
+    # the queries run on each environment
+    def getSqlDbcSpace(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
+        return f"""
+            SELECT
+                  {self.getSqlDbName(env, "sizes.DatabaseName")} as DatabaseName
+                , sizes.TableName
+                , 'PERM' as SpaceKind
+                , sizes.CurrentPerm
+                , sizes.AmpSkew
+                , case when stats.TableName is null then 'N' else 'Y' end as HasStatistics
+            FROM (
+                SELECT
+                      DataBaseName as DatabaseName
+                    , TableName
+                    , sum(CurrentPerm) as CurrentPerm
+                    , cast(max(CurrentPerm) / nullifzero(avg(CurrentPerm)) as decimal(9, 2)) as AmpSkew
+                FROM DBC.TableSizeV
+                where DataBaseName in {self.dbList2whereSqlList(env, dbList)}
+                    {self.getSqlTableFilter()}
+                    {restriction}
+                group by 1, 2
+            ) sizes
+            left join (
+                SELECT DISTINCT
+                      DatabaseName
+                    , TableName
+                FROM DBC.StatsV
+                where DatabaseName in {self.dbList2whereSqlList(env, dbList)}
+                    {self.getSqlTableFilter()}
+            ) stats
+                on stats.DatabaseName = sizes.DatabaseName
+                and stats.TableName = sizes.TableName
+            {self.getSqlOrderBy()}
+        """
+
+    def getSqlDbcTableVersions(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
+        return f"""
+            SELECT
+                  {self.getSqlDbName(env, "DatabaseName")} as DatabaseName
+                , TableName
+                , CreateTimeStamp
+                , LastAlterTimeStamp
+            FROM DBC.TablesV
+            where DataBaseName in {self.dbList2whereSqlList(env, dbList)}
+                {self.getSqlTableFilter()}
+                {restriction}
+        """
+
+    def getSqlDbcColumns(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
         return f"""
             SELECT
-                  REGEXP_REPLACE(DatabaseName, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
+                  {self.getSqlDbName(env, "DatabaseName")} as DatabaseName
                 , TableName
                 , ColumnName
                 , ColumnFormat
@@ -185,49 +1013,36 @@ class CompareEnv(object):
                 --, CommentString
                 , UpperCaseFlag
             FROM DBC.ColumnsV
-            where DatabaseName in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            order by DatabaseName, TableName, ColumnName
+            where DatabaseName in {self.dbList2whereSqlList(env, dbList)}
+                {self.getSqlTableFilter()}
+                {restriction}
+            {self.getSqlOrderBy()}
             """
 
-    def getSqlDbcConstraints(self, env: Environment):
+    # The name of the unnamed foreign keys is set by prepareConstraintRow
+    def getSqlDbcConstraints(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
         return f"""
             SELECT
-                  REGEXP_REPLACE(ParentDB, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
+                  {self.getSqlDbName(env, "ParentDB")} as DatabaseName
                 , ParentTable                                       as TableName
-                , coalesce(IndexName, ChildDatabase || '_' || ChildTable || '_' || trim(IndexID))   as ConstraintName
-                , REGEXP_REPLACE(ChildDB, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as ChildDatabase
+                , IndexName                                         as ConstraintName
+                , {self.getSqlDbName(env, "ChildDB")} as ChildDatabase
                 , IndexName
                 , ChildTable
-            FROM DBC.All_RI_ChildrenV
-            where ParentDB in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            group by 1,2,3,4,5,6
-            order by DatabaseName, TableName, ConstraintName
-        """
-
-    def getSqlDbcConstraintColumns(self, env: Environment):
-        return f"""
-            SELECT
-                  REGEXP_REPLACE(ParentDB, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
-                , ParentTable                                        as TableName
-                , coalesce(IndexName, REGEXP_REPLACE(ChildDB, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i')
-                    || '_' || ChildTable || '_' || trim(IndexID))   as ConstraintName
+                , IndexID
                 , ParentKeyColumn                                    as ColumnName
                 , ChildKeyColumn
             FROM DBC.All_RI_ChildrenV
-            where ParentDB in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            order by DatabaseName, TableName, ConstraintName, ChildKeyColumn
+            where ParentDB in {self.dbList2whereSqlList(env, dbList)}
+                {self.getSqlTableFilter()}
+                {restriction}
+            {self.getSqlOrderBy()}
         """
 
-    def getSqlDbcIndices(self, env: Environment):
+    def getSqlDbcIndices(self, env: Environment, dbList: Optional[List[str]] = None, restriction: str = ""):
         return f"""
             SELECT
-                  REGEXP_REPLACE(DatabaseName, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
+                  {self.getSqlDbName(env, "DatabaseName")} as DatabaseName
                 , TableName
                 --, case when IndexName is not null and IndexType <> 'P' then IndexName else TableName || '_' || IndexType || '_' || trim(IndexNumber) end as IndexCode
                 , TableName || '_' || IndexType || '_' || trim(IndexNumber) as IndexCode
@@ -235,287 +1050,135 @@ class CompareEnv(object):
                 , IndexNumber
                 , IndexType
                 , UniqueFlag
-            FROM DBC.IndicesV i
-            where DatabaseName in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            group by 1,2,3,4,5,6,7
-            order by 1,2,3,4,5,6,7
-        """
-
-    def getSqlDbcIndexColumns(self, env: Environment):
-        return f"""
-            SELECT
-                  REGEXP_REPLACE(DatabaseName, '^{env.dbRegexStr}$', '\\1', 1, 1, 'i') as DatabaseName
-                , TableName
-                --, case when IndexName is not null and IndexType <> 'P' then IndexName else TableName || '_' || IndexType || '_' || trim(IndexNumber) end as IndexCode
-                , TableName || '_' || IndexType || '_' || trim(IndexNumber) as IndexCode
                 , ColumnName
                 , ColumnPosition
             FROM DBC.IndicesV
-            where DatabaseName in {self.dbList2whereSqlList(env)}
-                {self.tableFilter}
-                {self.backupTableFilter}
-            order by 1,2,3,4,5
+            where DatabaseName in {self.dbList2whereSqlList(env, dbList)}
+                {self.getSqlTableFilter()}
+                {restriction}
+            {self.getSqlOrderBy()}
         """
 
-    def fillArray(self, dbcColumns, res, envName, otherEnv, granularity):
-        for line in dbcColumns:
-            dbName = line["DatabaseName"].upper()
-            tbName = line["TableName"].upper()
-
-            if (
-                re.search("_P[0-9]{3}_S[0-9]{3}$", tbName)
-                or re.search("_[0-9]{8}$", tbName)
-                or tbName.endswith(("_1", "_2", "_ET"))
-            ):
-                continue
-
-            if dbName not in self.ddl:
-                self.ddl[dbName] = {"name": dbName, envName: True, otherEnv: False, "tables": {}}
-            else:
-                self.ddl[dbName][envName] = True
-
-            tables = self.ddl[dbName]["tables"]
-            if tbName not in tables:
-                tables[tbName] = {
-                    "name": tbName,
-                    envName: True,
-                    otherEnv: False,
-                    "columns": {},
-                    "constraints": {},
-                    "indices": {},
-                }
-            else:
-                tables[tbName][envName] = True
-
-            if granularity == "table":
-                tables[tbName][envName + "Properties"] = self.fillColProperties(line, res)
-
-            if granularity == "col":
-                colName = line["ColumnName"].upper()
-                columns = tables[tbName]["columns"]
-                if colName not in columns:
-                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
-                else:
-                    columns[colName][envName] = True
-
-                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
-
-            if granularity == "constraint":
-                constraintName = line["ConstraintName"].upper()
-                constraints = tables[tbName]["constraints"]
-                if constraintName not in constraints:
-                    constraints[constraintName] = {
-                        "name": constraintName,
-                        "columns": {},
-                        envName: True,
-                        otherEnv: False,
-                    }
-                else:
-                    constraints[constraintName][envName] = True
-
-                constraints[constraintName][envName + "Properties"] = self.fillColProperties(line, res)
-
-            if granularity == "constraintColumns":
-                constraintName = line["ConstraintName"].upper()
-                constraints = tables[tbName]["constraints"]
-                colName = line["ColumnName"].upper()
-                columns = constraints[constraintName]["columns"]
-                if colName not in columns:
-                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
-                else:
-                    columns[colName][envName] = True
-
-                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
-
-            if granularity == "indices":
-                indexCode = line["IndexCode"].upper()
-                indices = tables[tbName]["indices"]
-                if indexCode not in indices:
-                    indices[indexCode] = {"name": indexCode, "columns": {}, envName: True, otherEnv: False}
-                else:
-                    indices[indexCode][envName] = True
-
-                indices[indexCode][envName + "Properties"] = self.fillColProperties(line, res)
-
-            if granularity == "indexColumns":
-                indexCode = line["IndexCode"].upper()
-                indices = tables[tbName]["indices"]
-                colName = line["ColumnName"].upper()
-                columns = indices[indexCode]["columns"]
-                if colName not in columns:
-                    columns[colName] = {"name": colName, envName: True, otherEnv: False}
-                else:
-                    columns[colName][envName] = True
-
-                columns[colName][envName + "Properties"] = self.fillColProperties(line, res)
-
-    def fillColProperties(self, line, res):
-        properties = {}
-        for colDesc in res.description:
-            colName = colDesc[0]
-            if colName not in ["DatabaseName", "TableName", "ColumnName", "IndexCode", "ConstraintName"]:
-                if type(line[colName]) is str:
-                    properties[colName] = line[colName].replace("\r", "\n")
-                else:
-                    properties[colName] = line[colName]
-
-        return properties
-
-    def delete_keys_from_dict(self, dict_del, lst_keys):
-        for k in lst_keys:
-            try:
-                del dict_del[k]
-            except KeyError:
-                pass
-        for v in dict_del.values():
-            if isinstance(v, dict):
-                self.delete_keys_from_dict(v, lst_keys)
-
-        return dict_del
-
-    def merge(self, a, b, path=None):
-        "merges b into a"
-        if path is None:
-            path = []
-        for key in b:
-            if key in a:
-                if isinstance(a[key], dict) and isinstance(b[key], dict):
-                    self.merge(a[key], b[key], path + [str(key)])
-                else:
-                    a[key] = b[key]
-            else:
-                a[key] = b[key]
-        return a
-
-    def mergeObjects(self, obj1, obj2):
+    def prepareConstraintRow(self, row: Dict):
+        if row["ConstraintName"] is None:
+            row["ConstraintName"] = f"{row['ChildDatabase']}_{row['ChildTable']}_{row['IndexID']}"
 
-        if obj2["env1"]:
-            newObj2 = self.delete_keys_from_dict(obj2, ["env2"])
-        else:
-            newObj2 = self.delete_keys_from_dict(obj2, ["env1"])
-
-        return self.merge(obj1, newObj2)
+    # Definition of a foreign key from the rows of its columns, in any order: its child table and its key pairs
+    @staticmethod
+    def getConstraintSignature(rows: List[Dict]) -> str:
+        keyPairs = sorted(f"{row['ColumnName']}={row['ChildKeyColumn']}".upper() for row in rows)
+        return f"{rows[0]['ChildDatabase']}.{rows[0]['ChildTable']}({','.join(keyPairs)})".upper()
 
-    def matchUnnamedObjects(self, objList, objType):
-        newObjectList = {}
+    # Definition of an index from the rows of its columns, in any order: its type, uniqueness and ordered columns
+    @staticmethod
+    def getIndexSignature(rows: List[Dict]) -> str:
+        columns = sorted((row["ColumnPosition"] or 0, row["ColumnName"].upper()) for row in rows)
+        return f"{rows[0]['IndexType']}{rows[0]['UniqueFlag']}({','.join(colName for _, colName in columns)})"
 
-        for name, obj in objList.items():
-            if not (obj["env1"] and obj["env2"]):
-                trueId = ""
-                for name, col in obj["columns"].items():
+    # The table rules are also checked on the fetched rows, for the snapshots extracted with other rules
+    def isExcludedTable(self, tbName: str) -> bool:
+        return self.tableRules.isExcluded(tbName)
 
-                    if objType == "indices":
-                        trueId += "#" + name
-                    elif objType == "constraints":
-                        if obj["env1"]:
-                            trueId += "#" + col["env1Properties"]["ChildKeyColumn"]
-                        else:
-                            trueId += "#" + col["env2Properties"]["ChildKeyColumn"]
-
-                if objType == "constraints":
-                    if obj["env1"]:
-                        childTable = obj["env1Properties"]["ChildDatabase"] + "." + obj["env1Properties"]["ChildTable"]
-                    else:
-                        childTable = obj["env2Properties"]["ChildDatabase"] + "." + obj["env2Properties"]["ChildTable"]
-
-                    trueId = childTable + trueId
-                obj["trueId"] = trueId
-                if trueId in newObjectList:
-
-                    newObjectList[trueId] = self.mergeObjects(obj, newObjectList[trueId])
-                    # pp.pprint(newObjectList[trueId])
-                else:
-                    newObjectList[trueId] = obj
-            else:
-                newObjectList[name] = obj
+    # envIndex is the position of the environment in self.envs. Returns the number of rows of excluded tables
+    def fillArray(self, dbcColumns, description, envIndex: int, granularity: str) -> int:
+        schema = self.getPropertySchema(granularity, description)
+        envBit = 1 << envIndex
+        discarded = 0
 
-        return newObjectList
-
-    # Add one tab to the beginning of each line
-    def addTab(self, string):
-        return "\t".join(string.splitlines(True))
+        for line in dbcColumns:
+            tbName = line["TableName"].upper()
+            if self.isExcludedTable(tbName):
+                discarded += 1
+                continue
 
-    def getDiffObj(self, objects, lvl):
-        diffObjs = ""
-        for name, obj in sorted(objects.items()):
-            # if obj['name'] == 'REF_TERRITORY' or obj['name'] == 'REF_TERRITORY':
-            #     pp.pprint(obj)
+            dbName = line["DatabaseName"].upper()
+            database = self.ddl.get(dbName)
+            if database is None:
+                database = self.ddl[dbName] = Database(sys.intern(dbName))
+            database.presence |= envBit
+            table = self.getChild(database.tables, Table, tbName, envBit)
 
-            diffObj = ""
-            if not obj["env1"]:
-                diffObj = " not in " + colored(self.env1.name, self.env1.color)
-            elif not obj["env2"]:
-                diffObj = " not in " + colored(self.env2.name, self.env2.color)
-            else:
-                diffObjProperties = self.getDiffProperties(obj)
-                if diffObjProperties != "":
-                    diffObj = diffObjProperties
-                for k in obj.keys():
-                    if type(obj[k]) is dict and k != "env1Properties" and k != "env2Properties":
-                        if k == "constraints" or k == "indices":
-                            obj[k] = self.matchUnnamedObjects(obj[k], k)
-                        diffSubObjs = self.getDiffObj(obj[k], lvl + 1)
-                        if diffSubObjs != "":
-                            diffObj += self.addTab("\n" + k + diffSubObjs)
-
-            tableKind = ""
-
-            if "env1Properties" in obj:
-                if "TableKind" in obj["env1Properties"]:
-                    tableKind = obj["env1Properties"]["TableKind"]
-            if tableKind == "":
-                if "env2Properties" in obj:
-                    if "TableKind" in obj["env2Properties"]:
-                        tableKind = obj["env2Properties"]["TableKind"]
-            if tableKind != "":
-                objName = "(" + tableKind + ") " + obj["name"]
+            if granularity == "table":
+                obj: MetaObject = table
+            elif granularity == "col":
+                obj = self.getChild(table.columns, Column, line["ColumnName"], envBit)
+            elif granularity == "constraint":
+                constraint = self.getChild(table.constraints, Constraint, line["ConstraintName"], envBit)
+                constraint.signature = constraint.signature or line["Signature"]
+                obj = constraint
+            elif granularity == "constraintColumns":
+                constraint = self.getChild(table.constraints, Constraint, line["ConstraintName"], envBit)
+                obj = self.getChild(constraint.columns, ConstraintColumn, line["ColumnName"], envBit)
+            elif granularity == "indices":
+                index = self.getChild(table.indices, Index, line["IndexCode"], envBit)
+                index.signature = index.signature or line["Signature"]
+                obj = index
+            elif granularity == "indexColumns":
+                index = self.getChild(table.indices, Index, line["IndexCode"], envBit)
+                obj = self.getChild(index.columns, IndexColumn, line["ColumnName"], envBit)
+            elif granularity == "definition":
+                obj = self.getChild(table.definitions, Definition, line["DefinitionKind"], envBit)
+            elif granularity == "space":
+                obj = self.getChild(table.space, Space, line["SpaceKind"], envBit)
             else:
-                objName = obj["name"]
-
-            if diffObj != "":
-                diffObjs += (
-                    "\n" + colored(objName, self.colors[lvl]["name"], attrs=self.colors[lvl]["attrs"]) + diffObj
-                )
-
-        if diffObjs != "" and lvl > 0:
-            return self.addTab(diffObjs)
-        elif diffObjs != "" and lvl == 0:
-            return diffObjs
-        else:
-            return ""
-
-    def getDiffProperties(self, obj):
-        if "env1Properties" not in obj:
-            return ""
-        diffObjProperties = ""
-        # pp.pprint(obj)
-        for propName, val1 in obj["env1Properties"].items():
-            if propName.lower() == "commentstring" and "comments" in self.ignoreProperties:
-                continue
-            if propName.lower() in self.ignoreProperties:
                 continue
 
-            if val1 is None:
-                val1 = "Null"
-
-            val2 = obj["env2Properties"][propName]
-            if val2 is None:
-                val2 = "Null"
-
-            if propName == "ColumnFormat":
-                if val1.upper() == "YYYY-MM-DD":
-                    val1 = "YY/MM/DD"
-                if val2.upper() == "YYYY-MM-DD":
-                    val2 = "YY/MM/DD"
-
-            if val1 != val2:
-                diffObjProperties += (
-                    "\n" + propName + " : " + colored(val1, self.env1.color) + " -> " + colored(val2, self.env2.color)
-                )
-
-        if diffObjProperties != "":
-            return self.addTab(diffObjProperties)
-        else:
-            return ""
+            self.setProperties(obj, envIndex, self.fillColProperties(line, schema))
+
+        return discarded
+
+    def getChild(self, children: Dict, cls, name: str, envBit: int):
+        name = name.upper()
+        obj = children.get(name)
+        if obj is None:
+            name = sys.intern(name)
+            obj = children[name] = cls(name)
+        obj.presence |= envBit
+        return obj
+
+    # Names of the properties of a granularity, in the order of the property tuples
+    def getPropertySchema(self, granularity: str, description) -> Tuple[str, ...]:
+        names = tuple(sys.intern(colDesc[0]) for colDesc in description or [] if colDesc[0] not in self.keyColumns)
+        if not names:
+            return self.propertySchemas.get(granularity, ())
+
+        schema = self.propertySchemas.setdefault(granularity, names)
+        if schema != names:
+            raise Exception(f"{granularity} rows do not have the same columns in all environments")
+        return schema
+
+    # Properties are immutable tuples, equal ones (most columns share the same type, format and flags) are stored once
+    def fillColProperties(self, line, schema: Tuple[str, ...]) -> tuple:
+        values = []
+        for colName in schema:
+            value = line[colName]
+            if type(value) is str:
+                value = sys.intern(value.replace("\r", "\n"))
+            values.append(value)
+
+        properties = tuple(values)
+        return self.propertyPool.setdefault(properties, properties)
+
+    # The tuples of the properties of all the environments are pooled as well: an object defined the same way in
+    # every environment shares them with all the objects like it
+    def setProperties(self, obj: MetaObject, envIndex: int, properties: Optional[tuple]):
+        sides = obj.properties or (None,) * len(self.envs)
+        sides = sides[:envIndex] + (properties,) + sides[envIndex + 1 :]
+        obj.properties = self.propertyPool.setdefault(sides, sides)
+
+    # Bits of all the environments, the objects are compared in the environments of a mask
+    def getAllEnvs(self) -> int:
+        return (1 << len(self.envs)) - 1
+
+    def getDifferences(self) -> List[Difference]:
+        with self.timePhase("diff"):
+            return DiffEngine(self).diff(self.ddl, self.diffProcesses)
+
+    # Time of a phase of the comparison, added to the metrics when they are exported
+    def timePhase(self, name: str):
+        return self.metrics.phase(name) if self.metrics is not None else nullcontext()
+
+    # Properties of the -ip option, ignored by the comparison like the ignored properties of the property rules
+    def setIgnoredProperties(self, propNames: List[str]):
+        self.ignoreProperties = propNames
+        self.propertyComparator = PropertyComparator(self.dbCredentials.conf.propertyRules, propNames)
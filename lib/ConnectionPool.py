@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import teradatasql
+
+
+class ConnectionPool(object):
+    """Connections kept open between the comparisons of the daemon, by connection string (server and user). A
+    connection idle for more than maxIdle seconds may have been closed by the server, it is not reused."""
+
+    def __init__(self, maxIdle: float = 600):
+        self.maxIdle = maxIdle
+        self.idle: Dict[str, List[Tuple[float, teradatasql.TeradataConnection]]] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, connectionStr: str) -> teradatasql.TeradataConnection:
+        expired = []
+        conn = None
+        with self.lock:
+            connections = self.idle.get(connectionStr, [])
+            while connections and conn is None:
+                releaseTime, candidate = connections.pop()
+                if time.monotonic() - releaseTime > self.maxIdle:
+                    expired.append(candidate)
+                else:
+                    conn = candidate
+
+        for candidate in expired:
+            self.closeConnection(candidate)
+        return conn if conn is not None else teradatasql.connect(connectionStr)
+
+    def release(self, connectionStr: str, conn: teradatasql.TeradataConnection):
+        with self.lock:
+            self.idle.setdefault(connectionStr, []).append((time.monotonic(), conn))
+
+    # Close the idle connections, after an error that may have broken them
+    def clear(self):
+        with self.lock:
+            connections = [conn for idle in self.idle.values() for _, conn in idle]
+            self.idle = {}
+        for conn in connections:
+            self.closeConnection(conn)
+
+    def closeConnection(self, conn: teradatasql.TeradataConnection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getIdleCount(self) -> int:
+        with self.lock:
+            return sum(len(idle) for idle in self.idle.values())
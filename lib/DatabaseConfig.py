@@ -1,10 +1,16 @@
 import argparse
 import json
 import os
+import re
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from pydantic import BaseSettings, Extra
+from pydantic import BaseSettings, Extra, root_validator
+
+from lib.Metadata import TYPE_NAMES
+
+# Object types named by the property rules and the accepted differences
+OBJECT_TYPES = tuple(TYPE_NAMES.values())
 
 
 class Settings(BaseSettings):
@@ -29,15 +35,142 @@ class Server(Settings):
     environments: List[Environment]
 
 
+class TableRule(Settings):
+    """Table name pattern, either a LIKE pattern (escape character: backslash) or a regular expression"""
+
+    like: Optional[str] = None
+    regex: Optional[str] = None
+
+    @root_validator(skip_on_failure=True)
+    def checkPattern(cls, values):
+        if (values.get("like") is None) == (values.get("regex") is None):
+            raise ValueError("a table rule needs either a like or a regex pattern")
+        return values
+
+
+class TableRules(Settings):
+    # Partition, staging, error and backup tables
+    defaultExclusions: bool = True
+    include: List[TableRule] = []
+    exclude: List[TableRule] = []
+
+
+class PropertyRule(Settings):
+    """Comparison of a property of the objects of the given types (table, column, constraint, constraint_column,
+    index, index_column, definition, space), of all types if none is given"""
+
+    property: str
+    objects: List[str] = []
+    ignore: bool = False
+    # Other values of the list compared and shown as the first one, they are matched without case
+    equivalent: List[str] = []
+    # Regular expression replaced in the values before they are compared
+    regex: Optional[str] = None
+    replace: str = ""
+    ignoreCase: bool = False
+    # Numbers compared as equal when their difference is at most this share of the biggest one
+    tolerance: Optional[float] = None
+
+    @root_validator(skip_on_failure=True)
+    def checkRule(cls, values):
+        unknown = [typeName for typeName in values.get("objects", []) if typeName not in OBJECT_TYPES]
+        if unknown:
+            raise ValueError(f"unknown object types {', '.join(unknown)}, choose in {', '.join(OBJECT_TYPES)}")
+        if values.get("regex") is not None:
+            try:
+                re.compile(values["regex"])
+            except re.error as e:
+                raise ValueError(f"invalid regex {values['regex']}: {e}")
+        if values.get("tolerance") is not None and not 0 <= values["tolerance"] < 1:
+            raise ValueError(f"tolerance {values['tolerance']} is not between 0 and 1")
+        return values
+
+
+class AcceptedDifference(Settings):
+    """Known difference between the environments. % matches any characters in the names (escape character:
+    backslash), _ is a plain character as in most object names. Without property, the object is accepted as a whole
+    with its children: the database, the table, or the objects of the type and name given"""
+
+    database: str = "%"
+    table: Optional[str] = None
+    type: Optional[str] = None
+    name: Optional[str] = None
+    property: Optional[str] = None
+    reason: Optional[str] = None
+
+    @root_validator(skip_on_failure=True)
+    def checkDifference(cls, values):
+        if values.get("type") is not None:
+            regex = ".*".join(map(re.escape, values["type"].lower().split("%")))
+            if not any(re.fullmatch(regex, typeName) for typeName in OBJECT_TYPES):
+                raise ValueError(f"unknown object type {values['type']}, choose in {', '.join(OBJECT_TYPES)}")
+        if values["database"] == "%" and all(values.get(key) is None for key in ("table", "type", "name", "property")):
+            raise ValueError("the difference accepts every difference, give a table, a type, a name or a property")
+        return values
+
+
+class AcceptedDifferences(Settings):
+    differences: List[AcceptedDifference] = []
+
+
+class BatchApp(Settings):
+    """Application of a batch job, its databases are named by databaseNamePattern with its app name. Without
+    pattern, the one of the config file is used, and without pairs the pairs of the job"""
+
+    app: str
+    databaseNamePattern: Optional[str] = None
+    databases: List[str]
+    tableFilter: Optional[str] = None
+    accepted: Optional[str] = None
+    pairs: Optional[List[Tuple[str, str]]] = None
+
+
+class BatchJob(Settings):
+    pairs: List[Tuple[str, str]] = []
+    apps: List[BatchApp]
+    # Sessions opened at the same time on a server, by server name
+    maxSessions: Dict[str, int] = {}
+
+    @root_validator(skip_on_failure=True)
+    def checkJob(cls, values):
+        appNames = [app.app for app in values["apps"]]
+        duplicates = sorted({name for name in appNames if appNames.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"the apps {', '.join(duplicates)} are listed several times")
+        for name, sessions in values["maxSessions"].items():
+            if sessions < 1:
+                raise ValueError(f"maxSessions of the server {name} is at least 1")
+        for app in values["apps"]:
+            pairs = app.pairs if app.pairs is not None else values["pairs"]
+            if not pairs:
+                raise ValueError(f"no environment pair to compare for the app {app.app}")
+            for env1, env2 in pairs:
+                if env1 == env2:
+                    raise ValueError(f"the pair {env1}/{env2} of the app {app.app} compares an environment to itself")
+        return values
+
+
+class PropertyRules(Settings):
+    # ColumnFormat YYYY-MM-DD compared as YY/MM/DD, thresholds of the space of the tables
+    defaultRules: bool = True
+    rules: List[PropertyRule] = []
+
+
 class ConfigFile(Settings):
     app: str
     databaseNamePattern: str
+    tableRules: TableRules = TableRules()
+    propertyRules: PropertyRules = PropertyRules()
     servers: List[Server]
 
 
 class DatabaseConfig(object):
-    def __init__(self):
+    def __init__(self, conf: Optional[ConfigFile] = None):
         self.confFile = Path("config") / "database-conf.json"
+        if conf is not None:
+            self.conf = conf
+            return
+
         if not self.confFile.is_file():
             print(f"Missing {self.confFile} configuration file. Copy the template and fill in the credentials")
             exit(1)
@@ -87,3 +220,7 @@ if __name__ == "__main__":
         (parentPath / "config" / "json-schemas" / "database-conf.schema.json").write_text(
             ConfigFile.schema_json(indent=4)
         )
+        (parentPath / "config" / "json-schemas" / "accepted-differences.schema.json").write_text(
+            AcceptedDifferences.schema_json(indent=4)
+        )
+        (parentPath / "config" / "json-schemas" / "batch-job.schema.json").write_text(BatchJob.schema_json(indent=4))
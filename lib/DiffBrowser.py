@@ -0,0 +1,492 @@
+import io
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from prompt_toolkit.application import Application, get_app
+from prompt_toolkit.filters import Condition
+from prompt_toolkit.formatted_text import ANSI, StyleAndTextTuples, to_formatted_text
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import HSplit, Layout, Window
+from prompt_toolkit.layout.controls import FormattedTextControl
+from termcolor import colored
+
+from lib.CompareEnv import CompareEnv
+from lib.AcceptedIndex import Scope
+from lib.DiffEngine import DiffEngine, Difference
+from lib.DiffRenderer import DiffRenderer
+from lib.Metadata import Database, Table
+
+
+class BrowserNode(object):
+    """Line of the browser: a database, a difference, a kind of children or a property. The children of a node are
+    built the first time it is expanded. The tables of a database are compared while they are scrolled into view,
+    the last line of a database still holding tables to compare is a placeholder whose loader is the database."""
+
+    __slots__ = ("text", "depth", "level", "parent", "database", "diff", "children", "pending", "loader", "expanded")
+
+    def __init__(
+        self,
+        text: str,
+        depth: int,
+        parent: Optional["BrowserNode"],
+        database: Optional[Database] = None,
+        diff: Optional[Difference] = None,
+        level: int = 0,
+    ):
+        self.text = text
+        self.depth = depth
+        # Level of the object in the tree of the differences, for its colors
+        self.level = level
+        self.parent = parent
+        self.database = database
+        self.diff = diff
+        self.children: Optional[List[BrowserNode]] = None
+        self.pending: Optional[Iterator[BrowserNode]] = None
+        self.loader: Optional[BrowserNode] = None
+        self.expanded = False
+
+
+class DiffBrowser(object):
+    """Full screen tree of the differences of an extracted model. Only the lines on screen are rendered, and the
+    differences of a database are only computed for the tables scrolled into view, so that large comparisons open
+    at once. A table can be queried again in every environment, in a background thread."""
+
+    # Difference kinds shown by each filter, cycled with f
+    filters = ("all", "missing", "changed", "definitions", "space")
+    # Tables of a database compared each time its placeholder comes into view
+    tablesPerLoad = 200
+    help = "↑↓ move  ←→ fold  / search  n next  f filter  r query again  q quit"
+
+    def __init__(self, compareEnv: CompareEnv):
+        self.compareEnv = compareEnv
+        self.engine = DiffEngine(compareEnv)
+        self.renderer = DiffRenderer(compareEnv, io.StringIO())
+        self.filter = "all"
+        # Filter result of the differences shown or hidden so far, by id
+        self.shown: Dict[int, bool] = {}
+        self.roots = [
+            self.getDatabaseNode(database, scope)
+            for _, database in sorted(compareEnv.ddl.items())
+            for scope in [self.engine.getTableScope(database, self.engine.allEnvs)]
+            if scope is not None
+        ]
+        self.rows: List[BrowserNode] = []
+        self.cursor = 0
+        self.top = 0
+        self.message = ""
+        self.searchText: Optional[str] = None
+        self.lastSearch = ""
+        # Set while a table is queried again, and (database node, table node, table or exception) once it is done
+        self.busy = False
+        self.refreshed: Optional[tuple] = None
+        self.app: Optional[Application] = None
+        self.buildRows()
+
+    def run(self):
+        body = Window(FormattedTextControl(self.getBodyText, focusable=True), wrap_lines=False)
+        status = Window(FormattedTextControl(self.getStatusText), height=1, style="reverse")
+        self.app = Application(
+            layout=Layout(HSplit([body, status])), key_bindings=self.getKeyBindings(), full_screen=True
+        )
+        self.app.run()
+
+    # Database with the scope of the accepted differences in its tables
+    def getDatabaseNode(self, database: Database, scope: Scope) -> BrowserNode:
+        colors = self.compareEnv.colors[0]
+        text = colored(database.name, colors["name"], attrs=colors["attrs"])
+        missing = self.engine.allEnvs & ~database.presence
+        if missing:
+            text += self.renderer.getPresence(missing)
+        node = BrowserNode(text, 0, None, database=database)
+        envMask = self.engine.allEnvs & database.presence
+        if envMask & (envMask - 1) != 0:
+            node.pending = self.iterTableNodes(node, database, envMask, scope)
+            node.children = []
+        return node
+
+    # Differences of the tables of a database, computed one table at a time
+    def iterTableNodes(
+        self, dbNode: BrowserNode, database: Database, envMask: int, scope: Scope
+    ) -> Iterator[BrowserNode]:
+        # The renamed tables are paired before the first table is compared, the others are read from the model as
+        # they may have been queried again
+        tables, renames = self.engine.matchRenamedObjects(database.tables, envMask)
+        for tbName in sorted(tables):
+            table = tables[tbName] if tbName in renames else database.tables.get(tbName)
+            diff = self.engine.diffItem(table, envMask, scope, renames.get(tbName)) if table is not None else None
+            if diff is not None:
+                yield self.getDiffNode(diff, 1, dbNode, 1)
+
+    def getDiffNode(self, diff: Difference, depth: int, parent: BrowserNode, level: int) -> BrowserNode:
+        text = self.renderer.getHeader(diff, level).lstrip("\n")
+        if diff.renamed is not None:
+            text += self.renderer.getRenaming(diff)
+        if diff.missing:
+            text += self.renderer.getPresence(diff.missing)
+        node = BrowserNode(text, depth, parent, diff=diff, level=level)
+        # The objects of a table are small, they are shown expanded with the table
+        node.expanded = diff.typeName not in ("database", "table")
+        return node
+
+    # Properties of a difference, with the lines of the text diffs one level below, then its kinds of children
+    def getChildren(self, node: BrowserNode) -> List[BrowserNode]:
+        if node.children is not None:
+            return node.children
+
+        node.children = []
+        diff = node.diff
+        if diff is not None:
+            for line in self.renderer.getProperties(diff).split("\n")[1:] if diff.properties else []:
+                depth = node.depth + 1 + len(line) - len(line.lstrip("\t"))
+                node.children.append(BrowserNode(line.lstrip("\t"), depth, node))
+            for kind, childDiffs in diff.children:
+                group = BrowserNode(kind, node.depth + 1, node)
+                group.expanded = True
+                group.children = [
+                    self.getDiffNode(child, node.depth + 2, group, node.level + 1) for child in childDiffs
+                ]
+                node.children.append(group)
+        return node.children
+
+    def isExpandable(self, node: BrowserNode) -> bool:
+        if node.database is not None:
+            return node.pending is not None or bool(node.children)
+        if node.diff is not None:
+            return bool(node.diff.properties) or bool(node.diff.children)
+        return bool(node.children)
+
+    # Differences of the filter, or holding children of the filter. Properties and placeholders are always shown.
+    def isShown(self, node: BrowserNode) -> bool:
+        if node.diff is None:
+            return node.loader is not None or node.children is None or any(map(self.isShown, node.children))
+        return self.isShownDiff(node.diff)
+
+    def isShownDiff(self, diff: Difference) -> bool:
+        shown = self.shown.get(id(diff))
+        if shown is None:
+            if self.filter == "missing":
+                shown = diff.missing != 0
+            elif self.filter == "changed":
+                shown = bool(diff.properties) and diff.typeName not in ("definition", "space")
+            elif self.filter == "definitions":
+                shown = bool(diff.properties) and diff.typeName == "definition"
+            elif self.filter == "space":
+                shown = bool(diff.properties) and diff.typeName == "space"
+            else:
+                shown = True
+            shown = shown or any(self.isShownDiff(child) for _, children in diff.children for child in children)
+            self.shown[id(diff)] = shown
+        return shown
+
+    def getShownChildren(self, node: BrowserNode) -> List[BrowserNode]:
+        children = [child for child in self.getChildren(node) if self.isShown(child)]
+        if node.pending is not None:
+            placeholder = BrowserNode("...", node.depth + 1, node)
+            placeholder.loader = node
+            children.append(placeholder)
+        return children
+
+    def appendRows(self, node: BrowserNode, rows: List[BrowserNode]):
+        rows.append(node)
+        if node.expanded:
+            for child in self.getShownChildren(node):
+                self.appendRows(child, rows)
+
+    def buildRows(self):
+        rows: List[BrowserNode] = []
+        for root in self.roots:
+            if root.pending is not None or self.isShown(root):
+                self.appendRows(root, rows)
+        self.rows = rows
+        self.cursor = min(self.cursor, max(0, len(rows) - 1))
+
+    def expand(self, index: int):
+        node = self.rows[index]
+        if node.expanded or not self.isExpandable(node):
+            return
+        node.expanded = True
+        rows: List[BrowserNode] = []
+        for child in self.getShownChildren(node):
+            self.appendRows(child, rows)
+        self.rows[index + 1 : index + 1] = rows
+
+    def collapse(self, index: int):
+        node = self.rows[index]
+        end = index + 1
+        while end < len(self.rows) and self.rows[end].depth > node.depth:
+            end += 1
+        del self.rows[index + 1 : end]
+        node.expanded = False
+
+    # Compares the next tables of the database of a placeholder, and replaces the placeholder by their lines
+    def load(self, index: int):
+        dbNode = self.rows[index].loader
+        assert dbNode is not None and dbNode.pending is not None and dbNode.children is not None
+        nodes = []
+        for node in dbNode.pending:
+            nodes.append(node)
+            if len(nodes) == self.tablesPerLoad:
+                break
+        else:
+            dbNode.pending = None
+        dbNode.children += nodes
+
+        rows: List[BrowserNode] = []
+        for node in nodes:
+            if self.isShown(node):
+                self.appendRows(node, rows)
+        if dbNode.pending is not None:
+            rows.append(self.rows[index])
+        self.rows[index : index + 1] = rows
+
+    def getHeight(self) -> int:
+        return max(1, get_app().output.get_size().rows - 1)
+
+    def getBodyText(self) -> StyleAndTextTuples:
+        if self.refreshed is not None:
+            self.applyRefresh(*self.refreshed)
+            self.refreshed = None
+
+        height = self.getHeight()
+        # The placeholders on screen are replaced by the differences of their tables
+        while not self.busy:
+            self.cursor = min(self.cursor, max(0, len(self.rows) - 1))
+            self.top = min(max(self.top, self.cursor - height + 1), self.cursor)
+            placeholders = [i for i in range(self.top, min(len(self.rows), self.top + height)) if self.rows[i].loader]
+            if not placeholders:
+                break
+            self.load(placeholders[0])
+
+        fragments: StyleAndTextTuples = []
+        for index in range(self.top, min(len(self.rows), self.top + height)):
+            node = self.rows[index]
+            marker = ("▾ " if node.expanded else "▸ ") if self.isExpandable(node) else "  "
+            line = to_formatted_text(ANSI("  " * node.depth + marker + node.text))
+            if index == self.cursor:
+                line = [(fragment[0] + " reverse", fragment[1]) for fragment in line]
+            fragments += line + [("", "\n")]
+        return fragments
+
+    def getStatusText(self) -> str:
+        if self.searchText is not None:
+            return "/" + self.searchText
+        more = "+" if any(root.pending is not None for root in self.roots) else ""
+        position = f"{self.cursor + 1}/{len(self.rows)}{more}"
+        return f" {self.filter} | {position} | {self.message or self.help}"
+
+    def getKeyBindings(self) -> KeyBindings:
+        kb = KeyBindings()
+        searching = Condition(lambda: self.searchText is not None)
+        browsing = ~searching
+
+        def move(offset: int):
+            self.cursor = min(max(0, self.cursor + offset), max(0, len(self.rows) - 1))
+            self.message = ""
+
+        kb.add("up", filter=browsing)(lambda event: move(-1))
+        kb.add("k", filter=browsing)(lambda event: move(-1))
+        kb.add("down", filter=browsing)(lambda event: move(1))
+        kb.add("j", filter=browsing)(lambda event: move(1))
+        kb.add("pageup", filter=browsing)(lambda event: move(-self.getHeight()))
+        kb.add("pagedown", filter=browsing)(lambda event: move(self.getHeight()))
+        kb.add("home", filter=browsing)(lambda event: move(-len(self.rows)))
+        kb.add("end", filter=browsing)(lambda event: move(len(self.rows)))
+
+        @kb.add("right", filter=browsing)
+        @kb.add("l", filter=browsing)
+        def _(event):
+            if self.rows:
+                self.expand(self.cursor)
+
+        @kb.add("enter", filter=browsing)
+        @kb.add("space", filter=browsing)
+        def _(event):
+            if self.rows:
+                if self.rows[self.cursor].expanded:
+                    self.collapse(self.cursor)
+                else:
+                    self.expand(self.cursor)
+
+        @kb.add("left", filter=browsing)
+        @kb.add("h", filter=browsing)
+        def _(event):
+            if not self.rows:
+                return
+            node = self.rows[self.cursor]
+            if node.expanded and self.isExpandable(node):
+                self.collapse(self.cursor)
+            elif node.parent is not None:
+                self.cursor = self.rows.index(node.parent)
+
+        @kb.add("f", filter=browsing)
+        def _(event):
+            if not self.busy:
+                node = self.rows[self.cursor] if self.rows else None
+                self.filter = self.filters[(self.filters.index(self.filter) + 1) % len(self.filters)]
+                self.shown = {}
+                self.buildRows()
+                self.moveTo(node)
+
+        @kb.add("/", filter=browsing)
+        def _(event):
+            if not self.busy:
+                self.searchText = ""
+
+        @kb.add("n", filter=browsing)
+        def _(event):
+            if self.lastSearch and not self.busy:
+                self.search(self.lastSearch)
+
+        @kb.add("r", filter=browsing)
+        def _(event):
+            self.refreshTable()
+
+        @kb.add("q", filter=browsing)
+        @kb.add("c-c")
+        def _(event):
+            event.app.exit()
+
+        @kb.add("enter", filter=searching)
+        def _(event):
+            text, self.searchText = self.searchText, None
+            if text:
+                self.lastSearch = text
+                self.search(text)
+
+        @kb.add("escape", filter=searching)
+        def _(event):
+            self.searchText = None
+
+        @kb.add("backspace", filter=searching)
+        def _(event):
+            self.searchText = (self.searchText or "")[:-1]
+
+        @kb.add("<any>", filter=searching)
+        def _(event):
+            if event.data.isprintable():
+                self.searchText = (self.searchText or "") + event.data
+
+        return kb
+
+    # Cursor on the line of a node, or on its closest ancestor shown
+    def moveTo(self, node: Optional[BrowserNode]):
+        positions = {id(row): index for index, row in enumerate(self.rows)}
+        while node is not None and id(node) not in positions:
+            node = node.parent
+        self.cursor = positions[id(node)] if node is not None else 0
+
+    # Nodes of the filter in the order of the tree, expanded or not, comparing the tables of the databases when
+    # the search reaches them
+    def iterNodes(self, nodes: List[BrowserNode]) -> Iterator[BrowserNode]:
+        for node in nodes:
+            if node.diff is not None and not self.isShownDiff(node.diff):
+                continue
+            yield node
+            if node.database is not None:
+                yield from self.iterDatabaseNodes(node)
+            else:
+                yield from self.iterNodes(self.getChildren(node))
+
+    def iterDatabaseNodes(self, dbNode: BrowserNode) -> Iterator[BrowserNode]:
+        index = 0
+        while dbNode.children is not None and (index < len(dbNode.children) or dbNode.pending is not None):
+            if index == len(dbNode.children):
+                assert dbNode.pending is not None
+                node = next(dbNode.pending, None)
+                if node is None:
+                    dbNode.pending = None
+                    break
+                dbNode.children.append(node)
+            yield from self.iterNodes([dbNode.children[index]])
+            index += 1
+
+    # Next database or object whose name holds the text, after the cursor, from the top once the end is reached
+    def search(self, text: str):
+        current = self.rows[self.cursor] if self.rows else None
+        text = text.upper()
+        first = found = None
+        passed = current is None
+        for node in self.iterNodes(self.roots):
+            if node is current:
+                passed = True
+                continue
+            name = node.database.name if node.database is not None else node.diff.name if node.diff else None
+            if name is not None and text in name.upper():
+                if passed:
+                    found = node
+                    break
+                first = first or node
+
+        found = found or first
+        if found is None:
+            self.message = f"{text} not found"
+            return
+        parent = found.parent
+        while parent is not None:
+            parent.expanded = True
+            parent = parent.parent
+        self.buildRows()
+        self.moveTo(found)
+        self.message = ""
+
+    # Database and table nodes of the table under the cursor
+    def getTableNodes(self):
+        node = self.rows[self.cursor] if self.rows else None
+        while node is not None and (node.diff is None or node.diff.typeName != "table"):
+            node = node.parent
+        return (node.parent, node) if node is not None and node.parent is not None else (None, None)
+
+    def refreshTable(self):
+        if self.busy:
+            return
+        dbNode, tableNode = self.getTableNodes()
+        if dbNode is None or tableNode is None or dbNode.database is None or tableNode.diff is None:
+            self.message = "Move to a table to query it again"
+            return
+        if self.compareEnv.quick or any(env.snapshot is not None for env in self.compareEnv.envs):
+            self.message = "The tables cannot be queried again with --quick or from a snapshot"
+            return
+
+        dbName, tbName = dbNode.database.name, tableNode.diff.name
+        self.busy = True
+        self.message = f"Querying {dbName}.{tbName} again..."
+
+        def run():
+            try:
+                result = self.compareEnv.refreshTable(dbName, tbName)
+            except Exception as e:
+                result = e
+            self.refreshed = (dbNode, tableNode, result)
+            if self.app is not None:
+                self.app.invalidate()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def applyRefresh(self, dbNode: BrowserNode, tableNode: BrowserNode, result):
+        self.busy = False
+        tableName = f"{dbNode.database.name}.{tableNode.diff.name}" if dbNode.database and tableNode.diff else ""
+        if isinstance(result, Exception):
+            self.message = f"{tableName} could not be queried: {result}"
+            return
+
+        # New property schemas may come with the rows of the table
+        self.engine = DiffEngine(self.compareEnv)
+        self.shown = {}
+        diff = None
+        if isinstance(result, Table) and dbNode.database is not None:
+            envMask = self.engine.allEnvs & dbNode.database.presence
+            diff = self.engine.diffItem(result, envMask, self.engine.getTableScope(dbNode.database, envMask) or [])
+
+        assert dbNode.children is not None
+        position = next(i for i, child in enumerate(dbNode.children) if child is tableNode)
+        if diff is None:
+            del dbNode.children[position]
+            self.message = f"{tableName} has no differences anymore"
+            node = dbNode
+        else:
+            node = self.getDiffNode(diff, tableNode.depth, dbNode, tableNode.level)
+            node.expanded = tableNode.expanded
+            dbNode.children[position] = node
+            self.message = f"{tableName} queried again"
+        self.buildRows()
+        self.moveTo(node)
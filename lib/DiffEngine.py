@@ -0,0 +1,311 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from lib.AcceptedIndex import AcceptedIndex, Scope
+from lib.Metadata import Constraint, Database, Index, MetaObject
+from lib.RenameDetector import RenameDetector
+
+if TYPE_CHECKING:
+    from lib.CompareEnv import CompareEnv
+
+# Names of a renamed object in each environment, None where it is missing, and the similarity of the objects paired
+Renaming = Tuple[Tuple[Optional[str], ...], float]
+
+
+class Difference(object):
+    """Differences of one object of the model, only built for the objects that differ or have children that differ.
+    missing has the bits of the compared environments not holding the object, and properties the (name, values)
+    of the properties that differ, the values in the order of envIndexes. children has (kind, differences) for
+    each kind of children holding differences. renamed is set for the objects paired by the rename detection."""
+
+    __slots__ = ("name", "typeName", "tableKind", "missing", "envIndexes", "properties", "children", "renamed")
+
+    def __init__(
+        self,
+        obj: MetaObject,
+        tableKind: str,
+        missing: int,
+        envIndexes: Tuple[int, ...],
+        properties: Tuple[Tuple[str, tuple], ...],
+        children: Tuple[Tuple[str, List["Difference"]], ...],
+        renamed: Optional[Renaming] = None,
+    ):
+        self.name = obj.name
+        self.typeName = obj.typeName
+        self.tableKind = tableKind
+        self.missing = missing
+        self.envIndexes = envIndexes
+        self.properties = properties
+        self.children = children
+        self.renamed = renamed
+
+
+class DiffEngine(object):
+    """Computes the differences of the model without changing it, before any rendering"""
+
+    def __init__(self, compareEnv: "CompareEnv", tablesPerTask: int = 1000):
+        self.envCount = len(compareEnv.envs)
+        self.allEnvs = (1 << self.envCount) - 1
+        self.propertySchemas = dict(compareEnv.propertySchemas)
+        # Comparison of the property tuples of each granularity, compiled once from the property rules
+        self.comparators = {
+            granularity: compareEnv.propertyComparator.getComparator(granularity, schema)
+            for granularity, schema in compareEnv.propertySchemas.items()
+        }
+        self.tablesPerTask = tablesPerTask
+        # Known differences left out of the comparison, looked up from the root scope along the objects
+        self.accepted: Optional[AcceptedIndex] = compareEnv.acceptedIndex
+        self.rootScope: Scope = [self.accepted.root] if self.accepted is not None else []
+        # Tables, foreign keys and indices found in some environments only are paired by similarity
+        self.renameDetector: Optional[RenameDetector] = None
+        if compareEnv.renameSimilarity is not None:
+            self.renameDetector = RenameDetector(self.propertySchemas, compareEnv.renameSimilarity)
+
+    # Differences of the databases. With several processes, the tables of each database are compared by ranges of
+    # tablesPerTask tables in forked processes, which share the model of this one instead of receiving a copy.
+    # Without fork (Windows), the differences are computed in this process.
+    def diff(self, ddl: Dict[str, Database], processes: int = 1) -> List[Difference]:
+        allEnvs = self.allEnvs
+        if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return self.diffObjects(ddl, allEnvs, self.rootScope)
+
+        with ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=initDiffProcess,
+            initargs=(self, ddl),
+        ) as executor:
+            tasks = []
+            for dbName, database in sorted(ddl.items()):
+                scope = self.getTableScope(database, allEnvs)
+                if scope is None:
+                    continue
+                envMask = allEnvs & database.presence
+                if envMask & (envMask - 1) == 0:
+                    tasks.append((database, [], []))
+                    continue
+                # The renamed tables are compared in this process, the other processes read the tables of the model
+                tables, renames = self.matchRenamedObjects(database.tables, envMask)
+                tableNames = sorted(name for name in tables if name not in renames)
+                futures = [
+                    executor.submit(diffTables, dbName, tableNames[i : i + self.tablesPerTask], envMask)
+                    for i in range(0, len(tableNames), self.tablesPerTask)
+                ]
+                renamedDiffs = self.diffObjects({name: tables[name] for name in renames}, envMask, scope, renames)
+                tasks.append((database, futures, renamedDiffs))
+
+            diffs = []
+            for database, futures, renamedDiffs in tasks:
+                tableDiffs = renamedDiffs
+                for future in futures:
+                    taskDiffs, usedRules = future.result()
+                    tableDiffs += taskDiffs
+                    if self.accepted is not None:
+                        self.accepted.used.update(usedRules)
+                if renamedDiffs:
+                    tableDiffs.sort(key=lambda diff: diff.name)
+                children = (("tables", tableDiffs),) if tableDiffs else ()
+                dbDiff = self.getDifference(database, allEnvs & ~database.presence, (), (), children)
+                if dbDiff is not None:
+                    diffs.append(dbDiff)
+        return diffs
+
+    def diffObjects(
+        self,
+        objects: Mapping[str, MetaObject],
+        envMask: int,
+        scope: Scope = (),
+        renames: Optional[Dict[str, Renaming]] = None,
+    ) -> List[Difference]:
+        diffs = []
+        for name, obj in sorted(objects.items()):
+            diff = self.diffItem(obj, envMask, scope, renames.get(name) if renames else None)
+            if diff is not None:
+                diffs.append(diff)
+        return diffs
+
+    # The object is compared in the environments of envMask holding it, and its children in the same ones. With
+    # two environments, a missing object is only reported as missing. The scope has the patterns of the accepted
+    # differences the object is looked up in, an object accepted as a whole is not compared at all: its rules are
+    # in use as long as they match an object.
+    def diffItem(
+        self, obj: MetaObject, envMask: int, scope: Scope = (), renamed: Optional[Renaming] = None
+    ) -> Optional[Difference]:
+        propertyScope: Scope = []
+        if scope:
+            assert self.accepted is not None
+            rules, propertyScope, scope = self.accepted.lookup(scope, obj)
+            if rules:
+                self.accepted.used.update(rules)
+                return None
+
+        missing = envMask & ~obj.presence
+        envMask &= obj.presence
+        # At least two environments left to compare
+        if envMask & (envMask - 1) == 0:
+            return self.getDifference(obj, missing, (), (), (), renamed)
+
+        envIndexes, properties = self.getPropertyDiffs(obj, envMask)
+        if properties and propertyScope:
+            assert self.accepted is not None
+            properties = self.accepted.filterProperties(propertyScope, properties)
+        children = []
+        for k in obj.children:
+            objects = getattr(obj, k)
+            if k == "constraints" or k == "indices":
+                objects = self.matchSignatures(objects, envMask)
+            renames: Dict[str, Renaming] = {}
+            if k in ("tables", "constraints", "indices"):
+                objects, renames = self.matchRenamedObjects(objects, envMask)
+            childDiffs = self.diffObjects(objects, envMask, scope, renames)
+            if childDiffs:
+                children.append((k, childDiffs))
+        return self.getDifference(obj, missing, envIndexes, properties, tuple(children), renamed)
+
+    # Scope of the accepted differences in the tables of a database, None if the database is accepted as a whole
+    def getTableScope(self, database: Database, envMask: int) -> Optional[Scope]:
+        if not self.rootScope:
+            return []
+        assert self.accepted is not None
+        rules, _, scope = self.accepted.lookup(self.rootScope, database)
+        if rules:
+            self.accepted.used.update(rules)
+            return None
+        return scope
+
+    def getDifference(
+        self, obj: MetaObject, missing: int, envIndexes, properties, children, renamed: Optional[Renaming] = None
+    ) -> Optional[Difference]:
+        if not missing and not properties and not children and renamed is None:
+            return None
+        tableKind = ""
+        for envIndex in range(self.envCount):
+            tableKind = tableKind or self.getProperty(obj, envIndex, "TableKind") or ""
+        return Difference(obj, tableKind, missing, envIndexes, properties, children, renamed)
+
+    # Environments of envMask with properties, and the name and values of the properties that differ between them
+    def getPropertyDiffs(self, obj: MetaObject, envMask: int):
+        sides = obj.properties
+        # Most objects are defined the same way in all the environments, their property tuples are equal
+        if envMask == self.allEnvs and sides and sides[0] is not None and sides.count(sides[0]) == self.envCount:
+            return tuple(range(self.envCount)), ()
+
+        envProperties: List[Tuple[int, tuple]] = []
+        for envIndex in range(self.envCount):
+            properties = obj.getProperties(envIndex) if envMask >> envIndex & 1 else None
+            if properties is not None:
+                envProperties.append((envIndex, properties))
+        envIndexes = tuple(envIndex for envIndex, _ in envProperties)
+        propertySides = [properties for _, properties in envProperties]
+        # Equal property tuples are shared by the pool
+        if len(propertySides) < 2 or all(properties is propertySides[0] for properties in propertySides):
+            return envIndexes, ()
+
+        compare = self.comparators.get(obj.granularity)
+        return envIndexes, compare(propertySides) if compare is not None else ()
+
+    def getProperty(self, obj: MetaObject, envIndex: int, propName: str):
+        properties = obj.getProperties(envIndex)
+        schema = self.propertySchemas.get(obj.granularity, ())
+        if properties is None or propName not in schema:
+            return None
+        return properties[schema.index(propName)]
+
+    # Unnamed foreign keys and indices get a different name in each environment: the ones not found in all the
+    # environments of envMask are paired on the signature of their definition, computed at extraction, and merged
+    # under the name of their first environment. Returns new objects for the paired ones, the model is unchanged.
+    def matchSignatures(self, objects: Mapping[str, MetaObject], envMask: int) -> Mapping[str, MetaObject]:
+        orphans = [(key, obj) for key, obj in objects.items() if envMask & obj.presence and envMask & ~obj.presence]
+        if len(orphans) < 2:
+            return objects
+
+        matched = dict(objects)
+        # Keys of the objects still missing in some environments, by signature: several unnamed objects of a table
+        # may have the same definition
+        unmatchedKeys: Dict[str, List[str]] = {}
+        # The objects of the first environments first, their names are kept
+        for key, obj in sorted(orphans, key=lambda item: (item[1].presence & -item[1].presence, item[0])):
+            keys = unmatchedKeys.setdefault(getattr(obj, "signature"), [])
+            position = next(
+                (i for i, firstKey in enumerate(keys) if matched[firstKey].presence & obj.presence & envMask == 0),
+                None,
+            )
+            if position is None:
+                keys.append(key)
+                continue
+            firstKey = keys[position]
+            matched[firstKey] = self.merge(obj, matched[firstKey])
+            del matched[key]
+            if envMask & ~matched[firstKey].presence == 0:
+                del keys[position]
+        return matched
+
+    # Objects found in some environments only, paired by the rename detection and merged under the name of their
+    # first environment, with the names of the renamed objects by key. The model is unchanged.
+    def matchRenamedObjects(
+        self, objects: Mapping[str, MetaObject], envMask: int
+    ) -> Tuple[Mapping[str, MetaObject], Dict[str, Renaming]]:
+        if self.renameDetector is None:
+            return objects, {}
+        pairs = self.renameDetector.findRenames(objects, envMask)
+        if not pairs:
+            return objects, {}
+
+        matched = dict(objects)
+        renames: Dict[str, Renaming] = {}
+        for key1, key2, similarity in pairs:
+            (firstKey, first), (secondKey, second) = sorted(
+                ((key1, matched[key1]), (key2, matched[key2])), key=lambda item: item[1].presence & -item[1].presence
+            )
+            del matched[secondKey]
+            matched[firstKey] = self.merge(second, first)
+            names = tuple(
+                first.name if first.isIn(envIndex) else second.name if second.isIn(envIndex) else None
+                for envIndex in range(self.envCount)
+            )
+            renames[firstKey] = (names, similarity)
+        return matched, renames
+
+    def merge(self, a: MetaObject, b: MetaObject) -> MetaObject:
+        "new object with the environments of a and b, b first"
+        merged = type(a)(b.name)
+        merged.presence = a.presence | b.presence
+        if isinstance(merged, (Constraint, Index)):
+            merged.signature = getattr(b, "signature")
+        merged.properties = tuple(
+            b.getProperties(envIndex) if b.getProperties(envIndex) is not None else a.getProperties(envIndex)
+            for envIndex in range(self.envCount)
+        )
+
+        for k in a.children:
+            children = dict(getattr(a, k))
+            for name, child in getattr(b, k).items():
+                children[name] = self.merge(children[name], child) if name in children else child
+            setattr(merged, k, children)
+        return merged
+
+    @staticmethod
+    def getDisplayValue(value):
+        if value is None:
+            return "Null"
+        return value
+
+
+# Engine and model of a diff process, set when the process is forked
+diffProcess: Dict[str, Any] = {}
+
+
+def initDiffProcess(diffEngine: DiffEngine, ddl: Dict[str, Database]):
+    diffProcess["engine"] = diffEngine
+    diffProcess["ddl"] = ddl
+
+
+# Differences of the tables, and the accepted differences they used
+def diffTables(dbName: str, tableNames: List[str], envMask: int) -> Tuple[List[Difference], Set[int]]:
+    engine: DiffEngine = diffProcess["engine"]
+    database = diffProcess["ddl"][dbName]
+    scope = engine.getTableScope(database, envMask) or []
+    # The renamed tables are compared by the parent process
+    diffs = engine.diffObjects({tbName: database.tables[tbName] for tbName in tableNames}, envMask, scope)
+    return diffs, engine.accepted.used if engine.accepted is not None else set()
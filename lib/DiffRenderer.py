@@ -0,0 +1,209 @@
+from difflib import SequenceMatcher
+from itertools import count
+from typing import IO, Dict, List, Optional, Tuple
+
+from termcolor import colored
+
+from lib.CompareEnv import CompareEnv, Environment
+from lib.DiffEngine import DiffEngine, Difference
+
+Scopes = Tuple[int, ...]
+
+# Characters ending a line for str.splitlines
+LINE_BREAKS = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+class DiffRenderer(object):
+    """Writes the differences computed by DiffEngine to a stream as a colored tree. Each block is an indentation
+    scope: a line break gets one tab for each scope still open when the next text is written, so that a block
+    ending with a line break is not indented after it."""
+
+    # Properties holding the text of a definition, rendered as a unified diff with textContext lines of context
+    textProperties = ("RequestText",)
+    textContext = 2
+
+    def __init__(self, compareEnv: CompareEnv, stream: IO[str]):
+        self.compareEnv = compareEnv
+        self.stream = stream
+        self.scopeIds = count()
+        # Scopes open at the last line break written, if the last text written ended with one
+        self.lineBreakScopes: Optional[Scopes] = None
+        # Texts of the table being rendered, written at once when it is done
+        self.output: List[str] = []
+
+    def render(self, diffs: List[Difference]):
+        self.renderDifferences(diffs, 0, ())
+
+    def renderDifferences(self, diffs: List[Difference], lvl: int, scopes: Scopes):
+        if lvl > 0:
+            scopes = scopes + (next(self.scopeIds),)
+        for diff in diffs:
+            self.renderDifference(diff, lvl, scopes)
+
+    def renderDifference(self, diff: Difference, lvl: int, scopes: Scopes):
+        text = self.getHeader(diff, lvl)
+        if diff.renamed is not None:
+            text += self.getRenaming(diff)
+        if diff.missing:
+            text += self.getPresence(diff.missing)
+        self.emit(text, scopes)
+        if diff.properties:
+            self.emit(self.getProperties(diff), scopes + (next(self.scopeIds),))
+        for k, children in diff.children:
+            childScopes = scopes + (next(self.scopeIds),)
+            self.emit("\n" + k, childScopes)
+            self.renderDifferences(children, lvl + 1, childScopes)
+        # Databases and tables are written as soon as they are rendered
+        if lvl <= 1:
+            self.flush()
+
+    def getHeader(self, diff: Difference, lvl: int) -> str:
+        colors = self.compareEnv.colors[lvl]
+        objName = f"({diff.tableKind}) {diff.name}" if diff.tableKind != "" else diff.name
+        return "\n" + colored(objName, colors["name"], attrs=colors["attrs"])
+
+    # " not in" of the environments of the mask
+    def getPresence(self, missing: int) -> str:
+        envs = [env for env in self.compareEnv.envs if missing >> (env.number - 1) & 1]
+        return " not in " + ", ".join(colored(env.name, env.color) for env in envs)
+
+    # " renamed" with the other names of the object and the environments holding them, and the similarity of the
+    # objects paired
+    def getRenaming(self, diff: Difference) -> str:
+        assert diff.renamed is not None
+        names, similarity = diff.renamed
+        groups: Dict[str, List[Environment]] = {}
+        for env in self.compareEnv.envs:
+            name = names[env.number - 1]
+            if name is not None and name != diff.name:
+                groups.setdefault(name, []).append(env)
+        renamed = ", ".join(
+            name + " in " + ", ".join(colored(env.name, env.color) for env in envs) for name, envs in groups.items()
+        )
+        return f" renamed {renamed} ({similarity:.0%} similar)"
+
+    # Lines of the properties that differ, side by side for two environments, grouped by identical values for more
+    def getProperties(self, diff: Difference) -> str:
+        if len(self.compareEnv.envs) > 2:
+            return self.getPropertyGroups(diff)
+
+        env1, env2 = self.compareEnv.env1, self.compareEnv.env2
+        lines = ""
+        for propName, (val1, val2) in diff.properties:
+            if propName in self.textProperties:
+                lines += "\n" + propName + " :" + self.getTextDiff(val1, val2, [env1], [env2])
+                continue
+            val1, val2 = self.getDisplayValue(diff, propName, val1), self.getDisplayValue(diff, propName, val2)
+            lines += "\n" + propName + " : " + colored(val1, env1.color) + " -> " + colored(val2, env2.color)
+        return lines
+
+    # Value of a property as it is compared: the first of its equivalent values, Null for None
+    def getDisplayValue(self, diff: Difference, propName: str, value):
+        return DiffEngine.getDisplayValue(
+            self.compareEnv.propertyComparator.getDisplayValue(diff.typeName, propName, value)
+        )
+
+    def getPropertyGroups(self, diff: Difference) -> str:
+        properties = [
+            (propName, values) for propName, values in diff.properties if propName not in self.textProperties
+        ]
+        lines = self.getValueGroups(diff, properties) if properties else ""
+
+        # The texts of each group of environments are compared to the text of the first group
+        for propName, values in diff.properties:
+            if propName not in self.textProperties:
+                continue
+            groups: Dict[object, List[Environment]] = {}
+            for position, envIndex in enumerate(diff.envIndexes):
+                groups.setdefault(values[position], []).append(self.compareEnv.envs[envIndex])
+            (text1, envs1), *otherGroups = groups.items()
+            for text2, envs2 in otherGroups:
+                lines += "\n" + propName + " :" + self.getTextDiff(text1, text2, envs1, envs2)
+        return lines
+
+    # The environments are grouped by the values compared by the property rules, each group shows the values of
+    # its first environment
+    def getValueGroups(self, diff: Difference, properties: List[Tuple[str, tuple]]) -> str:
+        comparator = self.compareEnv.propertyComparator
+        normalizers = [comparator.getNormalizer(diff.typeName, propName) for propName, _ in properties]
+        groups: Dict[tuple, Tuple[tuple, List[Environment]]] = {}
+        for position, envIndex in enumerate(diff.envIndexes):
+            values = tuple(
+                self.getDisplayValue(diff, propName, propValues[position]) for propName, propValues in properties
+            )
+            key = tuple(
+                normalize(propValues[position]) if normalize is not None else propValues[position]
+                for normalize, (_, propValues) in zip(normalizers, properties)
+            )
+            groups.setdefault(key, (values, []))[1].append(self.compareEnv.envs[envIndex])
+
+        labelWidth = max(len(", ".join(env.name for env in envs)) for _, envs in groups.values())
+        lines = ""
+        for values, envs in groups.values():
+            label = ", ".join(colored(env.name, env.color) for env in envs)
+            padding = " " * (labelWidth - len(", ".join(env.name for env in envs)))
+            values = ", ".join(f"{propName} : {value}" for (propName, _), value in zip(properties, values))
+            lines += "\n" + label + padding + " | " + values
+        return lines
+
+    # Unified diff of two texts, one level below the property. The lines are matched once normalized like the
+    # definitions are compared.
+    def getTextDiff(self, text1, text2, envs1: List[Environment], envs2: List[Environment]) -> str:
+        if self.compareEnv.isDefinitionHash(text1) or self.compareEnv.isDefinitionHash(text2):
+            return self.getHashDiff(text1, text2, envs1, envs2)
+        lines1 = str(DiffEngine.getDisplayValue(text1)).splitlines()
+        lines2 = str(DiffEngine.getDisplayValue(text2)).splitlines()
+        keys1 = [self.compareEnv.normalizeDefinition(line) for line in lines1]
+        keys2 = [self.compareEnv.normalizeDefinition(line) for line in lines2]
+        color1, color2 = envs1[0].color, envs2[0].color
+
+        output = [
+            colored("--- " + ", ".join(env.name for env in envs1), color1),
+            colored("+++ " + ", ".join(env.name for env in envs2), color2),
+        ]
+        matcher = SequenceMatcher(None, keys1, keys2, autojunk=False)
+        for group in matcher.get_grouped_opcodes(self.textContext):
+            (_, first1, _, first2, _), (_, _, last1, _, last2) = group[0], group[-1]
+            output.append(f"@@ -{first1 + 1},{last1 - first1} +{first2 + 1},{last2 - first2} @@")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    output += [" " + line for line in lines1[i1:i2]]
+                    continue
+                output += [colored("-" + line, color1) for line in lines1[i1:i2]]
+                output += [colored("+" + line, color2) for line in lines2[j1:j2]]
+        return "".join("\n\t" + line for line in output)
+
+    # The line breaks inside the text are indented for all its scopes, the line break written before it only for
+    # the scopes still open
+    # Definitions without their text, read from a snapshot, only differ by the length and hash of their text
+    def getHashDiff(self, hash1, hash2, envs1: List[Environment], envs2: List[Environment]) -> str:
+        values = []
+        for value, envs in ((hash1, envs1), (hash2, envs2)):
+            value = colored(str(DiffEngine.getDisplayValue(value)), envs[0].color)
+            if len(self.compareEnv.envs) > 2:
+                value = ", ".join(colored(env.name, env.color) for env in envs) + " " + value
+            values.append(value)
+        return f" definition differs (hash {values[0]} -> {values[1]})"
+
+    def emit(self, text: str, scopes: Scopes):
+        lines = text.splitlines(True)
+        if not lines:
+            return
+        indent = "\t" * len(scopes)
+        if self.lineBreakScopes is scopes:
+            prefix = indent
+        elif self.lineBreakScopes is not None:
+            depth = 0
+            for lineBreakScope, scope in zip(self.lineBreakScopes, scopes):
+                if lineBreakScope != scope:
+                    break
+                depth += 1
+            prefix = "\t" * depth
+        else:
+            prefix = ""
+        self.lineBreakScopes = scopes if lines[-1][-1] in LINE_BREAKS else None
+        self.output.append(prefix + indent.join(lines))
+
+    def flush(self):
+        self.stream.write("".join(self.output))
+        self.output = []
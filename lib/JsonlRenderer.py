@@ -0,0 +1,67 @@
+import json
+from typing import IO, List, Optional
+
+from lib.CompareEnv import CompareEnv
+from lib.DiffEngine import Difference
+
+
+class JsonlRenderer(object):
+    """Writes one JSON record per difference computed by DiffEngine, without colors, for scripts"""
+
+    def __init__(self, compareEnv: CompareEnv, stream: IO[str]):
+        self.compareEnv = compareEnv
+        self.stream = stream
+        self.count = 0
+
+    def render(self, diffs: List[Difference]):
+        for dbDiff in diffs:
+            self.renderDifference(dbDiff, dbDiff.name, None, None)
+
+    def renderDifference(self, diff: Difference, dbName: str, tbName: Optional[str], parentName: Optional[str]):
+        if diff.renamed is not None:
+            names, _ = diff.renamed
+            self.write(diff, dbName, tbName, parentName, "renamed", None, names[0], names[1])
+
+        if diff.missing:
+            self.write(diff, dbName, tbName, parentName, "missing_in_env1" if diff.missing & 1 else "missing_in_env2")
+            return
+
+        for propName, (val1, val2) in diff.properties:
+            self.write(diff, dbName, tbName, parentName, "property_changed", propName, val1, val2)
+
+        for k, children in diff.children:
+            for child in children:
+                if diff.typeName == "database":
+                    self.renderDifference(child, dbName, child.name, None)
+                elif diff.typeName == "table":
+                    self.renderDifference(child, dbName, tbName, None)
+                else:
+                    self.renderDifference(child, dbName, tbName, diff.name)
+
+    def write(
+        self,
+        diff: Difference,
+        dbName: str,
+        tbName: Optional[str],
+        parentName: Optional[str],
+        kind: str,
+        propName: Optional[str] = None,
+        val1=None,
+        val2=None,
+    ):
+        record = {
+            "database": dbName,
+            "table": tbName,
+            "type": diff.typeName,
+            "parent": parentName,
+            "name": diff.name,
+            "kind": kind,
+            "property": propName,
+            "env1": val1,
+            "env2": val2,
+        }
+        if diff.renamed is not None and kind == "renamed":
+            record["similarity"] = round(diff.renamed[1], 3)
+        # Decimal and timestamp values are written as strings
+        self.stream.write(json.dumps(record, default=str) + "\n")
+        self.count += 1
@@ -0,0 +1,214 @@
+import io
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from termcolor import colored
+
+from lib.CompareEnv import CompareEnv, Environment, QueryResult
+from lib.DiffEngine import DiffEngine, Difference
+from lib.DiffRenderer import DiffRenderer
+from lib.Metadata import Database
+
+TableKey = Tuple[str, str]
+
+
+class RowStream(object):
+    """Rows of one query, read by batches in the (DatabaseName, TableName) order of the query"""
+
+    def __init__(self, compareEnv: CompareEnv, env: Environment, query, batchSize: int):
+        self.compareEnv = compareEnv
+        self.env = env
+        self.query = query
+        self.batchSize = batchSize
+        self.rows: Deque[Dict] = deque()
+        self.lastKey: Optional[TableKey] = None
+        self.done = False
+
+        self.cur = env.acquireSession()
+        start = time.perf_counter()
+        self.cur.execute(query["sql"](env))
+        self.description = self.cur.description
+        # Metrics of the query, recorded once all the rows are fetched
+        self.firstRowSeconds = time.perf_counter() - start
+        self.fetchSeconds = 0.0
+        self.rowCount = 0
+        self.size = 0
+
+    def fetch(self):
+        metrics = self.compareEnv.metrics
+        while not self.rows and not self.done:
+            start = time.perf_counter()
+            batch = self.cur.fetchmany(self.batchSize)
+            self.fetchSeconds += time.perf_counter() - start
+            if not batch:
+                self.done = True
+                self.env.releaseSession(self.cur)
+                if metrics is not None:
+                    granularity = self.query["granularity"]
+                    metrics.addQuery(
+                        self.env.name, granularity, self.firstRowSeconds, self.fetchSeconds, self.rowCount, self.size
+                    )
+                break
+            if metrics is not None:
+                self.rowCount += len(batch)
+                self.size += metrics.getSize(batch)
+            for row in self.compareEnv.rows2Obj(batch, self.description):
+                if not self.compareEnv.isExcludedTable(row["TableName"].upper()):
+                    self.rows.append(row)
+
+    def peekKey(self) -> Optional[TableKey]:
+        self.fetch()
+        if not self.rows:
+            return None
+
+        row = self.rows[0]
+        key = (row["DatabaseName"].upper(), row["TableName"].upper())
+        if self.lastKey is not None and key < self.lastKey:
+            raise Exception(
+                f"{self.env.name}:{self.query['granularity']} rows are not sorted by database and table name"
+                f" ({'.'.join(self.lastKey)} before {'.'.join(key)}), use the tree engine for these databases"
+            )
+        self.lastKey = key
+        return key
+
+    def peekDatabase(self) -> Optional[str]:
+        key = self.peekKey()
+        return key[0] if key is not None else None
+
+    # Pop the rows of one table
+    def takeGroup(self, key: TableKey) -> List[Dict]:
+        group = []
+        while self.peekKey() == key:
+            group.append(self.rows.popleft())
+        return group
+
+
+class MergeDiff(object):
+    """Diff engine reading the sorted query results of both environments side by side, as a merge join on
+    (database, table). Only the metadata of the current table is held in memory, and the differences are
+    rendered like DiffRenderer renders the whole tree."""
+
+    def __init__(self, compareEnv: CompareEnv, batchSize: int = 10000):
+        self.compareEnv = compareEnv
+        self.batchSize = batchSize
+        compareEnv.sortedQueries = True
+        # Depth of the indentation scope of the last rendered line, if it ended with a line break
+        self.lineBreakDepth: Optional[int] = None
+
+    # Sessions needed by each environment: every query is read at the same time, on its own session, and the texts
+    # of the definitions on another
+    @staticmethod
+    def getSessionCount(compareEnv: CompareEnv) -> int:
+        return len([query for query in compareEnv.queries if query["condition"]]) + 1
+
+    def openStreams(self) -> Dict[int, List[RowStream]]:
+        compareEnv = self.compareEnv
+        compareEnv.openEnvironments()
+
+        queries = [query for query in compareEnv.queries if query["condition"]]
+        streams = {}
+        for env in compareEnv.envs:
+            streams[env.number] = [RowStream(compareEnv, env, query, self.batchSize) for query in queries]
+
+        return streams
+
+    # Same output as CompareEnv.addTab applied on the whole tree: a tab is added after each line break, for each
+    # indentation scope the next line belongs to
+    def indent(self, text: str, depth: int) -> str:
+        output = ""
+        for line in text.splitlines(True):
+            if self.lineBreakDepth is not None:
+                output += "\t" * min(self.lineBreakDepth, depth)
+            output += line
+            self.lineBreakDepth = depth if line.splitlines()[0] != line else None
+        return output
+
+    def getDbHeader(self, dbName: str) -> str:
+        colors = self.compareEnv.colors[0]
+        return self.indent("\n" + colored(dbName, colors["name"], attrs=colors["attrs"]), 0)
+
+    # Model of each table, in a Database holding only this table, or of each database missing in one environment
+    def iterModels(self):
+        compareEnv = self.compareEnv
+        streams = self.openStreams()
+        env1, env2 = compareEnv.env1, compareEnv.env2
+        currentDb: Optional[str] = None
+
+        while True:
+            keys = [key for envStreams in streams.values() for key in (s.peekKey() for s in envStreams) if key]
+            if not keys:
+                break
+            key = min(keys)
+            dbName = key[0]
+
+            if dbName != currentDb:
+                currentDb = dbName
+                compareEnv.propertyPool = {}
+                inEnv = {
+                    number: any(s.peekDatabase() == dbName for s in envStreams)
+                    for number, envStreams in streams.items()
+                }
+                if not inEnv[env1.number] or not inEnv[env2.number]:
+                    database = Database(dbName)
+                    database.presence = sum(1 << (number - 1) for number, isIn in inEnv.items() if isIn)
+                    yield {dbName: database}
+                    for envStreams in streams.values():
+                        for stream in envStreams:
+                            streamKey = stream.peekKey()
+                            while streamKey is not None and streamKey[0] == dbName:
+                                stream.takeGroup(streamKey)
+                                streamKey = stream.peekKey()
+                    continue
+
+            compareEnv.ddl = {}
+            for env in compareEnv.envs:
+                for stream in streams[env.number]:
+                    rows = stream.takeGroup(key)
+                    compareEnv.fillResult(env, stream.query, QueryResult(stream.description, rows))
+            compareEnv.fetchDefinitions()
+            # The database is in both environments, even if the table is only in one
+            for database in compareEnv.ddl.values():
+                database.presence = compareEnv.getAllEnvs()
+            yield compareEnv.ddl
+
+        compareEnv.closeExecutors()
+        compareEnv.ddl = {}
+        compareEnv.propertyPool = {}
+
+    # Text of the differences of an object, indented to depth
+    def renderDifference(self, diff: Difference, lvl: int, depth: int) -> str:
+        output = io.StringIO()
+        DiffRenderer(self.compareEnv, output).renderDifference(diff, lvl, ())
+        return self.indent(output.getvalue(), depth)
+
+    def iterDiffs(self):
+        compareEnv = self.compareEnv
+        currentDb: Optional[str] = None
+        dbHeaderPending = False
+
+        for ddl in self.iterModels():
+            dbName, database = next(iter(ddl.items()))
+            diffEngine = DiffEngine(compareEnv)
+            if not database.env1 or not database.env2:
+                dbDiff = diffEngine.diffItem(database, compareEnv.getAllEnvs(), diffEngine.rootScope)
+                if dbDiff is not None:
+                    yield self.renderDifference(dbDiff, 0, 0)
+                continue
+            scope = diffEngine.getTableScope(database, compareEnv.getAllEnvs())
+            if scope is None:
+                continue
+            if dbName != currentDb:
+                currentDb = dbName
+                dbHeaderPending = True
+
+            table = next(iter(database.tables.values()))
+            with compareEnv.timePhase("diff"):
+                tableDiff = diffEngine.diffItem(table, compareEnv.getAllEnvs(), scope)
+            if tableDiff is not None:
+                if dbHeaderPending:
+                    yield self.getDbHeader(dbName) + self.indent("\ntables", 1)
+                    dbHeaderPending = False
+                with compareEnv.timePhase("render"):
+                    tableText = self.renderDifference(tableDiff, 1, 2)
+                yield tableText
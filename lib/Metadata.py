@@ -0,0 +1,142 @@
+from typing import Dict, Optional, Tuple
+
+
+class MetaObject(object):
+    """Object found in one or several of the compared environments. Bit i of presence is set when the environment of
+    index i holds the object, and properties has the property tuple of each environment, None where it has none.
+    Property tuples follow the order of the property names registered for the granularity in
+    CompareEnv.propertySchemas"""
+
+    __slots__ = ("name", "presence", "properties")
+
+    granularity = ""
+    typeName = ""
+    children: Tuple[str, ...] = ()
+
+    def __init__(self, name: str):
+        self.name = name
+        self.presence = 0
+        self.properties: Tuple[Optional[tuple], ...] = ()
+
+    def isIn(self, index: int) -> bool:
+        return self.presence >> index & 1 == 1
+
+    def getProperties(self, index: int) -> Optional[tuple]:
+        return self.properties[index] if index < len(self.properties) else None
+
+    # Sides of a comparison of two environments
+    @property
+    def env1(self) -> bool:
+        return self.presence & 1 == 1
+
+    @property
+    def env2(self) -> bool:
+        return self.presence & 2 == 2
+
+    @property
+    def env1Properties(self) -> Optional[tuple]:
+        return self.getProperties(0)
+
+    @property
+    def env2Properties(self) -> Optional[tuple]:
+        return self.getProperties(1)
+
+
+class Column(MetaObject):
+    __slots__ = ()
+
+    granularity = "col"
+    typeName = "column"
+
+
+class ConstraintColumn(MetaObject):
+    __slots__ = ()
+
+    granularity = "constraintColumns"
+    typeName = "constraint_column"
+
+
+class IndexColumn(MetaObject):
+    __slots__ = ()
+
+    granularity = "indexColumns"
+    typeName = "index_column"
+
+
+class Constraint(MetaObject):
+    __slots__ = ("columns", "signature")
+
+    granularity = "constraint"
+    typeName = "constraint"
+    children = ("columns",)
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.columns: Dict[str, ConstraintColumn] = {}
+        # Definition in the first environment holding the foreign key, to pair the unnamed ones
+        self.signature: Optional[str] = None
+
+
+class Index(MetaObject):
+    __slots__ = ("columns", "signature")
+
+    granularity = "indices"
+    typeName = "index"
+    children = ("columns",)
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.columns: Dict[str, IndexColumn] = {}
+        # Definition in the first environment holding the index, to pair the unnamed ones
+        self.signature: Optional[str] = None
+
+
+# Text of a view, macro, procedure or join index, named by its kind (VIEW, MACRO, PROCEDURE, JOIN INDEX)
+class Definition(MetaObject):
+    __slots__ = ()
+
+    granularity = "definition"
+    typeName = "definition"
+
+
+# Space used by a table on the AMPs and whether statistics are collected on it, compared within the thresholds of
+# the property rules
+class Space(MetaObject):
+    __slots__ = ()
+
+    granularity = "space"
+    typeName = "space"
+
+
+class Table(MetaObject):
+    __slots__ = ("columns", "constraints", "indices", "definitions", "space")
+
+    granularity = "table"
+    typeName = "table"
+    children = ("columns", "constraints", "indices", "definitions", "space")
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.columns: Dict[str, Column] = {}
+        self.constraints: Dict[str, Constraint] = {}
+        self.indices: Dict[str, Index] = {}
+        self.definitions: Dict[str, Definition] = {}
+        self.space: Dict[str, Space] = {}
+
+
+class Database(MetaObject):
+    __slots__ = ("tables",)
+
+    typeName = "database"
+    children = ("tables",)
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.tables: Dict[str, Table] = {}
+
+
+# Type name of the objects of each granularity, used by the property rules and the jsonl records
+TYPE_NAMES = {
+    cls.granularity: cls.typeName
+    for cls in (Table, Column, Constraint, ConstraintColumn, Index, IndexColumn, Definition, Space)
+}
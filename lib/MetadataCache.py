@@ -0,0 +1,67 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Collection, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from lib.CompareEnv import QueryResult
+
+CacheKey = Tuple[str, str, str]
+
+
+class MetadataCache(object):
+    """Query results of the daemon, by environment, granularity and physical database, kept for ttl seconds. The
+    results hold all the tables allowed by the table rules, the table filter of each comparison is applied on the
+    rows."""
+
+    def __init__(self, ttl: float = 900):
+        self.ttl = ttl
+        self.entries: Dict[CacheKey, Tuple[float, "QueryResult"]] = {}
+        self.lock = threading.Lock()
+        # Comparisons missing the same results wait for the first one to query them
+        self.loadLocks: Dict[Tuple[str, str, str], threading.Lock] = {}
+
+    def get(self, key: CacheKey) -> Optional["QueryResult"]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: CacheKey, res: "QueryResult"):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), res)
+
+    # The applications of a batch extract the same environment without waiting for each other
+    def getLoadLock(self, envName: str, app: str, granularity: str) -> threading.Lock:
+        with self.lock:
+            return self.loadLocks.setdefault((envName, app, granularity), threading.Lock())
+
+    # Drop the results of one environment, or of all of them, restricted to some physical databases if dbNames is
+    # set. Returns the number of results dropped
+    def invalidate(self, envName: Optional[str] = None, dbNames: Optional[Collection[str]] = None) -> int:
+        with self.lock:
+            keys = [
+                key
+                for key in self.entries
+                if (envName is None or key[0] == envName) and (dbNames is None or key[2] in dbNames)
+            ]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    # Number of results and age in seconds of the oldest one, by environment
+    def getStatus(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        status: Dict[str, Dict] = {}
+        with self.lock:
+            for (envName, granularity, db), (loadTime, res) in self.entries.items():
+                if now - loadTime > self.ttl:
+                    continue
+                envStatus = status.setdefault(envName, {"results": 0, "rows": 0, "age": 0})
+                envStatus["results"] += 1
+                envStatus["rows"] += len(res.rows)
+                envStatus["age"] = max(envStatus["age"], round(now - loadTime))
+        return status
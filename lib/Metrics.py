@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class QueryMetrics(object):
+    """Totals of the queries of one granularity in one environment"""
+
+    __slots__ = (
+        "queries",
+        "seconds",
+        "firstRowSeconds",
+        "fetchSeconds",
+        "rows",
+        "bytes",
+        "buildSeconds",
+        "keptRows",
+        "discardedRows",
+    )
+
+    def __init__(self):
+        self.queries = 0
+        # From the execute to the last row: the time to the first row is the execute, then the rows are fetched
+        self.seconds = 0.0
+        self.firstRowSeconds = 0.0
+        self.fetchSeconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        # Time spent in fillArray, and rows kept or rejected by the table rules
+        self.buildSeconds = 0.0
+        self.keptRows = 0
+        self.discardedRows = 0
+
+    def toDict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Metrics(object):
+    """Time and volume of each step of a comparison, by environment and query granularity, written as JSON or as a
+    Prometheus textfile. The queries run in several threads, the totals are updated under a lock."""
+
+    prefix = "teradata_env_compare"
+
+    def __init__(self, app: str, envNames: List[str]):
+        self.app = app
+        self.envNames = envNames
+        self.startTime = datetime.now(timezone.utc)
+        self.logons: Dict[str, Tuple[int, float]] = {}
+        self.queries: Dict[Tuple[str, str], QueryMetrics] = {}
+        self.phases: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def getQueryMetrics(self, envName: str, granularity: str) -> QueryMetrics:
+        key = (envName, granularity)
+        if key not in self.queries:
+            self.queries[key] = QueryMetrics()
+        return self.queries[key]
+
+    def addLogon(self, envName: str, seconds: float):
+        with self.lock:
+            count, total = self.logons.get(envName, (0, 0.0))
+            self.logons[envName] = (count + 1, total + seconds)
+
+    # Approximate size of fetched rows: length of the strings, 8 bytes for the other values
+    def getSize(self, rows: List) -> int:
+        return sum(len(value) if isinstance(value, str) else 8 for row in rows for value in row)
+
+    def addQuery(
+        self, envName: str, granularity: str, firstRowSeconds: float, fetchSeconds: float, rowCount: int, size: int
+    ):
+        with self.lock:
+            queryMetrics = self.getQueryMetrics(envName, granularity)
+            queryMetrics.queries += 1
+            queryMetrics.seconds += firstRowSeconds + fetchSeconds
+            queryMetrics.firstRowSeconds += firstRowSeconds
+            queryMetrics.fetchSeconds += fetchSeconds
+            queryMetrics.rows += rowCount
+            queryMetrics.bytes += size
+
+    def addBuild(self, envName: str, granularity: str, seconds: float, keptRows: int, discardedRows: int):
+        with self.lock:
+            queryMetrics = self.getQueryMetrics(envName, granularity)
+            queryMetrics.buildSeconds += seconds
+            queryMetrics.keptRows += keptRows
+            queryMetrics.discardedRows += discardedRows
+
+    # Time of a phase of the comparison (extract, diff, render), added up over the databases of the pipeline
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def toDict(self) -> Dict:
+        return {
+            "app": self.app,
+            "environments": self.envNames,
+            "startTime": self.startTime.isoformat(),
+            "phases": self.phases,
+            "logons": {
+                envName: {"sessions": count, "seconds": total} for envName, (count, total) in self.logons.items()
+            },
+            "queries": [
+                dict({"env": envName, "granularity": granularity}, **queryMetrics.toDict())
+                for (envName, granularity), queryMetrics in self.queries.items()
+            ],
+        }
+
+    def toPrometheus(self) -> str:
+        app = self.escapeLabel(self.app)
+        lines = self.getMetricLines(
+            "start_time_seconds", "Start of the comparison", [(f'app="{app}"', self.startTime.timestamp())]
+        )
+        lines += self.getMetricLines(
+            "phase_seconds",
+            "Time of each phase of the comparison",
+            [(f'app="{app}",phase="{self.escapeLabel(name)}"', seconds) for name, seconds in self.phases.items()],
+        )
+
+        envLabels = {envName: f'app="{app}",env="{self.escapeLabel(envName)}"' for envName in self.envNames}
+        logons = self.logons.items()
+        lines += self.getMetricLines("logons", "Sessions opened", [(envLabels[env], n) for env, (n, _) in logons])
+        lines += self.getMetricLines(
+            "logon_seconds", "Time of the logons", [(envLabels[env], total) for env, (_, total) in logons]
+        )
+
+        # fmt: off
+        queryMetrics = (
+            ("queries",           "queries",         "DBC queries run"),
+            ("query_seconds",     "seconds",         "Time of the DBC queries, from the execute to the last row"),
+            ("first_row_seconds", "firstRowSeconds", "Time of the DBC queries to the first row"),
+            ("fetch_seconds",     "fetchSeconds",    "Time of the transfer of the rows"),
+            ("fetched_rows",      "rows",            "Rows fetched"),
+            ("fetched_bytes",     "bytes",           "Approximate size of the values fetched"),
+            ("build_seconds",     "buildSeconds",    "Time spent to add the rows to the model"),
+            ("kept_rows",         "keptRows",        "Rows added to the model"),
+            ("discarded_rows",    "discardedRows",   "Rows rejected by the table rules"),
+        )
+        # fmt: on
+        for name, attribute, description in queryMetrics:
+            samples = [
+                (f'{envLabels[envName]},granularity="{self.escapeLabel(granularity)}"', getattr(metrics, attribute))
+                for (envName, granularity), metrics in self.queries.items()
+            ]
+            lines += self.getMetricLines(name, description, samples)
+
+        return "\n".join(lines) + "\n"
+
+    # Gauges, the textfile is written again by each comparison
+    def getMetricLines(self, name: str, description: str, samples: List[Tuple[str, float]]) -> List[str]:
+        lines = [f"# HELP {self.prefix}_{name} {description}", f"# TYPE {self.prefix}_{name} gauge"]
+        return lines + [f"{self.prefix}_{name}{{{labels}}} {value}" for labels, value in samples]
+
+    def escapeLabel(self, value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    # The Prometheus textfile is replaced at once, the collector never reads a partial file
+    def save(self, jsonPath: Optional[str], prometheusPath: Optional[str]):
+        if jsonPath:
+            Path(jsonPath).write_text(json.dumps(self.toDict(), indent=4) + "\n")
+        if prometheusPath:
+            tmpPath = Path(f"{prometheusPath}.{os.getpid()}.tmp")
+            tmpPath.write_text(self.toPrometheus())
+            os.replace(tmpPath, prometheusPath)
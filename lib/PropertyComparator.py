@@ -0,0 +1,161 @@
+import re
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lib.DatabaseConfig import PropertyRule, PropertyRules
+from lib.Metadata import TYPE_NAMES
+
+DEFAULT_RULES = [
+    # Dates with the default format of the system, displayed as YY/MM/DD
+    PropertyRule(property="ColumnFormat", equivalent=["YY/MM/DD", "YYYY-MM-DD"]),
+    # Tables 10 times bigger, or twice as skewed, than in another environment
+    PropertyRule(property="CurrentPerm", objects=["space"], tolerance=0.9),
+    PropertyRule(property="AmpSkew", objects=["space"], tolerance=0.5),
+]
+
+# Names of the -ip option that are not property names
+PROPERTY_ALIASES = {"comments": "CommentString"}
+
+PropertyDiffs = Tuple[Tuple[str, tuple], ...]
+
+
+class PropertyComparator(object):
+    """Property rules of the config file and properties ignored with -ip. The rules are compiled once for the
+    property order of each granularity into a function comparing the property tuples of the environments, the
+    rules are not looked up again for each object."""
+
+    def __init__(self, rules: PropertyRules, ignoreProperties: Optional[List[str]] = None):
+        self.rules = (DEFAULT_RULES if rules.defaultRules else []) + rules.rules
+        for name in ignoreProperties or []:
+            if name != "":
+                self.rules.append(PropertyRule(property=PROPERTY_ALIASES.get(name.lower(), name), ignore=True))
+        self.normalizers: Dict[Tuple[str, str], Optional[Callable]] = {}
+        self.equivalents: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self.comparators: Dict[Tuple[str, Tuple[str, ...]], Callable[[List[tuple]], PropertyDiffs]] = {}
+
+    def getRules(self, typeName: str, propName: str) -> List[PropertyRule]:
+        return [
+            rule
+            for rule in self.rules
+            if rule.property.lower() == propName.lower() and (not rule.objects or typeName in rule.objects)
+        ]
+
+    def isIgnored(self, typeName: str, propName: str) -> bool:
+        return any(rule.ignore for rule in self.getRules(typeName, propName))
+
+    # Function giving the value compared in place of a value of the property, None if the values are compared as
+    # they are. The regular expressions are replaced first, then the equivalent values, then the case is ignored.
+    def getNormalizer(self, typeName: str, propName: str) -> Optional[Callable]:
+        key = (typeName, propName)
+        if key not in self.normalizers:
+            self.normalizers[key] = self.compileNormalizer(typeName, propName)
+        return self.normalizers[key]
+
+    # First value of the list of each equivalent value, by upper case value. The first value itself is compared as it
+    # is, with its case.
+    def getEquivalents(self, typeName: str, propName: str) -> Dict[str, str]:
+        key = (typeName, propName)
+        if key not in self.equivalents:
+            self.equivalents[key] = {}
+            for rule in self.getRules(typeName, propName):
+                for value in rule.equivalent[1:]:
+                    self.equivalents[key].setdefault(value.upper(), rule.equivalent[0])
+        return self.equivalents[key]
+
+    # Value shown for a value of the property: the first value of its equivalent values, as it is compared
+    def getDisplayValue(self, typeName: str, propName: str, value):
+        equivalents = self.getEquivalents(typeName, propName)
+        if not equivalents or not isinstance(value, str):
+            return value
+        return equivalents.get(value.upper(), value)
+
+    def compileNormalizer(self, typeName: str, propName: str) -> Optional[Callable]:
+        rules = self.getRules(typeName, propName)
+        substitutions = [(re.compile(rule.regex), rule.replace) for rule in rules if rule.regex is not None]
+        equivalents = self.getEquivalents(typeName, propName)
+        ignoreCase = any(rule.ignoreCase for rule in rules)
+        if not substitutions and not equivalents and not ignoreCase:
+            return None
+
+        def normalize(value):
+            if value is None:
+                return None
+            text = value if isinstance(value, str) else str(value)
+            for regex, replace in substitutions:
+                text = regex.sub(replace, text)
+            text = equivalents.get(text.upper(), text)
+            return text.upper() if ignoreCase else text
+
+        return normalize
+
+    def getComparator(self, granularity: str, schema: Tuple[str, ...]) -> Callable[[List[tuple]], PropertyDiffs]:
+        key = (granularity, schema)
+        if key not in self.comparators:
+            self.comparators[key] = self.compile(TYPE_NAMES.get(granularity, granularity), schema)
+        return self.comparators[key]
+
+    # Share of the biggest value that two numbers of the property may differ by, the one of the last rule setting it
+    def getTolerance(self, typeName: str, propName: str) -> Optional[float]:
+        tolerances = [rule.tolerance for rule in self.getRules(typeName, propName) if rule.tolerance is not None]
+        return tolerances[-1] if tolerances else None
+
+    def compile(self, typeName: str, schema: Tuple[str, ...]) -> Callable[[List[tuple]], PropertyDiffs]:
+        properties = tuple(
+            (position, propName, self.getNormalizer(typeName, propName), self.getTolerance(typeName, propName))
+            for position, propName in enumerate(schema)
+            if not self.isIgnored(typeName, propName)
+        )
+
+        # Name and values of the properties that differ, the values in the order of the property tuples
+        def compare(sides: List[tuple]) -> PropertyDiffs:
+            columns = tuple(zip(*sides))
+            diffs = []
+            for position, propName, normalize, tolerance in properties:
+                values = columns[position]
+                if values.count(values[0]) == len(values):
+                    continue
+                if normalize is not None and len(set(map(normalize, values))) == 1:
+                    continue
+                if tolerance is not None and isWithinTolerance(values, tolerance):
+                    continue
+                diffs.append((propName, values))
+            return tuple(diffs)
+
+        return compare
+
+    # SQL expression normalizing a column like getNormalizer, None if the property is ignored. The regular
+    # expressions are given to REGEXP_REPLACE as they are.
+    def getSqlValue(self, typeName: str, column: str, expression: Optional[str] = None) -> Optional[str]:
+        rules = self.getRules(typeName, column)
+        if any(rule.ignore for rule in rules):
+            return None
+
+        sql = expression or column
+        for rule in rules:
+            if rule.regex is not None:
+                sql = (
+                    f"REGEXP_REPLACE({sql}, {self.getSqlString(rule.regex)}, {self.getSqlString(rule.replace)}, 1, 0)"
+                )
+        equivalents = [rule.equivalent for rule in rules if len(rule.equivalent) > 1]
+        if equivalents:
+            cases = "".join(
+                f" when upper({sql}) in ({', '.join(self.getSqlString(value.upper()) for value in values[1:])})"
+                f" then {self.getSqlString(values[0])}"
+                for values in equivalents
+            )
+            sql = f"case{cases} else {sql} end"
+        if any(rule.ignoreCase for rule in rules):
+            sql = f"upper({sql})"
+        return sql
+
+    def getSqlString(self, value: str) -> str:
+        return "'" + value.replace("'", "''") + "'"
+
+
+# Numbers whose difference is at most tolerance times the biggest absolute value. A null or a value that is not a
+# number is never within the tolerance of another value.
+def isWithinTolerance(values: tuple, tolerance: float) -> bool:
+    if not all(isinstance(value, (int, float, Decimal)) for value in values):
+        return False
+    numbers = [float(value) for value in values]
+    return max(numbers) - min(numbers) <= tolerance * max(map(abs, numbers))
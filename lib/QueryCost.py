@@ -0,0 +1,41 @@
+import re
+from typing import Optional
+
+
+def parseNumber(text: str) -> int:
+    return int(text.replace(",", ""))
+
+
+class QueryCost(object):
+    """Estimates of Teradata for one query, read from the text of its EXPLAIN"""
+
+    def __init__(self, envName: str, granularity: str, explanation: str):
+        self.envName = envName
+        self.granularity = granularity
+        # Sentences are cut across the rows of the explain
+        self.explanation = " ".join(explanation.split())
+
+        spools = re.findall(
+            r"size of Spool (\d+) is estimated with [\w ]+? confidence to be ([\d,]+) rows? \(\s*([\d,]+) bytes\)",
+            self.explanation,
+        )
+        self.spoolBytes = max((parseNumber(size) for _, _, size in spools), default=None)
+
+        # Rows of the spool returned to the client
+        self.rows: Optional[int] = None
+        result = re.findall(r"contents of Spool (\d+) are sent back to the user", self.explanation)
+        for spool, rows, _ in spools:
+            if not result or spool == result[-1]:
+                self.rows = parseNumber(rows)
+
+        # "0.05 seconds", or "1 hour and 5 minutes" on long estimates
+        total = re.search(r"total estimated time is (.+?)\.(?:\s|$)", self.explanation)
+        self.time = total.group(1) if total else None
+
+    def getLabel(self) -> str:
+        return f"{self.envName}:{self.granularity}"
+
+    def format(self, labelWidth: int = 0) -> str:
+        rows = f"{self.rows:,}" if self.rows is not None else "?"
+        spool = f"{self.spoolBytes:,} bytes" if self.spoolBytes is not None else "?"
+        return f"{self.getLabel():<{labelWidth}}   rows: {rows:>12}   spool: {spool:>18}   time: {self.time or '?'}"
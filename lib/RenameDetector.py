@@ -0,0 +1,93 @@
+import zlib
+from typing import Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
+
+from lib.Metadata import MetaObject
+
+
+class RenameDetector(object):
+    """Pairs the objects found in some of the compared environments only with the most similar objects found in the
+    others, as renamed objects. The features of an object are the trigrams of its name, its properties and the
+    names and properties of its children, and its similarity to another object is the Jaccard index of their
+    features. Each object is summarized by a MinHash signature of its features, cut in bands: only the objects
+    sharing a band are compared, instead of every pair of objects. The signature is computed with one hash of each
+    feature, spread over the bins of the signature, each bin keeping its minimum."""
+
+    binCount = 32
+    bandSize = 2
+    # Bigger buckets are skipped, like the identical tables of a generated schema, which would be compared by pairs
+    maxBucketSize = 100
+
+    def __init__(self, propertySchemas: Dict[str, Tuple[str, ...]], minSimilarity: float):
+        self.propertySchemas = propertySchemas
+        self.minSimilarity = minSimilarity
+
+    def getFeatures(self, obj: MetaObject) -> FrozenSet[str]:
+        # Definition in the first environment holding the object
+        envIndex = (obj.presence & -obj.presence).bit_length() - 1
+        name = obj.name.upper()
+        features = {"name " + name[i : i + 3] for i in range(max(1, len(name) - 2))}
+        schema = self.propertySchemas.get(obj.granularity, ())
+        features.update(f"{propName} {value}" for propName, value in zip(schema, obj.getProperties(envIndex) or ()))
+        for kind in obj.children:
+            for childName, child in getattr(obj, kind).items():
+                features.add(f"{kind} {childName}")
+                features.add(f"{kind} {childName} {child.getProperties(envIndex)}")
+        return frozenset(features)
+
+    # The hash does not depend on the process, the pairs found are the same in every run
+    def getSignature(self, features: FrozenSet[str]) -> Tuple[Tuple[int, int], ...]:
+        bins: List[Optional[int]] = [None] * self.binCount
+        for feature in features:
+            value, position = divmod(zlib.crc32(feature.encode()), self.binCount)
+            binValue = bins[position]
+            if binValue is None or value < binValue:
+                bins[position] = value
+        # An empty bin takes the value of the next bin holding one, with its distance, so that two objects agree on
+        # it as often as on the other bins
+        signature = []
+        for position in range(self.binCount):
+            distance = 0
+            while bins[(position + distance) % self.binCount] is None:
+                distance += 1
+            signature.append((distance, bins[(position + distance) % self.binCount]))
+        return tuple(signature)
+
+    # Pairs of keys of objects found in disjoint environments of envMask, with their similarity. Each object is
+    # paired once, with its most similar object.
+    def findRenames(self, objects: Mapping[str, MetaObject], envMask: int) -> List[Tuple[str, str, float]]:
+        orphans = [(key, obj) for key, obj in objects.items() if envMask & obj.presence and envMask & ~obj.presence]
+        if len(orphans) < 2:
+            return []
+
+        features = [self.getFeatures(obj) for _, obj in orphans]
+        buckets: Dict[tuple, List[int]] = {}
+        for i, objFeatures in enumerate(features):
+            signature = self.getSignature(objFeatures)
+            for band in range(0, self.binCount, self.bandSize):
+                buckets.setdefault((band, signature[band : band + self.bandSize]), []).append(i)
+
+        candidates: Set[Tuple[int, int]] = set()
+        for members in buckets.values():
+            if len(members) < 2 or len(members) > self.maxBucketSize:
+                continue
+            for position, i in enumerate(members):
+                for j in members[position + 1 :]:
+                    if orphans[i][1].presence & orphans[j][1].presence & envMask == 0:
+                        candidates.add((i, j))
+
+        scores = []
+        for i, j in candidates:
+            common = len(features[i] & features[j])
+            similarity = common / (len(features[i]) + len(features[j]) - common)
+            if similarity >= self.minSimilarity:
+                scores.append((similarity, i, j))
+
+        renames = []
+        paired: Set[int] = set()
+        for similarity, i, j in sorted(
+            scores, key=lambda score: (-score[0], orphans[score[1]][0], orphans[score[2]][0])
+        ):
+            if i not in paired and j not in paired:
+                paired.update((i, j))
+                renames.append((orphans[i][0], orphans[j][0], similarity))
+        return renames
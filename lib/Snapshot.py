@@ -0,0 +1,212 @@
+import datetime
+import json
+import sqlite3
+import threading
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from lib.CompareEnv import QueryResult
+
+
+# JSON cannot carry the Decimal and timestamp values returned by teradatasql, tag them so that a
+# snapshot compares exactly like a live extraction
+def encodeValue(value):
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def decodeValue(value):
+    if isinstance(value, dict):
+        if "$decimal" in value:
+            return Decimal(value["$decimal"])
+        if "$datetime" in value:
+            return datetime.datetime.fromisoformat(value["$datetime"])
+        if "$date" in value:
+            return datetime.date.fromisoformat(value["$date"])
+    return value
+
+
+class SnapshotInfo(object):
+    def __init__(self, id: int, app: str, env: str, code: str, extractedAt: str, tableFilter: Optional[str]):
+        self.id = id
+        self.app = app
+        self.env = env
+        self.code = code
+        self.extractedAt = extractedAt
+        self.tableFilter = tableFilter
+
+
+class Snapshot(object):
+    """SQLite store of the rows extracted by CompareEnv.queries, one snapshot per app and environment"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Reads happen from the extraction thread pool, writes from the main thread
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.execute("pragma foreign_keys = on")
+            self.conn.executescript(
+                """
+                create table if not exists snapshot (
+                    id          integer primary key,
+                    app         text not null,
+                    env         text not null,
+                    code        text not null,
+                    extractedAt text not null,
+                    tableFilter text,
+                    unique (app, env)
+                );
+                create table if not exists snapshotQuery (
+                    snapshotId  integer not null references snapshot(id) on delete cascade,
+                    granularity text not null,
+                    description text not null,
+                    primary key (snapshotId, granularity)
+                );
+                create table if not exists snapshotRow (
+                    id           integer primary key,
+                    snapshotId   integer not null references snapshot(id) on delete cascade,
+                    granularity  text not null,
+                    databaseName text not null collate nocase,
+                    tableName    text not null collate nocase,
+                    data         text not null
+                );
+                create index if not exists snapshotRowIdx
+                    on snapshotRow (snapshotId, granularity, databaseName, tableName);
+                """
+            )
+
+    def getInfo(self, app: str, env: str) -> Optional[SnapshotInfo]:
+        with self.lock:
+            row = self.conn.execute(
+                "select id, app, env, code, extractedAt, tableFilter from snapshot where app = ? and env = ?",
+                (app, env),
+            ).fetchone()
+        return SnapshotInfo(*row) if row is not None else None
+
+    def getGranularities(self, snapshotId: int) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "select granularity from snapshotQuery where snapshotId = ?", (snapshotId,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # Replace the previous snapshot of the environment. The previous one is renamed with a trailing "~" and stays
+    # readable by id, for incremental refreshes, until commit() drops it
+    def create(self, app: str, env: str, code: str, tableFilter: Optional[str]) -> int:
+        extractedAt = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.conn.execute("delete from snapshot where app = ? and env = ?", (app, env + "~"))
+            self.conn.execute("update snapshot set env = env || '~' where app = ? and env = ?", (app, env))
+            cur = self.conn.execute(
+                "insert into snapshot (app, env, code, extractedAt, tableFilter) values (?, ?, ?, ?, ?)",
+                (app, env, code, extractedAt, tableFilter),
+            )
+        assert cur.lastrowid is not None
+        return cur.lastrowid
+
+    def append(self, snapshotId: int, granularity: str, res: QueryResult):
+        columns = [colDesc[0] for colDesc in res.description or []]
+        with self.lock:
+            self.conn.execute(
+                "insert or ignore into snapshotQuery (snapshotId, granularity, description) values (?, ?, ?)",
+                (snapshotId, granularity, json.dumps(columns)),
+            )
+            self.conn.executemany(
+                """
+                insert into snapshotRow (snapshotId, granularity, databaseName, tableName, data)
+                values (?, ?, ?, ?, ?)
+                """,
+                (
+                    (
+                        snapshotId,
+                        granularity,
+                        row["DatabaseName"].upper(),
+                        row["TableName"].upper(),
+                        json.dumps([encodeValue(row[col]) for col in columns]),
+                    )
+                    for row in res.rows
+                ),
+            )
+
+    def read(
+        self, snapshotId: int, granularity: str, dbNames: Iterable[str], tableFilter: Optional[str] = None
+    ) -> QueryResult:
+        dbNames = [db.upper() for db in dbNames]
+        sql = f"""
+            select data
+            from snapshotRow
+            where snapshotId = ?
+                and granularity = ?
+                and databaseName in ({",".join("?" * len(dbNames))})
+        """
+        params: List = [snapshotId, granularity, *dbNames]
+        if tableFilter:
+            patterns = tableFilter.split(",")
+            sql += f" and ({' or '.join(['tableName like ? escape ?'] * len(patterns))})"
+            for pattern in patterns:
+                params += [pattern, "\\"]
+        sql += " order by id"
+
+        with self.lock:
+            description = self.conn.execute(
+                "select description from snapshotQuery where snapshotId = ? and granularity = ?",
+                (snapshotId, granularity),
+            ).fetchone()
+            rows = self.conn.execute(sql, params).fetchall()
+
+        columns: List[str] = json.loads(description[0]) if description is not None else []
+        output: List[Dict] = []
+        for (data,) in rows:
+            output.append({col: decodeValue(value) for col, value in zip(columns, json.loads(data))})
+
+        return QueryResult([(col, None) for col in columns], output)
+
+    def commit(self):
+        with self.lock:
+            self.conn.execute("delete from snapshot where env like '%~'")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+TableKey = Tuple[str, str]
+
+
+class IncrementalRefresh(object):
+    """Tables of an environment whose cached metadata is stale, found by comparing the DBC.TablesV timestamps of
+    the database with the ones saved in the previous snapshot"""
+
+    def __init__(self, snapshot: Snapshot, snapshotId: int, cachedVersions: QueryResult, versions: QueryResult):
+        self.snapshot = snapshot
+        self.snapshotId = snapshotId
+        self.versions = versions
+
+        cached = {self.getKey(row): self.getVersion(row) for row in cachedVersions.rows}
+        current = {self.getKey(row): self.getVersion(row) for row in versions.rows}
+
+        self.changedTables: Set[TableKey] = {key for key, version in current.items() if cached.get(key) != version}
+        self.droppedTables: Set[TableKey] = set(cached.keys()) - set(current.keys())
+        # Tables whose foreign keys are stale, including parents of changed child tables. Set by CompareEnv
+        self.changedParentTables: Set[TableKey] = set(self.changedTables)
+
+    def getKey(self, row: Dict) -> TableKey:
+        return (row["DatabaseName"].upper(), row["TableName"].upper())
+
+    def getVersion(self, row: Dict):
+        return (row["CreateTimeStamp"], row["LastAlterTimeStamp"])
+
+    def getStaleTables(self, byChild: bool) -> Set[TableKey]:
+        return self.changedParentTables if byChild else self.changedTables
+
+    def isStale(self, row: Dict, byChild: bool) -> bool:
+        key = self.getKey(row)
+        return key in self.getStaleTables(byChild) or key in self.droppedTables
@@ -0,0 +1,76 @@
+import re
+from typing import Dict, List, Optional, Pattern
+
+from lib.DatabaseConfig import TableRule, TableRules
+
+# Partition, staging and error tables, and the backups suffixed with a timestamp
+DEFAULT_EXCLUSIONS = [
+    TableRule(regex="_P[0-9]{3}_S[0-9]{3}$"),
+    TableRule(regex="_[0-9]{8}$"),
+    TableRule(regex="_(1|2|ET)$"),
+    TableRule(regex="20[0-9]{6,12}$"),
+]
+
+
+def like2Regex(pattern: str) -> str:
+    regex = "^"
+    chars = iter(pattern)
+    for char in chars:
+        if char == "\\":
+            regex += re.escape(next(chars, "\\"))
+        elif char == "%":
+            regex += ".*"
+        elif char == "_":
+            regex += "."
+        else:
+            regex += re.escape(char)
+    return regex + "$"
+
+
+class TableFilter(object):
+    """Include and exclude rules on the table names. They are compiled into the where clause of the DBC queries, so
+    that the rejected tables are not transferred, and checked again on the rows read from a snapshot."""
+
+    def __init__(self, rules: TableRules, patterns: Optional[List[str]] = None):
+        # A table must match one rule of each group
+        self.includeGroups: List[List[TableRule]] = []
+        if rules.include:
+            self.includeGroups.append(rules.include)
+        if patterns:
+            self.includeGroups.append([TableRule(like=pattern) for pattern in patterns])
+
+        self.excludes = (DEFAULT_EXCLUSIONS if rules.defaultExclusions else []) + rules.exclude
+
+        self.includeRegexes = [[self.compileRule(rule) for rule in group] for group in self.includeGroups]
+        self.excludeRegexes = [self.compileRule(rule) for rule in self.excludes]
+        self.excludedTables: Dict[str, bool] = {}
+
+    def compileRule(self, rule: TableRule) -> Pattern:
+        if rule.like is not None:
+            return re.compile(like2Regex(rule.like), re.IGNORECASE | re.DOTALL)
+        return re.compile(rule.regex or "", re.IGNORECASE)
+
+    def getSqlRule(self, rule: TableRule, column: str, include: bool) -> str:
+        if rule.like is not None:
+            pattern = rule.like.replace("'", "''")
+            return f"{column} {'' if include else 'not '}like '{pattern}' escape '\\'"
+
+        pattern = (rule.regex or "").replace("'", "''")
+        return f"regexp_instr({column}, '{pattern}', 1, 1, 0, 'i') {'>' if include else '='} 0"
+
+    def getSqlCondition(self, column: str = "TableName") -> str:
+        sql = ""
+        for group in self.includeGroups:
+            sql += "\n                and (" + " or ".join(self.getSqlRule(rule, column, True) for rule in group) + ")"
+        for rule in self.excludes:
+            sql += "\n                and " + self.getSqlRule(rule, column, False)
+        return sql
+
+    def isExcluded(self, tbName: str) -> bool:
+        excluded = self.excludedTables.get(tbName)
+        if excluded is None:
+            excluded = any(regex.search(tbName) for regex in self.excludeRegexes) or not all(
+                any(regex.search(tbName) for regex in group) for group in self.includeRegexes
+            )
+            self.excludedTables[tbName] = excluded
+        return excluded
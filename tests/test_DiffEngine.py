@@ -0,0 +1,109 @@
+import itertools
+import unittest
+from typing import Dict, List, Sequence, Tuple
+
+from lib.CompareEnv import CompareEnv, Environment
+from lib.DatabaseConfig import ConfigFile, DatabaseConfig
+from lib.DiffEngine import DiffEngine
+from lib.Metadata import Constraint, Index, MetaObject, Table
+
+
+def getCompareEnv() -> CompareEnv:
+    conf = {
+        "app": "TEST",
+        "databaseNamePattern": "${env}_${db}",
+        "servers": [
+            {
+                "name": "test",
+                "host": "test",
+                "defaultUser": "test",
+                "defaultPassword": "test",
+                "environments": [{"name": "ENV1"}, {"name": "ENV2"}, {"name": "ENV3"}],
+            }
+        ],
+    }
+    compareEnv = CompareEnv(DatabaseConfig(ConfigFile(**conf)), [])
+    compareEnv.envNames = ["ENV1", "ENV2", "ENV3"]
+    compareEnv.dbSuffixList = ["DB"]
+    compareEnv.envs = [
+        Environment(name, compareEnv.dbCredentials, i + 1, "green", compareEnv.dbSuffixList)
+        for i, name in enumerate(compareEnv.envNames)
+    ]
+    compareEnv.env1, compareEnv.env2 = compareEnv.envs[0], compareEnv.envs[1]
+    return compareEnv
+
+
+# Unnamed object generated under its name in the environments of presence
+def getObject(cls, name: str, presence: int, signature: str):
+    obj = cls(name)
+    obj.presence = presence
+    obj.signature = signature
+    return obj
+
+
+class MatchSignaturesTest(unittest.TestCase):
+    """Unnamed foreign keys and indices named differently in each environment are paired on their definition"""
+
+    def setUp(self):
+        self.engine = DiffEngine(getCompareEnv())
+
+    def match(self, objects: Sequence[MetaObject], envMask: int) -> Dict[str, int]:
+        matched = self.engine.matchSignatures({obj.name: obj for obj in objects}, envMask)
+        return {key: obj.presence for key, obj in matched.items()}
+
+    def testSameSignatures(self):
+        # Two foreign keys of the same definition on each side, all of them are paired whatever the order
+        objects = [
+            getObject(Constraint, "FK_1", 1, "DB.CHILD(A=B)"),
+            getObject(Constraint, "FK_2", 1, "DB.CHILD(A=B)"),
+            getObject(Constraint, "FK_8", 2, "DB.CHILD(A=B)"),
+            getObject(Constraint, "FK_80", 2, "DB.CHILD(A=B)"),
+        ]
+        for permutation in itertools.permutations(objects):
+            self.assertEqual(self.match(list(permutation), 3), {"FK_1": 3, "FK_2": 3})
+
+    def testUnevenSides(self):
+        objects = [
+            getObject(Index, "IDX_1", 1, "PN(A)"),
+            getObject(Index, "IDX_2", 1, "PN(A)"),
+            getObject(Index, "IDX_3", 1, "PN(A)"),
+            getObject(Index, "IDX_8", 2, "PN(A)"),
+            getObject(Index, "IDX_9", 2, "PN(A)"),
+            getObject(Index, "IDX_10", 2, "SN(A)"),
+        ]
+        self.assertEqual(self.match(objects, 3), {"IDX_1": 3, "IDX_2": 3, "IDX_3": 1, "IDX_10": 2})
+
+    def testThreeEnvironments(self):
+        # An object paired in two environments is still paired with the one of the third
+        objects = [
+            getObject(Index, "IDX_1", 1, "PN(A)"),
+            getObject(Index, "IDX_2", 1, "PN(A)"),
+            getObject(Index, "IDX_5", 2, "PN(A)"),
+            getObject(Index, "IDX_6", 2, "PN(A)"),
+            getObject(Index, "IDX_8", 4, "PN(A)"),
+            getObject(Index, "IDX_9", 4, "PN(A)"),
+            getObject(Index, "IDX_0", 7, "PN(A)"),
+        ]
+        self.assertEqual(self.match(objects, 7), {"IDX_0": 7, "IDX_1": 7, "IDX_2": 7})
+
+    def testNoDifference(self):
+        table = Table("T")
+        table.presence = 3
+        for name, presence in (("FK_1", 1), ("FK_2", 1), ("FK_8", 2), ("FK_80", 2)):
+            table.constraints[name] = getObject(Constraint, name, presence, "DB.CHILD(A=B)")
+        self.assertIsNone(self.engine.diffItem(table, 3))
+
+
+def getRows(rows: List[Tuple]) -> List[Dict]:
+    return [dict(zip(("ColumnName", "ChildKeyColumn", "ChildDatabase", "ChildTable"), row)) for row in rows]
+
+
+class SignatureTest(unittest.TestCase):
+    def testConstraintSignature(self):
+        rows1 = getRows([("a", "b", "DB", "CHILD"), ("c", "d", "DB", "CHILD")])
+        rows2 = getRows([("C", "D", "db", "child"), ("A", "B", "db", "child")])
+        self.assertEqual(CompareEnv.getConstraintSignature(rows1), CompareEnv.getConstraintSignature(rows2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from lib.DatabaseConfig import PropertyRule, PropertyRules
+from lib.PropertyComparator import PropertyComparator
+
+
+class EquivalentTest(unittest.TestCase):
+    """The default rule compares and shows the dates YYYY-MM-DD as YY/MM/DD"""
+
+    def setUp(self):
+        self.comparator = PropertyComparator(PropertyRules())
+        self.compare = self.comparator.getComparator("col", ("ColumnFormat",))
+
+    def testEquivalentValues(self):
+        self.assertEqual(self.compare([("YYYY-MM-DD",), ("YY/MM/DD",)]), ())
+        self.assertEqual(self.compare([("yyyy-mm-dd",), ("YY/MM/DD",)]), ())
+
+    def testFirstValueKeepsItsCase(self):
+        self.assertEqual(
+            self.compare([("YYYY-MM-DD",), ("yy/mm/dd",)]), (("ColumnFormat", ("YYYY-MM-DD", "yy/mm/dd")),)
+        )
+
+    def testDisplayValue(self):
+        self.assertEqual(self.comparator.getDisplayValue("column", "ColumnFormat", "YYYY-MM-DD"), "YY/MM/DD")
+        self.assertEqual(self.comparator.getDisplayValue("column", "ColumnFormat", "X(10)"), "X(10)")
+        self.assertEqual(self.comparator.getDisplayValue("column", "CommentString", "YYYY-MM-DD"), "YYYY-MM-DD")
+
+    def testSqlValue(self):
+        comparator = PropertyComparator(
+            PropertyRules(defaultRules=False, rules=[PropertyRule(property="ColumnFormat", equivalent=["A", "b"])])
+        )
+        self.assertEqual(
+            comparator.getSqlValue("column", "ColumnFormat"),
+            "case when upper(ColumnFormat) in ('B') then 'A' else ColumnFormat end",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()